@@ -7,7 +7,7 @@ async function apiRequest(endpoint, method = 'GET', data = null) {
         }
     };
 
-    if (data && (method === 'POST' || method === 'PUT')) {
+    if (data && (method === 'POST' || method === 'PUT' || method === 'PATCH')) {
         options.body = JSON.stringify(data);
     }
 
@@ -74,11 +74,59 @@ async function registerOfficial(officialData) {
 }
 
 // Complaints Functions
-async function fetchComplaints(username) {
+// Returns one page: { complaints, total, next_cursor }. Pass next_cursor back as
+// options.cursor to get the following page; it is null on the last page. total is only
+// counted for the first page (null on later ones).
+// Other options: limit, sector, status, priority, from, to (dates), order ('asc' | 'desc'),
+// cluster (a duplicate cluster id from the dashboard).
+async function fetchComplaints(username, options = {}) {
     try {
-        return await apiRequest(API_CONFIG.ENDPOINTS.COMPLAINTS + `?username=${username}`);
+        const params = new URLSearchParams();
+        if (username) params.set('username', username);
+        Object.entries(options).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') params.set(key, value);
+        });
+        return await apiRequest(API_CONFIG.ENDPOINTS.COMPLAINTS + `?${params.toString()}`);
     } catch (error) {
-        return [];
+        return { success: false, complaints: [], total: 0, next_cursor: null };
+    }
+}
+
+// Officials only: counts by sector x status x priority, age buckets and the largest
+// duplicate clusters, optionally for one sector
+async function fetchOfficialDashboard(empId, sector = '') {
+    try {
+        const params = new URLSearchParams({ emp_id: empId });
+        if (sector) params.set('sector', sector);
+        return await apiRequest(API_CONFIG.ENDPOINTS.OFFICIAL_DASHBOARD + `?${params.toString()}`);
+    } catch (error) {
+        return null;
+    }
+}
+
+// Download link for a complaint export; filters as for fetchComplaints plus district,
+// format 'jsonl' (default) or 'csv'
+function complaintExportUrl(empId, filters = {}) {
+    const params = new URLSearchParams({ emp_id: empId });
+    Object.entries(filters).forEach(([key, value]) => {
+        if (value !== undefined && value !== null && value !== '') params.set(key, value);
+    });
+    return `${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.COMPLAINTS_EXPORT}?${params.toString()}`;
+}
+
+// Uploads a .jsonl or .csv File; resolves to { imported, skipped, errors }
+async function importComplaints(empId, file) {
+    try {
+        const format = file.name.toLowerCase().endsWith('.csv') ? 'csv' : 'jsonl';
+        const params = new URLSearchParams({ emp_id: empId, format });
+        const response = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.COMPLAINTS_IMPORT}?${params.toString()}`, {
+            method: 'POST',
+            headers: { 'Content-Type': format === 'csv' ? 'text/csv' : 'application/x-ndjson' },
+            body: file
+        });
+        return await response.json();
+    } catch (error) {
+        return { success: false, imported: 0, skipped: 0, errors: [] };
     }
 }
 
@@ -90,6 +138,28 @@ async function submitComplaint(complaintData) {
     }
 }
 
+// Officials only: Category 1 moves complaints to in_process/resolved,
+// Category 2 to verified/closed (or back to in_process)
+async function updateComplaintStatus(complaintId, status, empId, note = '') {
+    try {
+        return await apiRequest(`${API_CONFIG.ENDPOINTS.COMPLAINTS}/${complaintId}/status`, 'PATCH', {
+            status,
+            emp_id: empId,
+            note
+        });
+    } catch (error) {
+        return { success: false };
+    }
+}
+
+async function fetchComplaintHistory(complaintId) {
+    try {
+        return await apiRequest(`${API_CONFIG.ENDPOINTS.COMPLAINTS}/${complaintId}/history`);
+    } catch (error) {
+        return { success: false, events: [] };
+    }
+}
+
 // Location Functions
 async function getCurrentLocation() {
     try {
@@ -99,15 +169,77 @@ async function getCurrentLocation() {
     }
 }
 
+// Scheme Functions
+// Returns { schemes, total, state }; options: state, lat, lng, limit, prefix (false for whole words only)
+async function searchSchemesApi(query, options = {}) {
+    try {
+        const params = new URLSearchParams({ q: query || '' });
+        Object.entries(options).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') params.set(key, value === false ? '0' : value);
+        });
+        return await apiRequest(API_CONFIG.ENDPOINTS.SCHEME_SEARCH + `?${params.toString()}`);
+    } catch (error) {
+        return { success: false, schemes: [], total: 0 };
+    }
+}
+
+// Returns { schemes, state }; options: userId (personalises by state and family), state, lat, lng, limit
+async function recommendSchemesApi(query, options = {}) {
+    try {
+        const params = new URLSearchParams({ q: query || '' });
+        if (options.userId) params.set('user_id', options.userId);
+        ['state', 'lat', 'lng', 'limit'].forEach(key => {
+            if (options[key] !== undefined && options[key] !== null && options[key] !== '') params.set(key, options[key]);
+        });
+        return await apiRequest(API_CONFIG.ENDPOINTS.SCHEME_RECOMMEND + `?${params.toString()}`);
+    } catch (error) {
+        return { success: false, schemes: [] };
+    }
+}
+
 // Notifications Functions
-async function fetchNotifications(username) {
+// Returns { notifications, unread, next_before }; options: before (for the next page), limit, unread
+async function fetchNotifications(username, options = {}) {
     try {
-        return await apiRequest(API_CONFIG.ENDPOINTS.NOTIFICATIONS + `?username=${username}`);
+        const params = new URLSearchParams({ username });
+        Object.entries(options).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') params.set(key, value);
+        });
+        return await apiRequest(API_CONFIG.ENDPOINTS.NOTIFICATIONS + `?${params.toString()}`);
     } catch (error) {
         return [];
     }
 }
 
+// Omit ids to mark the whole inbox read
+async function markNotificationsRead(userId, ids = null) {
+    try {
+        const body = { user_id: userId };
+        if (ids) body.ids = ids;
+        return await apiRequest(API_CONFIG.ENDPOINTS.NOTIFICATIONS + '/read', 'POST', body);
+    } catch (error) {
+        return { success: false };
+    }
+}
+
+// Live updates instead of polling fetchComplaints/fetchNotifications. handlers.onComplaintStatus
+// and handlers.onNotification receive each event's record. The last event id is remembered
+// so a reload resumes where the previous page stopped. Returns the EventSource (call close()).
+function subscribeToUpdates(userId, handlers = {}) {
+    const storageKey = `digigov:lastEventId:${userId}`;
+    const params = new URLSearchParams({ user_id: userId });
+    const lastEventId = localStorage.getItem(storageKey);
+    if (lastEventId) params.set('last_event_id', lastEventId);
+    const source = new EventSource(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.STREAM}?${params.toString()}`);
+    const dispatch = handler => event => {
+        localStorage.setItem(storageKey, event.lastEventId);
+        if (handler) handler(JSON.parse(event.data));
+    };
+    source.addEventListener('complaint_status', dispatch(handlers.onComplaintStatus));
+    source.addEventListener('notification', dispatch(handlers.onNotification));
+    return source;
+}
+
 // Voice Processing Functions
 async function processVoiceInput(audioBlob) {
     try {
@@ -126,6 +258,51 @@ async function processVoiceInput(audioBlob) {
     }
 }
 
+// Streaming voice input: audio is sent in ~250 ms chunks while the user speaks and
+// onPartial({ text, partial }) fires as the server recognizes it.
+// Returns { stop } where stop() resolves to the final transcript (or null on failure).
+async function startVoiceStream(onPartial) {
+    const base = API_CONFIG.BASE_URL + API_CONFIG.ENDPOINTS.VOICE + '/stream';
+    const opened = await fetch(base, { method: 'POST' }).then(r => r.json()).catch(() => null);
+    if (!opened || !opened.success) return null;
+
+    const media = await navigator.mediaDevices.getUserMedia({ audio: true });
+    // The server expects 16 kHz mono 16-bit PCM; let the browser resample
+    const context = new AudioContext({ sampleRate: 16000 });
+    const source = context.createMediaStreamSource(media);
+    const processor = context.createScriptProcessor(4096, 1, 1);
+    let sending = Promise.resolve();
+
+    processor.onaudioprocess = (event) => {
+        const samples = event.inputBuffer.getChannelData(0);
+        const pcm = new Int16Array(samples.length);
+        for (let i = 0; i < samples.length; i++) {
+            const s = Math.max(-1, Math.min(1, samples[i]));
+            pcm[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
+        }
+        // Keep chunks in order
+        sending = sending.then(() => fetch(`${base}/${opened.stream_id}`, { method: 'POST', body: pcm.buffer })
+            .then(r => r.json())
+            .then(result => { if (result.success && onPartial) onPartial(result); })
+            .catch(error => console.error('Voice stream error:', error)));
+    };
+    source.connect(processor);
+    processor.connect(context.destination);
+
+    return {
+        stop: async () => {
+            processor.disconnect();
+            source.disconnect();
+            media.getTracks().forEach(track => track.stop());
+            await context.close();
+            await sending;
+            const result = await fetch(`${base}/${opened.stream_id}/finish`, { method: 'POST' })
+                .then(r => r.json()).catch(() => null);
+            return result && result.success ? result.transcript : null;
+        }
+    };
+}
+
 // Documents API
 async function listDocuments(userId) {
     try {
@@ -153,10 +330,59 @@ async function uploadDocumentApi(userId, file, type = '') {
     }
 }
 
+// Chunked upload that survives dropped connections: each chunk is retried, and after a
+// failure the server is asked how many bytes it already has before continuing.
+const UPLOAD_CHUNK_SIZE = 256 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+
+async function uploadDocumentResumable(userId, file, type = '', onProgress = null) {
+    const base = API_CONFIG.BASE_URL + API_CONFIG.ENDPOINTS.DOCUMENTS + '/uploads';
+    try {
+        const start = await fetch(base, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: userId, filename: file.name, type, size: file.size })
+        });
+        if (!start.ok) throw new Error('Upload failed');
+        let { upload } = await start.json();
+        let retries = 0;
+        while (upload.offset < upload.size) {
+            try {
+                const chunk = file.slice(upload.offset, upload.offset + UPLOAD_CHUNK_SIZE);
+                const res = await fetch(`${base}/${upload.id}?offset=${upload.offset}`, {
+                    method: 'PUT',
+                    body: chunk
+                });
+                if (!res.ok && res.status !== 409) throw new Error('Chunk failed');
+                // On 409 the server reports its offset and we continue from there
+                upload = (await res.json()).upload;
+                retries = 0;
+                if (onProgress) onProgress(upload.offset / upload.size);
+            } catch (e) {
+                if (++retries > UPLOAD_MAX_RETRIES) throw e;
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                const status = await fetch(`${base}/${upload.id}`);
+                if (status.ok) upload = (await status.json()).upload;
+            }
+        }
+        const done = await fetch(`${base}/${upload.id}/complete`, { method: 'POST' });
+        if (!done.ok) throw new Error('Upload failed');
+        return await done.json();
+    } catch (e) {
+        console.error('Upload error:', e);
+        return { success: false };
+    }
+}
+
 function documentViewUrl(docId) {
     return API_CONFIG.BASE_URL + API_CONFIG.ENDPOINTS.DOCUMENTS + `/${docId}/view`;
 }
 
+// size: 'thumbnail' (320px) or 'preview' (1280px); 404 until generated, so fall back to the view URL
+function documentThumbnailUrl(docId, size = 'thumbnail') {
+    return API_CONFIG.BASE_URL + API_CONFIG.ENDPOINTS.DOCUMENTS + `/${docId}/thumbnail?size=${size}`;
+}
+
 function documentDownloadUrl(docId) {
     return API_CONFIG.BASE_URL + API_CONFIG.ENDPOINTS.DOCUMENTS + `/${docId}/download`;
 }
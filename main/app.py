@@ -1,108 +1,159 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import os
+import sys
 import json
+import base64
+import datetime
+import hashlib
+import subprocess
+import threading
 import traceback
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask import send_file
 import mimetypes
 
 app = Flask(__name__)
+# Reverse proxies in front of the app (0 = clients connect directly). X-Forwarded-For is
+# only believed for that many hops from the right, so a client cannot claim another IP.
+PROXY_HOPS = int(os.environ.get('DIGIGOV_PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
 # Allow requests from any origin (useful when opening index.html from file:// or different ports)
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type"],
         "supports_credentials": False
     }
 })
 
-# Initialize users.json with proper structure
-if not os.path.exists('users.json'):
-    with open('users.json', 'w') as f:
-        json.dump({"users": {}, "officials": {}}, f, indent=4)
-else:
-    # Ensure required top-level keys exist
-    try:
-        with open('users.json', 'r') as f:
-            data = json.load(f)
-        changed = False
-        if "users" not in data:
-            data["users"] = {}
-            changed = True
-        if "officials" not in data:
-            data["officials"] = {}
-            changed = True
-        if changed:
-            with open('users.json', 'w') as f:
-                json.dump(data, f, indent=4)
-    except Exception:
-        with open('users.json', 'w') as f:
-            json.dump({"users": {}, "officials": {}}, f, indent=4)
-
-# Import other modules
+# Import other modules. Importing them has no side effects; recommend (numpy, and a
+# sentence-transformers model when configured) is imported on its first request.
+import storage
+import blobstore
+import previews
+import hashing
 import login
 import complaints
 import notifications
+import events
+import reminders
 import gps
-import voiceExtraction
-
-UPLOAD_DIR = 'uploads'
-DOCS_DB = 'documents.json'
-COMPLAINTS_DB = 'complaints.json'
+import geocoder
+import schemes
+import transcription
+import intents
+import metrics
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-if not os.path.exists(DOCS_DB):
-    with open(DOCS_DB, 'w') as f:
-        json.dump({"documents": []}, f, indent=4)
-if not os.path.exists(COMPLAINTS_DB):
-    with open(COMPLAINTS_DB, 'w') as f:
-        json.dump({"complaints": []}, f, indent=4)
-
-def load_documents():
-    try:
-        with open(DOCS_DB, 'r') as f:
-            return json.load(f)
-    except Exception:
-        return {"documents": []}
+# Let Werkzeug reject oversized multipart bodies while parsing (small allowance for form fields)
+app.config['MAX_CONTENT_LENGTH'] = blobstore.MAX_UPLOAD_BYTES + 64 * 1024
 
-def save_documents(data):
-    with open(DOCS_DB, 'w') as f:
-        json.dump(data, f, indent=4)
+# --- Startup ---
+# Importing this module only defines the routes. create_app() does the rest once per
+# process: directories, the database (and the one-time import of the legacy JSON files)
+# and the background workers. The speech model and scheme index are loaded on a
+# background thread, so a worker accepts requests while they warm up; a request that
+# needs one first waits for it.
+_init_lock = threading.Lock()
+_initialized = False
 
-def load_complaints():
-    try:
-        with open(COMPLAINTS_DB, 'r') as f:
-            return json.load(f)
-    except Exception:
-        return {"complaints": []}
+def _warm_up():
+    for step in (schemes.catalogue, transcription.start):
+        try:
+            step()
+        except Exception as e:
+            print('Warm-up error:', e)
+            traceback.print_exc()
 
-def save_complaints(data):
-    with open(COMPLAINTS_DB, 'w') as f:
-        json.dump(data, f, indent=4)
+def create_app(warm_up=True):
+    """The app, initialised for serving; safe to call more than once"""
+    global _initialized
+    with _init_lock:
+        if not _initialized:
+            blobstore.init_dirs()
+            # Per-function timings on /api/metrics; transaction() times the whole write
+            metrics.instrument(
+                storage,
+                metrics.public_functions(storage, skip={'get_connection', 'transaction', 'after_commit'}),
+                contexts=['transaction']
+            )
+            metrics.instrument(hashing, ['hash_password', 'check_password'])
+            metrics.register_collector(pool_metrics)
+            storage.init_db()
+            previews.start_workers()
+            notifications.start_workers()
+            reminders.start_scheduler()
+            if warm_up:
+                threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+            _initialized = True
+    return app
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok", "message": "Server is running"})
+    return jsonify({
+        "status": "ok",
+        "message": "Server is running",
+        "hashing": hashing.stats(),
+        "transcription": transcription.stats(),
+        "streams": events.stats()
+    })
+
+# --- Metrics ---
+# Prometheus scrape target; see metrics.py. Slow-request profiling is enabled with
+# DIGIGOV_PROFILE_SLOW_MS.
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def pool_metrics():
+    hashes, speech, streams = hashing.stats(), transcription.stats(), events.stats()
+    return [
+        ("digigov_bcrypt_in_flight", "gauge", "Password hashes running or queued", hashes["in_flight"]),
+        ("digigov_bcrypt_rejected_total", "counter", "Password hashes refused with 503", hashes["rejected"]),
+        ("digigov_stt_queue_depth", "gauge", "Voice clips waiting for a speech worker", speech["queue_depth"]),
+        ("digigov_stt_rejected_total", "counter", "Voice requests refused with 503", speech["rejected"]),
+        ("digigov_event_streams", "gauge", "Open server-sent event streams", streams["connections"]),
+    ]
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = metrics.RequestTimer()
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        # The route pattern, not the path, so ids in URLs don't multiply the series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        timer.finish(route, request.method, response.status_code,
+                     request.content_length, response.content_length)
+    return response
+
+@app.teardown_request
+def stop_request_timer(error=None):
+    # Requests that never reached after_request still release the profiler
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.close()
+
+def busy_response():
+    return jsonify({"success": False, "message": "Server is busy. Please try again shortly."}), 503
 
 @app.route('/api/register', methods=['POST'])
 def handle_register():
     try:
-        print("\n=== Registration Request ===")
-        print("Registration endpoint hit")
         data = request.get_json()
-        print("Received data:", data)
-        
         if not data:
-            print("Error: No data provided")
             return jsonify({"success": False, "message": "No data provided"}), 400
             
         # Validate required fields
         required_fields = ['name', 'phone', 'password', 'aadhaar']
         missing_fields = [field for field in required_fields if field not in data]
         if missing_fields:
-            print(f"Error: Missing fields: {missing_fields}")
             return jsonify({
                 "success": False,
                 "message": f"Missing required fields: {', '.join(missing_fields)}"
@@ -110,12 +161,16 @@ def handle_register():
         
         # Process registration
         result = login.register_user(data)
-        print("Registration result:", result)  # Debug print
+        if result.get("success") and result["user"].get("family"):
+            # Attendance and vaccination reminders for the children listed
+            reminders.schedule_user(result["user"])
         
         return jsonify(result)
+    except hashing.PoolBusy:
+        return busy_response()
     except Exception as e:
-        print("Registration error:", str(e))  # Debug print
-        traceback.print_exc()  # Print full error traceback
+        print("Registration error:", str(e))
+        traceback.print_exc()
         return jsonify({
             "success": False,
             "message": "Registration failed. Please try again."
@@ -133,6 +188,8 @@ def handle_login():
         
         result = login.verify_login(data['phone'], data['password'])
         return jsonify(result)
+    except hashing.PoolBusy:
+        return busy_response()
     except Exception as e:
         print("Login error:", str(e))
         return jsonify({
@@ -141,155 +198,708 @@ def handle_login():
         }), 500
 
 # Complaints API
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(key):
+    """Opaque page cursor for a (createdAt, id) key"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        created_at, complaint_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(created_at), int(complaint_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
 @app.route('/api/complaints', methods=['GET'])
 def list_complaints():
     try:
-        user_id = request.args.get('user_id') or request.args.get('username')
-        data = load_complaints()
-        items = data.get('complaints', [])
-        if user_id:
-            items = [c for c in items if str(c.get('userId')) == str(user_id) or str(c.get('username')) == str(user_id)]
-        return jsonify({"success": True, "complaints": items})
+        args = request.args
+        user_id = args.get('user_id') or args.get('username')
+        try:
+            limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            after = decode_cursor(args['cursor']) if args.get('cursor') else None
+        except (ValueError, TypeError):
+            return jsonify({"success": False, "complaints": [], "message": "Invalid limit or cursor"}), 400
+        items, total, next_after = storage.query_complaints(
+            user_id=user_id,
+            sector=args.get('sector'),
+            status=args.get('status'),
+            priority=args.get('priority'),
+            created_from=args.get('from'),
+            created_to=args.get('to'),
+            cluster_id=args.get('cluster', type=int),
+            order='desc' if args.get('order') == 'desc' else 'asc',
+            limit=limit,
+            after=after,
+        )
+        return jsonify({
+            "success": True,
+            "complaints": items,
+            "total": total,
+            "next_cursor": encode_cursor(next_after) if next_after else None
+        })
     except Exception as e:
         print('List complaints error:', e)
         return jsonify({"success": False, "complaints": []}), 500
 
+def parse_coordinates(lat, lng):
+    """(lat, lng) as floats, (None, None) when either is missing; ValueError if out of range"""
+    if lat is None or lng is None:
+        return None, None
+    if isinstance(lat, bool) or isinstance(lng, bool):
+        raise ValueError("lat and lng must be numbers")
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise ValueError("lat and lng must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat must be between -90 and 90 and lng between -180 and 180")
+    return lat, lng
+
 @app.route('/api/complaints', methods=['POST'])
 def create_complaint():
     try:
         data = request.get_json() or {}
         required = ['userId', 'sector', 'subject', 'description', 'location', 'priority']
-        missing = [k for k in required if not data.get(k)]
+        try:
+            lat, lng = parse_coordinates(data.get('lat'), data.get('lng'))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        has_coords = lat is not None
+        missing = [k for k in required if not data.get(k) and not (k == 'location' and has_coords)]
         if missing:
             return jsonify({"success": False, "message": f"Missing: {', '.join(missing)}"}), 400
-        store = load_complaints()
-        items = store.get('complaints', [])
-        new_id = (max([c.get('id', 0) for c in items]) + 1) if items else 1
-        record = {
-            "id": new_id,
-            "userId": data['userId'],
-            "sector": data['sector'],
-            "subject": data['subject'],
-            "description": data['description'],
-            "location": data['location'],
-            "priority": data['priority'],
-            "status": 'pending',
-            "createdAt": __import__('datetime').datetime.now().isoformat()
-        }
-        items.append(record)
-        store['complaints'] = items
-        save_complaints(store)
+        record = complaints.add_complaint(
+            data['userId'],
+            data['sector'],
+            data['subject'],
+            data['description'],
+            data.get('location', ''),
+            data['priority'],
+            lat=lat,
+            lng=lng
+        )
         return jsonify({"success": True, "complaint": record})
     except Exception as e:
         print('Create complaint error:', e)
         traceback.print_exc()
         return jsonify({"success": False, "message": "Failed to create complaint"}), 500
 
-# Notifications API (simple stub)
+def require_official(emp_id):
+    official = login.get_user_by_emp_id(emp_id) if emp_id else None
+    return official if official and official.get('role') == 'official' else None
+
+# Bulk export for district reports (officials only): JSON Lines, or CSV with ?format=csv.
+# Takes the filters of GET /api/complaints plus ?district=, and streams a page at a time.
+@app.route('/api/complaints/export', methods=['GET'])
+def export_complaints():
+    try:
+        args = request.args
+        if not require_official(args.get('emp_id')):
+            return jsonify({"success": False, "message": "Official not found"}), 403
+        fmt = args.get('format', 'jsonl')
+        if fmt not in complaints.EXPORT_FORMATS:
+            return jsonify({"success": False, "message": f"format must be one of {', '.join(complaints.EXPORT_FORMATS)}"}), 400
+        body = complaints.export_complaints(
+            fmt,
+            sector=args.get('sector'),
+            status=args.get('status'),
+            priority=args.get('priority'),
+            created_from=args.get('from'),
+            created_to=args.get('to'),
+            district=args.get('district')
+        )
+        filename = f"complaints-{datetime.date.today():%Y%m%d}.{fmt}"
+        return Response(body, mimetype=complaints.EXPORT_FORMATS[fmt], headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no'
+        })
+    except Exception as e:
+        print('Export complaints error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to export complaints"}), 500
+
+# Bulk import (officials only): the body is JSON Lines, or CSV with Content-Type text/csv or
+# ?format=csv, read line by line. Rows are validated and committed in batches; bad rows are
+# skipped and reported. One request is bounded by the upload size limit, so split larger
+# files or use `python complaints.py import`.
+@app.route('/api/complaints/import', methods=['POST'])
+def import_complaints():
+    try:
+        if not require_official(request.args.get('emp_id')):
+            return jsonify({"success": False, "message": "Official not found"}), 403
+        fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+        if fmt not in complaints.EXPORT_FORMATS:
+            return jsonify({"success": False, "message": f"format must be one of {', '.join(complaints.EXPORT_FORMATS)}"}), 400
+        lines = (line.decode('utf-8-sig') for line in request.stream)
+        rows = complaints.read_csv(lines) if fmt == 'csv' else complaints.read_jsonl(lines)
+        result = complaints.import_complaints(rows)
+        return jsonify({"success": True, **result})
+    except UnicodeDecodeError:
+        return jsonify({"success": False, "message": "File must be UTF-8"}), 400
+    except Exception as e:
+        print('Import complaints error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to import complaints"}), 500
+
+@app.route('/api/complaints/<int:complaint_id>/status', methods=['PATCH'])
+def update_complaint_status(complaint_id: int):
+    try:
+        data = request.get_json() or {}
+        missing = [k for k in ['status', 'emp_id'] if not data.get(k)]
+        if missing:
+            return jsonify({"success": False, "message": f"Missing: {', '.join(missing)}"}), 400
+        if not storage.get_complaint(complaint_id):
+            return jsonify({"success": False, "message": "Complaint not found"}), 404
+        result = complaints.update_complaint_status(
+            complaint_id, data['status'], data['emp_id'], data.get('note', '')
+        )
+        return jsonify(result), (200 if result["success"] else 400)
+    except Exception as e:
+        print('Update complaint status error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to update status"}), 500
+
+@app.route('/api/complaints/<int:complaint_id>/history', methods=['GET'])
+def complaint_history(complaint_id: int):
+    try:
+        if not storage.get_complaint(complaint_id):
+            return jsonify({"success": False, "events": [], "message": "Complaint not found"}), 404
+        return jsonify({"success": True, "events": complaints.get_complaint_history(complaint_id)})
+    except Exception as e:
+        print('Complaint history error:', e)
+        return jsonify({"success": False, "events": []}), 500
+
+# Official dashboard
+AGE_BUCKETS = [(1, '0-1 days'), (7, '2-7 days'), (30, '8-30 days')]
+OLDEST_BUCKET = '30+ days'
+CLUSTER_DAYS = 7
+
+def age_bucket(day, today):
+    try:
+        age = (today - datetime.date.fromisoformat(day)).days
+    except ValueError:
+        return OLDEST_BUCKET
+    return next((label for limit, label in AGE_BUCKETS if age <= limit), OLDEST_BUCKET)
+
+@app.route('/api/official/dashboard', methods=['GET'])
+def official_dashboard():
+    try:
+        # Same gate as the bulk export: the dashboard shows the same data in aggregate
+        if not require_official(request.args.get('emp_id')):
+            return jsonify({"success": False, "message": "Official not found"}), 403
+        sector_filter = request.args.get('sector')
+        today = datetime.date.today()
+        total = 0
+        by_sector = {}
+        by_status = {}
+        by_priority = {}
+        by_age = {}
+        # Counters are maintained on create/status change, so this never touches the complaints table
+        for sector, status, priority, day, count in storage.complaint_counts():
+            if sector_filter and sector != sector_filter:
+                continue
+            total += count
+            sector_entry = by_sector.setdefault(sector, {"total": 0, "by_status": {}})
+            sector_entry["total"] += count
+            cell = sector_entry["by_status"].setdefault(status, {})
+            cell[priority] = cell.get(priority, 0) + count
+            by_status[status] = by_status.get(status, 0) + count
+            by_priority[priority] = by_priority.get(priority, 0) + count
+            ages = by_age.setdefault(status, {})
+            bucket = age_bucket(day, today)
+            ages[bucket] = ages.get(bucket, 0) + count
+        return jsonify({
+            "success": True,
+            "total": total,
+            "by_sector": by_sector,
+            "by_status": by_status,
+            "by_priority": by_priority,
+            "age_buckets": by_age,
+            # Mass reports of the same incident, largest first; open one with /api/complaints?cluster=<id>
+            "clusters": storage.top_clusters(
+                sector_filter,
+                since=(today - datetime.timedelta(days=CLUSTER_DAYS)).isoformat()
+            )
+        })
+    except Exception as e:
+        print('Dashboard error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to load dashboard"}), 500
+
+# Notifications API: the user's inbox, newest first; pass next_before back as ?before=
 @app.route('/api/notifications', methods=['GET'])
 def get_notifications():
     try:
-        user_id = request.args.get('user_id') or 'anonymous'
-        notifs = [
-            {"id": 1, "title": "Welcome", "message": "Welcome to DigiGov!", "userId": user_id},
-            {"id": 2, "title": "Tips", "message": "You can upload important documents in Documents tab.", "userId": user_id}
-        ]
-        return jsonify({"success": True, "notifications": notifs})
+        user_id = request.args.get('user_id') or request.args.get('username')
+        if not user_id:
+            return jsonify({"success": False, "message": "user_id is required", "notifications": []}), 400
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        notifs, unread = notifications.inbox(
+            user_id,
+            limit=limit,
+            before=request.args.get('before', type=int),
+            unread_only=request.args.get('unread') in ('1', 'true')
+        )
+        return jsonify({
+            "success": True,
+            "notifications": notifs,
+            "unread": unread,
+            "next_before": notifs[-1]["id"] if len(notifs) == limit else None
+        })
     except Exception as e:
         print('Notifications error:', e)
+        traceback.print_exc()
         return jsonify({"success": False, "notifications": []}), 500
 
+@app.route('/api/notifications/read', methods=['POST'])
+def mark_notifications_read():
+    try:
+        data = request.get_json() or {}
+        if not data.get('user_id'):
+            return jsonify({"success": False, "message": "user_id is required"}), 400
+        ids = data.get('ids')
+        if ids is not None and not (isinstance(ids, list) and
+                                    all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+            return jsonify({"success": False, "message": "ids must be a list of notification ids"}), 400
+        # Without ids, everything in the inbox is marked read
+        updated = notifications.mark_read(data['user_id'], ids)
+        return jsonify({"success": True, "updated": updated})
+    except Exception as e:
+        print('Notifications read error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to update notifications"}), 500
+
+# Officials: queue one message for every citizen matching an audience filter
+# ({"state", "district", "parents"} or {"user_ids": [...]}). Returns as soon as it is queued.
+@app.route('/api/notifications/broadcast', methods=['POST'])
+def broadcast_notification():
+    try:
+        data = request.get_json() or {}
+        missing = [f for f in ('emp_id', 'title', 'message') if not data.get(f)]
+        if missing:
+            return jsonify({"success": False, "message": f"Missing required fields: {', '.join(missing)}"}), 400
+        official = login.get_user_by_emp_id(data['emp_id'])
+        if not official or official.get('role') != 'official':
+            return jsonify({"success": False, "message": "Official not found"}), 403
+        audience = data.get('audience') or {}
+        if not isinstance(audience, dict):
+            return jsonify({"success": False, "message": "audience must be an object"}), 400
+        job_id = notifications.broadcast(audience, data['title'], data['message'], sent_by=data['emp_id'])
+        return jsonify({"success": True, "job_id": job_id}), 202
+    except Exception as e:
+        print('Broadcast error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to queue broadcast"}), 500
+
+# Live updates (server-sent events): complaint status changes and new notifications for one
+# user. Browsers resend the last id they saw as Last-Event-ID when reconnecting; pass it as
+# ?last_event_id= to resume across page loads.
+@app.route('/api/stream', methods=['GET'])
+def event_stream():
+    try:
+        user_id = request.args.get('user_id') or request.args.get('username')
+        if not user_id:
+            return jsonify({"success": False, "message": "user_id is required"}), 400
+        last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_id = int(last_id) if last_id not in (None, '') else None
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid Last-Event-ID"}), 400
+        return Response(events.stream(user_id, last_id), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # Stop nginx from buffering the stream
+            'X-Accel-Buffering': 'no'
+        })
+    except events.TooManyStreams as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception as e:
+        print('Stream error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Failed to open event stream"}), 500
+
 # Location API
+def client_ip():
+    # ProxyFix (see PROXY_HOPS) has already replaced this with the forwarded address
+    return request.remote_addr
+
 @app.route('/api/location', methods=['GET'])
 def get_location():
     try:
-        coords = gps.get_location()
+        # Device GPS (?lat=&lng=) when the client has it, otherwise the client's IP
+        lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+        coords = (lat, lng) if lat is not None and lng is not None else gps.get_location(client_ip())
         if coords:
-            return jsonify({"success": True, "lat": coords[0], "lng": coords[1]})
+            place = geocoder.reverse_geocode(*coords) or {}
+            return jsonify({
+                "success": True,
+                "lat": coords[0],
+                "lng": coords[1],
+                "state": place.get("state"),
+                "district": place.get("district")
+            })
         return jsonify({"success": False, "message": "Location unavailable"}), 200
     except Exception as e:
         print('Location error:', e)
         return jsonify({"success": False, "message": "Failed to get location"}), 500
 
+# Scheme search: ?q= (the last word also matches as a prefix, for typeahead), optionally
+# restricted to one state by ?state= or by the state of ?lat=&lng=
+@app.route('/api/schemes/search', methods=['GET'])
+def search_schemes():
+    try:
+        query = request.args.get('q', '')
+        state = request.args.get('state')
+        lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+        if not state and lat is not None and lng is not None:
+            state = (geocoder.reverse_geocode(lat, lng) or {}).get('state')
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        prefix = request.args.get('prefix', '1') != '0'
+        results, total = schemes.search(query, state=state, limit=limit, prefix=prefix)
+        return jsonify({"success": True, "schemes": results, "total": total, "state": state})
+    except Exception as e:
+        print('Scheme search error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Scheme search failed"}), 500
+
+# Semantic recommendations, e.g. for a voice query that matched no scheme keywords.
+# ?q= is optional; with ?user_id= the user's state and family steer the results.
+@app.route('/api/schemes/recommend', methods=['GET'])
+def recommend_schemes():
+    import recommend
+    try:
+        query = request.args.get('q', '')
+        user_id = request.args.get('user_id')
+        user = login.get_user_by_id(user_id) if user_id else None
+        state = request.args.get('state')
+        lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+        if not state and lat is not None and lng is not None:
+            state = (geocoder.reverse_geocode(lat, lng) or {}).get('state')
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        results, state = recommend.recommend(query, user=user, state=state, limit=limit)
+        return jsonify({"success": True, "schemes": results, "state": state})
+    except recommend.Unavailable as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception as e:
+        print('Scheme recommendation error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Scheme recommendation failed"}), 500
+
 # Voice processing API (stub)
 @app.route('/api/voice', methods=['POST'])
 def process_voice():
     try:
         if 'audio' not in request.files:
             return jsonify({"success": False, "message": "No audio provided"}), 400
-        # For now, just return a placeholder transcript
-        return jsonify({"success": True, "transcript": "Transcription is not implemented in this demo."})
+        # {"transcript", "intent"}; intent names a home-screen block for spoken commands
+        result = transcription.transcribe(request.files['audio'].read())
+        return jsonify({"success": True, **result})
+    except (transcription.Unavailable, transcription.Busy) as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Could not read audio: {e}"}), 400
     except Exception as e:
         print('Voice error:', e)
         return jsonify({"success": False, "message": "Voice processing failed"}), 500
 
+# Streaming voice input: open a session, POST raw 16 kHz mono 16-bit PCM chunks as they are
+# recorded (each response carries the partial transcript), then finish for the final text.
+@app.route('/api/voice/stream', methods=['POST'])
+def open_voice_stream():
+    try:
+        return jsonify({"success": True, "stream_id": transcription.open_stream()})
+    except (transcription.Unavailable, transcription.Busy) as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception as e:
+        print('Voice stream error:', e)
+        return jsonify({"success": False, "message": "Voice processing failed"}), 500
+
+@app.route('/api/voice/stream/<stream_id>', methods=['POST'])
+def feed_voice_stream(stream_id):
+    try:
+        chunk = request.stream.read(transcription.MAX_CHUNK_BYTES + 1)
+        result = transcription.feed_stream(stream_id, chunk)
+        return jsonify({"success": True, **result})
+    except KeyError:
+        return jsonify({"success": False, "message": "Voice session expired"}), 404
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except transcription.Unavailable as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception as e:
+        print('Voice stream error:', e)
+        return jsonify({"success": False, "message": "Voice processing failed"}), 500
+
+@app.route('/api/voice/stream/<stream_id>/finish', methods=['POST'])
+def finish_voice_stream(stream_id):
+    try:
+        transcript = transcription.close_stream(stream_id)
+        return jsonify({"success": True, "transcript": transcript, "intent": intents.match(transcript)})
+    except KeyError:
+        return jsonify({"success": False, "message": "Voice session expired"}), 404
+    except transcription.Unavailable as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception as e:
+        print('Voice stream error:', e)
+        return jsonify({"success": False, "message": "Voice processing failed"}), 500
+
 @app.route('/api/documents', methods=['GET'])
 def list_documents():
     try:
         user_id = request.args.get('user_id')
-        data = load_documents()
-        docs = data.get('documents', [])
-        if user_id:
-            docs = [d for d in docs if str(d.get('user_id')) == str(user_id)]
+        docs = storage.list_documents(user_id)
         return jsonify({"success": True, "documents": docs})
     except Exception as e:
         print('List documents error:', e)
         return jsonify({"success": False, "documents": []}), 500
 
+def store_document(staged_path, digest, size, user_id, original_name, doc_type):
+    """Move a fully staged upload into the blob store and record the document"""
+    record = {
+        "user_id": user_id,
+        "name": original_name,
+        "original_name": original_name,
+        "path": None,
+        "sha256": digest,
+        "size": size,
+        "type": doc_type,
+        "uploadDate": datetime.datetime.now().strftime('%Y-%m-%d')
+    }
+    with storage.transaction() as conn:
+        record["path"] = blobstore.commit_blob(conn, staged_path, digest, size)
+        storage.insert_document(conn, record)
+        # Thumbnails are made in the background; the job survives restarts
+        previews.enqueue(conn, record)
+    return record
+
+def upload_too_large():
+    limit_mb = blobstore.MAX_UPLOAD_BYTES // (1024 * 1024)
+    return jsonify({"success": False, "message": f"File is larger than {limit_mb} MB"}), 413
+
 @app.route('/api/documents', methods=['POST'])
 def upload_document():
+    staged_path = None
     try:
         if 'file' not in request.files:
             return jsonify({"success": False, "message": "No file uploaded"}), 400
         file = request.files['file']
         if file.filename == '':
             return jsonify({"success": False, "message": "Empty filename"}), 400
-        user_id = request.form.get('user_id', '')
-        original_name = secure_filename(file.filename)
-        # Create user folder
-        user_folder = os.path.join(UPLOAD_DIR, str(user_id or 'anonymous'))
-        os.makedirs(user_folder, exist_ok=True)
-        # Ensure unique name
-        base_name = os.path.splitext(original_name)[0]
-        ext = os.path.splitext(original_name)[1]
-        save_name = original_name
-        counter = 1
-        while os.path.exists(os.path.join(user_folder, save_name)):
-            save_name = f"{base_name}_{counter}{ext}"
-            counter += 1
-        save_path = os.path.join(user_folder, save_name)
-        file.save(save_path)
-
-        data = load_documents()
-        doc_id = len(data.get('documents', [])) + 1
-        record = {
-            "id": doc_id,
-            "user_id": user_id,
-            "name": save_name,
-            "original_name": original_name,
-            "path": f"{user_folder}/{save_name}",
-            "type": request.form.get('type', ''),
-            "uploadDate": __import__('datetime').datetime.now().strftime('%Y-%m-%d')
-        }
-        data['documents'].append(record)
-        save_documents(data)
+        # Hash while copying in chunks, then store the content once under its SHA-256
+        staged_path = blobstore.staging_path(blobstore.new_upload_id())
+        hasher = hashlib.sha256()
+        size = blobstore.stream_to_file(file.stream, staged_path, blobstore.MAX_UPLOAD_BYTES, hasher=hasher)
+        record = store_document(
+            staged_path,
+            hasher.hexdigest(),
+            size,
+            request.form.get('user_id', ''),
+            secure_filename(file.filename),
+            request.form.get('type', '')
+        )
         return jsonify({"success": True, "document": record})
+    except (blobstore.UploadTooLarge, RequestEntityTooLarge):
+        return upload_too_large()
     except Exception as e:
         print('Upload error:', e)
         traceback.print_exc()
         return jsonify({"success": False, "message": "Upload failed"}), 500
+    finally:
+        if staged_path and os.path.exists(staged_path):
+            os.remove(staged_path)
+
+# Resumable uploads: start a session, PUT raw chunks at ?offset=<bytes so far>,
+# GET the session to find where to resume after a dropped connection, then complete.
+@app.route('/api/documents/uploads', methods=['POST'])
+def start_upload():
+    try:
+        data = request.get_json() or {}
+        if not data.get('filename'):
+            return jsonify({"success": False, "message": "Missing: filename"}), 400
+        try:
+            size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid size"}), 400
+        if size <= 0:
+            return jsonify({"success": False, "message": "Invalid size"}), 400
+        if size > blobstore.MAX_UPLOAD_BYTES:
+            return upload_too_large()
+        session = {
+            "id": blobstore.new_upload_id(),
+            "user_id": data.get('user_id', ''),
+            "filename": secure_filename(data['filename']),
+            "type": data.get('type', ''),
+            "size": size,
+            "offset": 0,
+            "createdAt": datetime.datetime.now().isoformat()
+        }
+        # Abandoned sessions would otherwise keep their staging files forever
+        blobstore.maybe_sweep_staging()
+        open(blobstore.staging_path(session["id"]), 'wb').close()
+        with storage.transaction() as conn:
+            storage.save_upload(conn, session)
+        return jsonify({"success": True, "upload": session})
+    except Exception as e:
+        print('Start upload error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Upload failed"}), 500
+
+@app.route('/api/documents/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    session = storage.get_upload(upload_id)
+    if not session:
+        return jsonify({"success": False, "message": "Upload not found"}), 404
+    return jsonify({"success": True, "upload": session})
+
+@app.route('/api/documents/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        session = storage.get_upload(upload_id)
+        if not session:
+            return jsonify({"success": False, "message": "Upload not found"}), 404
+        try:
+            offset = int(request.args.get('offset', -1))
+        except ValueError:
+            offset = -1
+        path = blobstore.staging_path(upload_id)
+        if not os.path.exists(path):
+            # Swept as abandoned while this request was on its way
+            with storage.transaction() as conn:
+                storage.delete_upload(conn, upload_id)
+            return jsonify({"success": False, "message": "Upload expired"}), 404
+        # One writer per upload: a retried chunk that overlaps the original gets a 409
+        # instead of being appended twice
+        with blobstore.open_staged(path) as staged:
+            session = storage.get_upload(upload_id)
+            if not session:
+                return jsonify({"success": False, "message": "Upload not found"}), 404
+            if offset != session["offset"]:
+                # Client is out of step (e.g. a retried chunk); tell it where to resume
+                return jsonify({"success": False, "message": "Offset mismatch", "upload": session}), 409
+            staged.seek(offset)
+            try:
+                written = blobstore.copy_stream(request.stream, staged, session["size"] - offset)
+            except blobstore.UploadTooLarge:
+                # Drop whatever part of this chunk was written so the session can resume cleanly
+                staged.truncate(offset)
+                return jsonify({
+                    "success": False,
+                    "message": f"Upload is larger than its declared size of {session['size']} bytes",
+                    "upload": session
+                }), 413
+            # Anything past this chunk is left over from an abandoned attempt
+            staged.truncate(offset + written)
+            with storage.transaction() as conn:
+                advanced = storage.advance_upload(conn, upload_id, offset, offset + written)
+            if not advanced:
+                return jsonify({"success": False, "message": "Offset mismatch",
+                                "upload": storage.get_upload(upload_id)}), 409
+        session["offset"] = offset + written
+        return jsonify({"success": True, "upload": session})
+    except blobstore.UploadBusy as e:
+        return jsonify({"success": False, "message": str(e), "upload": storage.get_upload(upload_id)}), 409
+    except FileNotFoundError:
+        return jsonify({"success": False, "message": "Upload not found"}), 404
+    except Exception as e:
+        print('Upload chunk error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Upload failed"}), 500
+
+@app.route('/api/documents/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    try:
+        path = blobstore.staging_path(upload_id)
+        # Held so no chunk can be written while the file is hashed and moved
+        with blobstore.open_staged(path):
+            session = storage.get_upload(upload_id)
+            if not session:
+                return jsonify({"success": False, "message": "Upload not found"}), 404
+            if session["offset"] != session["size"] or os.path.getsize(path) != session["size"]:
+                return jsonify({"success": False, "message": "Upload incomplete", "upload": session}), 409
+            # hashlib state cannot be persisted between chunk requests, so hash the assembled file once
+            record = store_document(
+                path,
+                blobstore.hash_file(path),
+                session["size"],
+                session["user_id"],
+                session["filename"],
+                session["type"]
+            )
+            with storage.transaction() as conn:
+                storage.delete_upload(conn, upload_id)
+        return jsonify({"success": True, "document": record})
+    except blobstore.UploadBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+    except FileNotFoundError:
+        return jsonify({"success": False, "message": "Upload not found"}), 404
+    except Exception as e:
+        print('Complete upload error:', e)
+        traceback.print_exc()
+        return jsonify({"success": False, "message": "Upload failed"}), 500
+
+# How document bytes leave the server:
+#   ''            -> Flask streams the file (wsgi.file_wrapper, i.e. sendfile under gunicorn)
+#   'x-sendfile'  -> X-Sendfile header for Apache/lighttpd
+#   'x-accel'     -> X-Accel-Redirect to an nginx `internal` location mapped onto UPLOAD_DIR
+FILE_OFFLOAD = os.environ.get('DIGIGOV_FILE_OFFLOAD', '')
+X_ACCEL_PREFIX = os.environ.get('DIGIGOV_X_ACCEL_PREFIX', '/protected-uploads/')
+app.config['USE_X_SENDFILE'] = FILE_OFFLOAD == 'x-sendfile'
+# Document content never changes under an id, so clients may reuse it and revalidate by ETag
+DOCUMENT_CACHE_CONTROL = 'private, max-age=3600'
+
+def serve_document(doc_id, inline):
+    # Primary-key lookup; no scan over the document list
+    match = storage.get_document(doc_id)
+    if not match:
+        return jsonify({"success": False, "message": "Not found"}), 404
+    path = match.get('path')
+    if not path or not os.path.exists(path):
+        return jsonify({"success": False, "message": "File missing"}), 404
+    filename = match.get('original_name') or match.get('name')
+    # Blobs have no extension, so guess the type from the uploaded name
+    mime, _ = mimetypes.guess_type(filename or path)
+    # Ensure PDFs open inline in browser
+    if (filename or path).lower().endswith('.pdf'):
+        mime = 'application/pdf'
+    mime = mime or 'application/octet-stream'
+    # Strong ETag from the stored content hash; older uploads fall back to Werkzeug's mtime/size tag
+    etag = match.get('sha256')
+
+    if FILE_OFFLOAD == 'x-accel':
+        if etag and etag in request.if_none_match:
+            resp = Response(status=304)
+        else:
+            relative = os.path.relpath(path, blobstore.UPLOAD_DIR).replace(os.sep, '/')
+            resp = Response(mimetype=mime)
+            # nginx serves the bytes, including Range requests
+            resp.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX + relative
+        if etag:
+            resp.set_etag(etag)
+    else:
+        # conditional=True answers If-None-Match with 304 and Range with 206
+        resp = send_file(
+            path,
+            mimetype=mime,
+            as_attachment=not inline,
+            download_name=filename,
+            conditional=True,
+            etag=etag or True
+        )
+    resp.headers['Cache-Control'] = DOCUMENT_CACHE_CONTROL
+    resp.headers['Accept-Ranges'] = 'bytes'
+    if inline:
+        # Force inline Content-Disposition to avoid downloads
+        resp.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    elif FILE_OFFLOAD == 'x-accel':
+        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return resp
 
 @app.route('/api/documents/<int:doc_id>/download', methods=['GET'])
 def download_document(doc_id: int):
     try:
-        data = load_documents()
-        match = next((d for d in data.get('documents', []) if int(d.get('id', -1)) == doc_id), None)
-        if not match:
-            return jsonify({"success": False, "message": "Not found"}), 404
-        path = match.get('path')
-        if not path or not os.path.exists(path):
-            return jsonify({"success": False, "message": "File missing"}), 404
-        return send_file(path, as_attachment=True, download_name=match.get('original_name') or match.get('name'))
+        return serve_document(doc_id, inline=False)
     except Exception as e:
         print('Download error:', e)
         return jsonify({"success": False, "message": "Download failed"}), 500
@@ -297,51 +907,50 @@ def download_document(doc_id: int):
 @app.route('/api/documents/<int:doc_id>/view', methods=['GET'])
 def view_document(doc_id: int):
     try:
-        data = load_documents()
-        match = next((d for d in data.get('documents', []) if int(d.get('id', -1)) == doc_id), None)
+        return serve_document(doc_id, inline=True)
+    except Exception as e:
+        print('View error:', e)
+        return jsonify({"success": False, "message": "View failed"}), 500
+
+@app.route('/api/documents/<int:doc_id>/thumbnail', methods=['GET'])
+def document_thumbnail(doc_id: int):
+    try:
+        variant = request.args.get('size', 'thumbnail')
+        if variant not in previews.VARIANTS:
+            return jsonify({"success": False, "message": f"Unknown size: {variant}"}), 400
+        match = storage.get_document(doc_id)
         if not match:
             return jsonify({"success": False, "message": "Not found"}), 404
-        path = match.get('path')
+        path = previews.variant_path(match['sha256'], variant) if match.get('sha256') else None
         if not path or not os.path.exists(path):
-            return jsonify({"success": False, "message": "File missing"}), 404
-        mime, _ = mimetypes.guess_type(path)
-        # Ensure PDFs open inline in browser
-        if path.lower().endswith('.pdf'):
-            mime = 'application/pdf'
-        resp = send_file(
-            path,
-            mimetype=mime or 'application/octet-stream',
-            as_attachment=False,
-            download_name=match.get('original_name') or match.get('name')
-        )
-        # Force inline Content-Disposition to avoid downloads
-        filename = match.get('original_name') or match.get('name')
-        resp.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+            # Not generated (yet); clients fall back to the original
+            return jsonify({"success": False, "message": "Thumbnail not available"}), 404
+        resp = send_file(path, mimetype='image/webp', conditional=True, etag=f"{match['sha256']}-{variant}")
+        resp.headers['Cache-Control'] = DOCUMENT_CACHE_CONTROL
         return resp
     except Exception as e:
-        print('View error:', e)
-        return jsonify({"success": False, "message": "View failed"}), 500
+        print('Thumbnail error:', e)
+        return jsonify({"success": False, "message": "Thumbnail failed"}), 500
 
 @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
 def delete_document(doc_id: int):
     try:
-        data = load_documents()
-        docs = data.get('documents', [])
-        idx = next((i for i, d in enumerate(docs) if int(d.get('id', -1)) == doc_id), -1)
-        if idx == -1:
+        record = storage.get_document(doc_id)
+        if not record:
             return jsonify({"success": False, "message": "Not found"}), 404
-        record = docs[idx]
+        with storage.transaction() as conn:
+            storage.delete_document(conn, doc_id)
+            if record.get('sha256'):
+                # Shared content: only removed with its last document
+                blobstore.release_blob(conn, record['sha256'])
+                return jsonify({"success": True})
+        # Documents uploaded before the blob store own their file
         path = record.get('path')
-        # Remove file if it exists
         try:
             if path and os.path.exists(path):
                 os.remove(path)
         except Exception as fe:
             print('File delete warning:', fe)
-        # Remove from metadata and save
-        docs.pop(idx)
-        data['documents'] = docs
-        save_documents(data)
         return jsonify({"success": True})
     except Exception as e:
         print('Delete error:', e)
@@ -366,6 +975,8 @@ def handle_official_register():
 
         result = login.register_official(data)
         return jsonify(result)
+    except hashing.PoolBusy:
+        return busy_response()
     except Exception as e:
         print("Official registration error:", str(e))
         return jsonify({
@@ -385,6 +996,8 @@ def handle_official_login():
 
         result = login.verify_official_login(data['emp_id'], data['password'])
         return jsonify(result)
+    except hashing.PoolBusy:
+        return busy_response()
     except Exception as e:
         print("Official login error:", str(e))
         return jsonify({
@@ -392,6 +1005,43 @@ def handle_official_login():
             "message": "Login failed. Please try again."
         }), 500
 
+# --- Cold-start Benchmark ---
+# Heavy optional modules that must not be loaded just by starting a worker
+LAZY_MODULES = ['numpy', 'sentence_transformers', 'speech_recognition', 'vosk', 'plyer', 'requests', 'fitz']
+
+_COLDSTART_PROBE = """
+import sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app(warm_up=False)
+ready = time.perf_counter()
+loaded = [m for m in app.LAZY_MODULES if m in sys.modules]
+print((imported - start) * 1000, (ready - imported) * 1000, ",".join(loaded) or "none")
+"""
+
+def _coldstart_benchmark(runs=5):
+    """Time `import app` and create_app() in fresh interpreters, as a new worker would"""
+    imports, inits = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', _COLDSTART_PROBE], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        import_ms, init_ms, loaded = out.strip().splitlines()[-1].split(' ')
+        imports.append(float(import_ms))
+        inits.append(float(init_ms))
+    imports.sort()
+    inits.sort()
+    print(f"import app: median {imports[runs // 2]:.0f} ms; create_app(): median {inits[runs // 2]:.0f} ms "
+          f"over {runs} cold starts")
+    print(f"heavy modules loaded at startup: {loaded}")
+
+# Development server; in production run `gunicorn -c gunicorn.conf.py asgi:app` (see asgi.py)
 if __name__ == '__main__':
-    print('Starting Flask server on http://localhost:5000 ...')
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    # python app.py                 -> development server
+    # python app.py coldstart [runs] -> startup cost of a fresh worker
+    if len(sys.argv) >= 2 and sys.argv[1] == 'coldstart':
+        _coldstart_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5)
+    else:
+        create_app()
+        print('Starting Flask server on http://localhost:5000 ...')
+        app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import traceback
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+# Streaming voice sessions go through one host worker (see transcription.py); set before
+# the app is imported, as the modules read it at import. gunicorn.conf.py also sets a key.
+os.environ.setdefault("DIGIGOV_STT_STREAM_SOCKET", os.path.abspath("stt-streams.sock"))
+
+import events
+import storage
+from app import app as flask_app, create_app
+
+# Production entry point: an ASGI application for uvicorn, alone or as gunicorn workers
+# (settings in gunicorn.conf.py):
+#
+#   gunicorn -c gunicorn.conf.py asgi:app
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+#
+# The Flask routes run unchanged on a bounded pool of WSGI_THREADS threads, so their
+# blocking SQLite, file and upload I/O never stalls the event loop, and request and
+# response bodies are streamed through. bcrypt and speech recognition already run on
+# their own pools (hashing.py, transcription.py). /api/stream is served natively: an open
+# event stream is a coroutine instead of a pool thread, so idle streams cost no threads
+# and cannot starve the other routes.
+#
+# `python app.py` still runs the Flask development server.
+WSGI_THREADS = int(os.environ.get("DIGIGOV_WSGI_THREADS", "32"))
+STREAM_PATH = "/api/stream"
+
+_wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+
+# --- Helpers ---
+
+def _cors_headers(headers):
+    # Same as flask_cors with origins "*": only answered to cross-origin requests
+    return [(b"access-control-allow-origin", b"*")] if b"origin" in headers else []
+
+
+async def _send_json(send, status, body, extra_headers=()):
+    payload = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode()), *extra_headers],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+# --- Event Streams ---
+
+class AsyncSubscription:
+    """An events.Subscription for a coroutine; events.publish() may wake it from any thread"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._loop = asyncio.get_running_loop()
+        self._pending = asyncio.Event()
+
+    def wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._pending.set)
+        except RuntimeError:
+            pass  # the event loop has shut down
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._pending.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self._pending.clear()
+        return woken
+
+
+def astream(user_id, last_id=None):
+    """events.stream() as an async generator; database reads run in the default executor"""
+    events.check_capacity()
+
+    async def generate():
+        subscription = events.subscribe(user_id, AsyncSubscription)
+        try:
+            cursor = last_id
+            if cursor is None:
+                cursor = await asyncio.to_thread(storage.latest_notification_id, user_id)
+            yield f"retry: {events.RETRY_MS}\n\n"
+            while True:
+                while True:
+                    records = await asyncio.to_thread(storage.notifications_after, user_id, cursor,
+                                                      events.PAGE_SIZE)
+                    for record in records:
+                        cursor = record["id"]
+                        yield events.format_event(record)
+                    if len(records) < events.PAGE_SIZE:
+                        break
+                if not await subscription.wait(events.HEARTBEAT_SECONDS):
+                    yield ": keepalive\n\n"
+        finally:
+            events.unsubscribe(subscription)
+
+    return generate()
+
+
+# --- Routes ---
+
+async def event_stream(scope, receive, send):
+    """GET /api/stream, as in app.py but on the event loop"""
+    headers = dict(scope["headers"])
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    cors = _cors_headers(headers)
+
+    def arg(name):
+        return (query.get(name) or [None])[0]
+
+    user_id = arg("user_id") or arg("username")
+    if not user_id:
+        return await _send_json(send, 400, {"success": False, "message": "user_id is required"}, cors)
+    last_id = headers.get(b"last-event-id", b"").decode("latin-1") or arg("last_event_id")
+    try:
+        last_id = int(last_id) if last_id not in (None, "") else None
+    except ValueError:
+        return await _send_json(send, 400, {"success": False, "message": "Invalid Last-Event-ID"}, cors)
+    try:
+        chunks = astream(user_id, last_id)
+    except events.TooManyStreams as e:
+        return await _send_json(send, 503, {"success": False, "message": str(e)}, cors)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    # Stop nginx from buffering the stream
+                    (b"x-accel-buffering", b"no"), *cors],
+    })
+
+    async def pump():
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        error = tasks[0].exception() if tasks[0] in done else None
+        if error:
+            print('Stream error:', error)
+            traceback.print_exception(type(error), error, error.__traceback__)
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Frees the stream's connection slot even if it never started
+        await chunks.aclose()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Once per worker process, before it takes requests
+            await asyncio.to_thread(create_app)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == STREAM_PATH and scope["method"] == "GET":
+        return await event_stream(scope, receive, send)
+    await _wsgi(scope, receive, send)
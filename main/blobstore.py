@@ -0,0 +1,179 @@
+import glob
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import storage
+
+# --- Upload Directories ---
+UPLOAD_DIR = "uploads"
+# Files are stored once under their SHA-256, however many documents point at them
+BLOB_DIR = f"{UPLOAD_DIR}/blobs"
+# Uploads in progress (single-shot and resumable) before they are moved into BLOB_DIR
+STAGING_DIR = f"{UPLOAD_DIR}/staging"
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("DIGIGOV_MAX_UPLOAD_MB", "25")) * 1024 * 1024
+# Resumable sessions untouched this long are abandoned; their staging files go with them
+UPLOAD_TTL_SECONDS = int(os.environ.get("DIGIGOV_UPLOAD_TTL_HOURS", "24")) * 3600
+SWEEP_INTERVAL_SECONDS = 600
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+class UploadTooLarge(Exception):
+    """Raised as soon as an upload goes past its size limit"""
+
+
+class UploadBusy(Exception):
+    """Another request is writing to the same resumable upload"""
+
+
+def init_dirs():
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    os.makedirs(STAGING_DIR, exist_ok=True)
+
+
+def blob_path(digest):
+    return f"{BLOB_DIR}/{digest[:2]}/{digest}"
+
+
+def staging_path(upload_id):
+    return f"{STAGING_DIR}/{upload_id}"
+
+
+def new_upload_id():
+    return uuid.uuid4().hex
+
+
+def stream_to_file(stream, path, limit, append=False, hasher=None):
+    """Copy `stream` to `path` in chunks, never holding more than one chunk in memory.
+
+    Raises UploadTooLarge once more than `limit` bytes have arrived. Returns the number
+    of bytes written; `hasher`, if given, is fed every chunk.
+    """
+    with open(path, "ab" if append else "wb") as out:
+        return copy_stream(stream, out, limit, hasher)
+
+
+def copy_stream(stream, out, limit, hasher=None):
+    """Copy `stream` into the open file `out` at its current position; see stream_to_file"""
+    written = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        written += len(chunk)
+        if written > limit:
+            raise UploadTooLarge(f"Upload exceeds {limit} bytes")
+        if hasher is not None:
+            hasher.update(chunk)
+        out.write(chunk)
+    return written
+
+
+@contextmanager
+def open_staged(path):
+    """A resumable upload's staging file, opened r+b and held exclusively.
+
+    Raises UploadBusy at once when another request (in any process) holds it, and
+    FileNotFoundError when the upload is gone. Without fcntl (Windows) there is no lock;
+    the offset compare-and-set in storage.advance_upload still rejects the loser.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    with open(path, "r+b") as f:
+        if fcntl:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadBusy("Another chunk of this upload is being written")
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def sweep_staging(now=None):
+    """Delete abandoned upload sessions and staging files older than UPLOAD_TTL_SECONDS.
+
+    Also catches files left behind by single-shot uploads whose process died. Returns the
+    number of files removed.
+    """
+    cutoff = (now or time.time()) - UPLOAD_TTL_SECONDS
+    with storage.transaction() as conn:
+        storage.expire_uploads(conn, cutoff)
+    removed = 0
+    for path in glob.glob(f"{STAGING_DIR}/*"):
+        try:
+            if os.path.getmtime(path) >= cutoff or storage.get_upload(os.path.basename(path)):
+                continue
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def maybe_sweep_staging():
+    """sweep_staging() at most once per SWEEP_INTERVAL_SECONDS in this process"""
+    global _last_sweep
+    if time.time() - _last_sweep < SWEEP_INTERVAL_SECONDS or not _sweep_lock.acquire(blocking=False):
+        return 0
+    try:
+        _last_sweep = time.time()
+        return sweep_staging()
+    finally:
+        _sweep_lock.release()
+
+
+def commit_blob(conn, staged_path, digest, size):
+    """Take a reference on blob `digest`, moving the staged file in if the blob is new.
+
+    Must run inside storage.transaction(): the write lock serializes this with
+    release_blob() so a blob is never removed while it is being re-referenced.
+    """
+    path = blob_path(digest)
+    if storage.acquire_blob(conn, digest, size) and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged_path, path)
+    elif os.path.exists(staged_path):
+        # Identical content is already stored
+        os.remove(staged_path)
+    return path
+
+
+def release_blob(conn, digest):
+    """Drop a reference on blob `digest`; the file goes with the last one once this commits.
+
+    Nothing is deleted if the transaction rolls back, so a surviving row always has its file.
+    """
+    if storage.release_blob(conn, digest) == 0:
+        storage.after_commit(lambda: _remove_blob(digest))
+
+
+def _remove_blob(digest):
+    # Under the write lock, and only if no upload has re-referenced the blob since
+    with storage.transaction() as conn:
+        if storage.blob_refs(conn, digest):
+            return
+        path = blob_path(digest)
+        # The blob itself plus any derived files (<digest>.<variant>.webp)
+        for leftover in [path] + glob.glob(glob.escape(path) + ".*"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
@@ -0,0 +1,267 @@
+import array
+import hashlib
+import operator
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import date, datetime, timedelta
+
+import schemes
+import storage
+
+# Near-duplicate complaint clusters, so a mass report of one outage is triaged once.
+#
+# Each complaint's subject and description become a set of character 5-grams (in the
+# romanized, folded form the scheme search uses, so Hindi and English reports of the same
+# thing overlap), summarised as a NUM_PERM-value MinHash signature. The signature is cut
+# into BANDS bands; every band is hashed together with the complaint's sector, place and
+# day into an LSH bucket. A new complaint is compared only with complaints that share a
+# bucket from its own day or the day before, so the cost of filing one does not grow
+# with the number of complaints on record.
+#
+# A complaint joins the cluster of its most similar candidate at THRESHOLD estimated
+# Jaccard similarity or above; otherwise it starts a cluster of its own. The place is the
+# district when the complaint has one, else a CELL_DEGREES grid cell around its
+# coordinates, else its typed location; reports either side of a cell edge are not
+# matched.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 5
+THRESHOLD = float(os.environ.get("DIGIGOV_CLUSTER_THRESHOLD", "0.6"))
+MAX_CANDIDATES = 200
+MAX_TEXT = 2000
+CELL_DEGREES = 0.05
+WINDOW_DAYS = 1
+BATCH_SIZE = 1000
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: signatures are stored, so the permutations must never change. Shingle
+# hashes and coefficients are 32-bit, so a * h + b never overflows 64 bits.
+_rng = random.Random(5381)
+_PERMUTATIONS = [(_rng.randrange(1, 1 << 32), _rng.randrange(0, 1 << 32)) for _ in range(NUM_PERM)]
+_vectorised = None  # (numpy, a column, b column) once loaded, False without numpy
+
+
+def _numpy():
+    """numpy and the permutations as arrays, imported on first use; None without numpy.
+
+    numpy only speeds signatures up; the pure-Python path gives identical values.
+    """
+    global _vectorised
+    if _vectorised is None:
+        try:
+            import numpy as np
+            _vectorised = (np,
+                           np.array([a for a, b in _PERMUTATIONS], dtype=np.uint64)[:, None],
+                           np.array([b for a, b in _PERMUTATIONS], dtype=np.uint64)[:, None])
+        except ImportError:
+            _vectorised = False
+    return _vectorised or None
+
+
+# --- Signatures ---
+
+def shingles(text):
+    words = " ".join(schemes.tokenize(str(text)[:MAX_TEXT]))
+    if len(words) <= SHINGLE:
+        return {words} if words else set()
+    return {words[i:i + SHINGLE] for i in range(len(words) - SHINGLE + 1)}
+
+
+def signature(text):
+    """MinHash signature of a text as array('Q'), or None when it has no words"""
+    hashes = [zlib.crc32(s.encode()) for s in shingles(text)]
+    if not hashes:
+        return None
+    vectorised = _numpy()
+    if vectorised:
+        np, a, b = vectorised
+        values = (a * np.array(hashes, dtype=np.uint64) + b) % np.uint64(_PRIME)
+        return array.array("Q", values.min(axis=1).tobytes())
+    return array.array("Q", [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS])
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(map(operator.eq, first, second)) / NUM_PERM
+
+
+def place_key(record):
+    if record.get("district"):
+        return "d:" + schemes.state_key(record["district"])
+    coordinates = record.get("coordinates")
+    if coordinates:
+        try:
+            return "c:%d:%d" % (float(coordinates["lat"]) // CELL_DEGREES,
+                                float(coordinates["lng"]) // CELL_DEGREES)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return "l:" + " ".join(schemes.tokenize(record.get("location") or ""))
+
+
+def buckets(sig, record, day):
+    """The LSH bucket keys of a signature for a complaint's sector and place on `day`"""
+    scope = f"{record.get('sector') or ''}|{place_key(record)}|{day}|".encode()
+    return [
+        hashlib.blake2b(scope + bytes([band]) + sig[band * ROWS:(band + 1) * ROWS].tobytes(),
+                        digest_size=12).hexdigest()
+        for band in range(BANDS)
+    ]
+
+
+def _day(record):
+    try:
+        return date.fromisoformat(str(record.get("createdAt") or "")[:10])
+    except ValueError:
+        return date.today()
+
+
+# --- Clustering ---
+
+def prepare(record):
+    """The signature and LSH buckets of a complaint, or None when it has no text.
+
+    Pure CPU work: call it before opening the transaction that assign() runs in, so the
+    write lock is not held while it runs.
+    """
+    sig = signature(f"{record.get('subject') or ''} {record.get('description') or ''}")
+    if sig is None:
+        return None
+    day = _day(record)
+    own = buckets(sig, record, day.isoformat())
+    lookup = own
+    for back in range(1, WINDOW_DAYS + 1):
+        lookup = lookup + buckets(sig, record, (day - timedelta(days=back)).isoformat())
+    return sig, day, own, lookup
+
+
+def assign(conn, record, prepared=None):
+    """Put a complaint in a cluster (in the caller's transaction); returns the cluster id.
+
+    `record` needs its id but need not be inserted yet; `prepared` is prepare(record),
+    computed here when not given. Sets record["clusterId"]; the caller saves the record.
+    Complaints without any text are not clustered.
+    """
+    existing = storage.cluster_of(conn, record["id"])
+    if existing is not None:
+        record["clusterId"] = existing
+        return existing
+    if prepared is None:
+        prepared = prepare(record)
+    if prepared is None:
+        return None
+    sig, day, own, lookup = prepared
+
+    best, best_score = None, 0.0
+    for cluster_id, blob in storage.lsh_candidates(conn, lookup, MAX_CANDIDATES).values():
+        score = similarity(sig, array.array("Q", blob))
+        if score >= THRESHOLD and score > best_score:
+            best, best_score = cluster_id, score
+
+    cluster_id = best or record["id"]
+    storage.add_to_cluster(conn, record["id"], cluster_id, sig.tobytes(), own, day.isoformat(), {
+        "sector": record.get("sector"),
+        "subject": record.get("subject"),
+        "location": record.get("location"),
+        "district": record.get("district")
+    }, record.get("createdAt") or datetime.now().isoformat())
+    record["clusterId"] = cluster_id
+    return cluster_id
+
+
+def prune(today=None):
+    """Drop buckets too old to match a complaint filed today"""
+    cutoff = (today or date.today()) - timedelta(days=WINDOW_DAYS)
+    with storage.transaction() as conn:
+        return storage.prune_lsh(conn, cutoff.isoformat())
+
+
+def recluster():
+    """Batch job: rebuild every cluster from the complaints on record, oldest first.
+
+    Complaints filed while it runs are clustered as usual and skipped when it reaches
+    them. Returns how many complaints were walked.
+    """
+    with storage.transaction() as conn:
+        storage.clear_clusters(conn)
+    total, cursor = 0, None
+    while True:
+        records, cursor = storage.complaints_after(cursor, BATCH_SIZE)
+        if not records:
+            break
+        prepared = [prepare(record) for record in records]
+        with storage.transaction() as conn:
+            for record, signature_buckets in zip(records, prepared):
+                previous = record.pop("clusterId", None)
+                assign(conn, record, signature_buckets)
+                if record.get("clusterId") != previous:
+                    storage.update_complaint(conn, record)
+        total += len(records)
+    prune()
+    return total
+
+
+# --- Benchmark ---
+
+_OUTAGES = [
+    ("Power cut", "No electricity in our area since morning, transformer near the market has failed"),
+    ("Water supply stopped", "There is no water supply in our colony for two days, tanker has not come"),
+    ("Road caved in", "The main road near the bus stand has caved in and vehicles cannot pass"),
+    ("Streetlights not working", "All the streetlights on our street are off and it is unsafe at night"),
+]
+_FILLER = ["please help", "urgent", "kindly resolve", "since yesterday", "whole street", "sir",
+           "many families affected", "very bad", "please send someone", "again"]
+
+
+def _benchmark(count=20000):
+    """File `count` synthetic complaints (one in five part of a mass report) and time assign"""
+    rng = random.Random(11)
+    districts = [f"District {i}" for i in range(300)]
+    created = datetime.now().isoformat()
+    latencies = []
+    for first in range(0, count, BATCH_SIZE):
+        with storage.transaction() as conn:
+            for i in range(first, min(first + BATCH_SIZE, count)):
+                if rng.random() < 0.2:
+                    subject, description = _OUTAGES[i % len(_OUTAGES)]
+                    district = districts[i % 7]
+                    description += " " + " ".join(rng.sample(_FILLER, 2))
+                else:
+                    subject = f"Issue {i}"
+                    description = " ".join(rng.choice(_FILLER) + f" item{rng.randrange(100000)}"
+                                           for _ in range(8))
+                    district = rng.choice(districts)
+                record = {
+                    "userId": "bench", "sector": "Electricity", "subject": subject,
+                    "description": description, "district": district, "status": "pending",
+                    "priority": "normal", "createdAt": created
+                }
+                start = time.perf_counter()
+                prepared = prepare(record)
+                record["id"] = storage.next_id(conn, "complaints", "complaints")
+                assign(conn, record, prepared)
+                latencies.append(time.perf_counter() - start)
+                storage.insert_complaint(conn, record)
+    latencies.sort()
+    print(f"assign: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms over {count} complaints")
+    for cluster in storage.top_clusters(limit=5):
+        print(f"  cluster {cluster['id']}: {cluster['size']} x {cluster['subject']!r} in {cluster['district']}")
+
+
+if __name__ == "__main__":
+    # python clusters.py recluster    -> rebuild all clusters from the complaints on record
+    # python clusters.py prune        -> drop LSH buckets older than the matching window
+    # python clusters.py bench [count] -> assign cost (use a scratch DIGIGOV_DB)
+    storage.init_db()
+    if len(sys.argv) == 2 and sys.argv[1] == "recluster":
+        print(f"Reclustered {recluster()} complaints")
+    elif len(sys.argv) == 2 and sys.argv[1] == "prune":
+        print(f"Pruned {prune()} buckets")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+    else:
+        print("usage: python clusters.py recluster | prune | bench [count]")
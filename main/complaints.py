@@ -1,95 +1,342 @@
-import json
+import csv
 import datetime
-import os
-
-# --- Users JSON File ---
-USERS_FILE = "users.json"
-try:
-    with open(USERS_FILE, "r") as f:
-        users = json.load(f)
-except (json.JSONDecodeError, FileNotFoundError):
-    users = {"users": {}}
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
-
-# --- Complaints JSON File ---
-COMPLAINTS_FILE = "complaints.json"
-
-# Load complaints from file or create empty
-complaints = {}
-if os.path.exists(COMPLAINTS_FILE):
-    try:
-        with open(COMPLAINTS_FILE, "r") as f:
-            content = f.read().strip()
-            complaints = json.loads(content) if content else {}
-            if not isinstance(complaints, dict):
-                complaints = {}
-    except (json.JSONDecodeError, OSError):
-        complaints = {}
-        with open(COMPLAINTS_FILE, "w") as f:
-            json.dump(complaints, f, indent=4)
-else:
-    with open(COMPLAINTS_FILE, "w") as f:
-        json.dump(complaints, f, indent=4)
-
-# Complaint ID counter (max ID + 1)
-complaint_counter = max([int(k) for k in complaints.keys()], default=0) + 1
-
-
-# --- Helper to save complaints ---
-def save_complaints():
-    with open(COMPLAINTS_FILE, "w") as f:
-        json.dump(complaints, f, indent=4)
+import io
+import json
+import sys
+
+import clusters
+import geocoder
+import login
+import notifications
+import storage
+
+SECTORS = ["Police", "Electricity", "Water", "Roads", "Health", "Education", "Revenue"]
+
+# --- Status Workflow ---
+# status -> {next status: official category allowed to make the change}
+# Category 1 officials handle and resolve complaints; Category 2 officials verify the
+# resolution with the citizen and close it, or send it back for more work.
+STATUS_TRANSITIONS = {
+    "pending": {"in_process": "1", "resolved": "1"},
+    "in_process": {"resolved": "1"},
+    "resolved": {"verified": "2", "in_process": "2"},
+    "verified": {"closed": "2"},
+}
+STATUSES = ["pending", "in_process", "resolved", "verified", "closed"]
+
+# --- Bulk Import / Export ---
+# Exports walk the complaints a page at a time and imports commit IMPORT_BATCH rows per
+# transaction, so memory stays flat however many complaints a file holds.
+EXPORT_FORMATS = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+# CSV columns; coordinates are flattened to lat/lng
+CSV_FIELDS = ["id", "userId", "username", "sector", "subject", "description", "location",
+              "priority", "status", "state", "district", "lat", "lng", "clusterId",
+              "createdAt", "updatedAt"]
+EXPORT_PAGE = 1000
+IMPORT_BATCH = 500
+MAX_IMPORT_ERRORS = 100
+MAX_TEXT_LENGTH = 10000
+# Spreadsheets run a cell starting with one of these as a formula; exported CSV text cells
+# get a leading ' so they open as plain text (read_csv takes it off again)
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def normalize_status(status):
+    """'In Process' / 'in-process' / 'IN_PROCESS' -> 'in_process'"""
+    return str(status or "").strip().lower().replace("-", "_").replace(" ", "_")
+
+
+def official_category(official):
+    """'1', 'Category 1' and 1 all mean category 1"""
+    return str(official.get("category", "")).lower().replace("category", "").strip()
 
 
 # --- Complaint Functions ---
 
-def get_user_by_username(username):
-    """Find a user in users.json by username"""
-    return users.get(username, None)
-
-
-def add_complaint(username, sector, complaint_text):
-    """Add a new complaint"""
-    global complaint_counter
-    user = get_user_by_username(username)
-    if not user:
-        return "❌ Username not found in users.json"
-
-    complaint_id = complaint_counter
-    complaint_counter += 1
-
-    complaints[str(complaint_id)] = {
-        "id": complaint_id,
-        "user_id": user["id"],
-        "username": user["username"],
+def add_complaint(user_id, sector, subject, description, location="", priority="normal",
+                  lat=None, lng=None):
+    """File a new complaint and return the stored record.
+
+    With coordinates, the state and district are looked up and stored too, and fill in
+    `location` when the citizen left it empty. Near-duplicates of a recent complaint get
+    its `clusterId`.
+    """
+    place = geocoder.reverse_geocode(lat, lng) if lat is not None and lng is not None else None
+    record = {
+        "userId": user_id,
         "sector": sector,
-        "complaint_text": complaint_text,
-        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "status": "Pending"
+        "subject": subject,
+        "description": description,
+        "location": location,
+        "priority": priority,
+        "status": "pending",
+        "createdAt": datetime.datetime.now().isoformat()
     }
-
-    save_complaints()
-    return f"✅ Complaint filed successfully with ID {complaint_id}"
-
-
-def get_user_complaints(username):
-    """Fetch all complaints filed by a username"""
-    return [c for c in complaints.values() if c["username"] == username]
-
-
-def update_complaint_status(complaint_id, new_status):
-    """Update the status of a complaint"""
-    if str(complaint_id) not in complaints:
-        return "❌ Complaint not found"
-    complaints[str(complaint_id)]["status"] = new_status
-    save_complaints()
-    return f"✅ Complaint ID {complaint_id} updated to status: {new_status}"
+    if lat is not None and lng is not None:
+        record["coordinates"] = {"lat": lat, "lng": lng}
+        if place:
+            record["state"] = place["state"]
+            record["district"] = place["district"]
+        # Outside the known boundaries the raw coordinates are better than nothing
+        record["location"] = location or geocoder.describe(place) or f"{lat}, {lng}"
+    # Hashing the text is the slow part; done before taking the write lock
+    prepared = clusters.prepare(record)
+    with storage.transaction() as conn:
+        record["id"] = storage.next_id(conn, "complaints", "complaints")
+        # Links it to an earlier report of the same incident, if there is one; clustered
+        # before the insert so the row is written once
+        clusters.assign(conn, record, prepared)
+        storage.insert_complaint(conn, record)
+    return record
+
+
+def get_user_complaints(user_id, limit=50, after=None):
+    """One page of complaints filed by a user"""
+    return storage.query_complaints(user_id=user_id, limit=limit, after=after)
+
+
+def get_complaints_by_sector(sector, limit=50, after=None):
+    """One page of complaints for a sector"""
+    return storage.query_complaints(sector=sector, limit=limit, after=after)
+
+
+def update_complaint_status(complaint_id, new_status, emp_id, note=""):
+    """Move a complaint along the workflow on behalf of an official.
+
+    Appends a status event to the complaint's history and updates the current state
+    in the same transaction; nothing else about the complaint is rewritten.
+    """
+    new_status = normalize_status(new_status)
+    official = login.get_user_by_emp_id(emp_id)
+    if not official or official.get("role") != "official":
+        return {"success": False, "message": "Official not found"}
+    category = official_category(official)
+
+    with storage.transaction() as conn:
+        record = storage.get_complaint(complaint_id, conn)
+        if not record:
+            return {"success": False, "message": "Complaint not found"}
+        old_status = normalize_status(record.get("status"))
+        allowed = STATUS_TRANSITIONS.get(old_status, {})
+        if new_status not in allowed:
+            return {
+                "success": False,
+                "message": f"Cannot change status from {old_status} to {new_status}"
+            }
+        if allowed[new_status] != category:
+            return {
+                "success": False,
+                "message": f"Only Category {allowed[new_status]} officials can mark a complaint {new_status}"
+            }
+
+        now = datetime.datetime.now().isoformat()
+        event = {
+            "complaintId": record["id"],
+            "from": old_status,
+            "to": new_status,
+            "empId": official.get("emp_id"),
+            "category": category,
+            "note": note,
+            "at": now
+        }
+        storage.append_complaint_event(conn, event)
+        record["status"] = new_status
+        record["updatedAt"] = now
+        storage.update_complaint(conn, record)
+        if record.get("userId"):
+            notifications.notify(
+                record["userId"],
+                "Complaint update",
+                f"Your complaint #{record['id']} ({record.get('subject', '')}) is now {new_status.replace('_', ' ')}",
+                kind="complaint_status",
+                conn=conn,
+                extra={"complaintId": record["id"], "status": new_status}
+            )
+
+    return {"success": True, "complaint": record, "event": event}
+
+
+def get_complaint_history(complaint_id):
+    """Every status change of a complaint, oldest first"""
+    return storage.complaint_events(complaint_id)
+
+
+# --- Bulk Import / Export ---
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_uncell(value):
+    if isinstance(value, str) and value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+def _csv_row(record):
+    row = {k: _csv_cell(v) for k, v in record.items()}
+    coordinates = row.pop("coordinates", None) or {}
+    row["lat"], row["lng"] = coordinates.get("lat"), coordinates.get("lng")
+    return row
+
+
+def export_complaints(fmt="jsonl", **filters):
+    """Yield complaints matching query_complaints `filters` as JSON Lines or CSV text"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+    after = None
+    while True:
+        records, _, after = storage.query_complaints(limit=EXPORT_PAGE, after=after, count=False, **filters)
+        if fmt == "csv":
+            writer.writerows(_csv_row(r) for r in records)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        elif records:
+            yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        if after is None:
+            return
+
+
+def read_jsonl(lines):
+    """(line number, record or the parse error) for each non-blank line"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, e
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, {k: _csv_uncell(v) for k, v in row.items()}
+
+
+def validate_import(row):
+    """A complaint record from an imported row; raises ValueError saying what is wrong"""
+    if isinstance(row, Exception):
+        raise ValueError(f"Invalid JSON: {row}")
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object")
+    # Empty CSV cells mean "not given"
+    record = {k: v for k, v in row.items() if k and v not in (None, "")}
+    record.pop("clusterId", None)  # clusters are recomputed on import
+    lat, lng = record.pop("lat", None), record.pop("lng", None)
+    if lat is not None and lng is not None:
+        record["coordinates"] = {"lat": lat, "lng": lng}
+    if "coordinates" in record:
+        try:
+            record["coordinates"] = {k: float(record["coordinates"][k]) for k in ("lat", "lng")}
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("coordinates need numeric lat and lng")
+        if not (-90 <= record["coordinates"]["lat"] <= 90 and -180 <= record["coordinates"]["lng"] <= 180):
+            raise ValueError("coordinates are out of range")
+    if "id" in record:
+        try:
+            record["id"] = int(record["id"])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid id {record['id']!r}")
+        if record["id"] <= 0:
+            raise ValueError(f"Invalid id {record['id']}")
+    if not (record.get("userId") or record.get("username")):
+        raise ValueError("Missing: userId")
+    if not record.get("sector"):
+        raise ValueError("Missing: sector")
+    if not (record.get("subject") or record.get("description")):
+        raise ValueError("Missing: subject or description")
+    for field in ("subject", "description", "location"):
+        if len(str(record.get(field, ""))) > MAX_TEXT_LENGTH:
+            raise ValueError(f"{field} is longer than {MAX_TEXT_LENGTH} characters")
+    record["status"] = normalize_status(record.get("status") or "pending")
+    if record["status"] not in STATUSES:
+        raise ValueError(f"Unknown status {row.get('status')!r}")
+    record["priority"] = str(record.get("priority") or "normal").strip().lower()
+    for field in ("createdAt", "updatedAt"):
+        if field in record:
+            try:
+                record[field] = datetime.datetime.fromisoformat(str(record[field]).replace(" ", "T")).isoformat()
+            except ValueError:
+                raise ValueError(f"Invalid {field} {record[field]!r}")
+    record.setdefault("createdAt", datetime.datetime.now().isoformat())
+    return record
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_complaints(rows):
+    """Validate and store (line number, row) pairs from read_jsonl/read_csv.
+
+    Rows keep their id when they have one, so re-running an import skips what is already
+    there instead of duplicating it. Each batch of IMPORT_BATCH rows is one transaction.
+    Returns {"imported", "skipped", "errors"}; errors lists the first MAX_IMPORT_ERRORS
+    skipped lines.
+    """
+    result = {"imported": 0, "skipped": 0, "errors": []}
+
+    def skip(number, message):
+        result["skipped"] += 1
+        if len(result["errors"]) < MAX_IMPORT_ERRORS:
+            result["errors"].append({"line": number, "message": str(message)})
+
+    for batch in _batches(rows, IMPORT_BATCH):
+        records = []
+        for number, row in batch:
+            try:
+                record = validate_import(row)
+            except ValueError as e:
+                skip(number, e)
+                continue
+            records.append((number, record, clusters.prepare(record)))
+        with storage.transaction() as conn:
+            for number, record, prepared in records:
+                if record.get("id"):
+                    if storage.get_complaint(record["id"], conn):
+                        skip(number, f"Complaint {record['id']} already exists")
+                        continue
+                    storage.advance_sequence(conn, "complaints", record["id"], "complaints")
+                else:
+                    record["id"] = storage.next_id(conn, "complaints", "complaints")
+                # Clustered before the insert so each row is written once
+                clusters.assign(conn, record, prepared)
+                storage.insert_complaint(conn, record)
+                result["imported"] += 1
+    return result
+
+
+def export_to_file(path, fmt=None, **filters):
+    """Write an export to `path` ("-" for stdout); the format defaults to the file extension"""
+    fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    try:
+        for chunk in export_complaints(fmt, **filters):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
 
-def get_complaints_by_sector(sector):
-    """Fetch complaints filtered by sector"""
-    return [c for c in complaints.values() if c["sector"].lower() == sector.lower()]
+def import_from_file(path, fmt=None):
+    fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return import_complaints(read_csv(f) if fmt == "csv" else read_jsonl(f))
 
 
 # --- Interactive Menu ---
@@ -98,26 +345,36 @@ def main():
         print("\n--- Complaint System ---")
         print("1. File a new complaint")
         print("2. View my complaints")
-        print("3. Update complaint status (Admin use)")
+        print("3. Update complaint status (Official use)")
         print("4. View complaints by sector")
-        print("5. Exit")
+        print("5. Export complaints to a file")
+        print("6. Import complaints from a file")
+        print("7. Exit")
 
         choice = input("Enter your choice: ")
 
         if choice == "1":
             try:
-                username = input("Enter your username: ")
-                sector = input("Enter sector (Police, Electricity, Water, Roads, Health, Education, Revenue): ")
-                complaint_text = input("Enter complaint details: ")
-
-                print(add_complaint(username, sector, complaint_text))
+                phone = input("Enter your registered phone number: ")
+                user = login.get_user_by_phone(phone)
+                if not user:
+                    print("❌ Phone number not registered")
+                    continue
+                sector = input(f"Enter sector ({', '.join(SECTORS)}): ")
+                subject = input("Enter complaint subject: ")
+                description = input("Enter complaint details: ")
+                location = input("Enter location: ")
+
+                record = add_complaint(user["id"], sector, subject, description, location)
+                print(f"✅ Complaint filed successfully with ID {record['id']}")
             except Exception as e:
                 print("❌ Error:", e)
 
         elif choice == "2":
             try:
-                username = input("Enter your username: ")
-                my_complaints = get_user_complaints(username)
+                phone = input("Enter your registered phone number: ")
+                user = login.get_user_by_phone(phone)
+                my_complaints = get_user_complaints(user["id"])[0] if user else []
                 if not my_complaints:
                     print("No complaints found.")
                 else:
@@ -128,15 +385,21 @@ def main():
 
         elif choice == "3":
             try:
+                emp_id = input("Enter your employee ID: ")
                 cid = int(input("Enter complaint ID to update: "))
-                new_status = input("Enter new status (Pending/In Process/Resolved/Verified): ")
-                print(update_complaint_status(cid, new_status))
+                new_status = input(f"Enter new status ({'/'.join(STATUSES)}): ")
+                note = input("Enter a note (optional): ")
+                result = update_complaint_status(cid, new_status, emp_id, note)
+                if result["success"]:
+                    print(f"✅ Complaint ID {cid} updated to status: {result['complaint']['status']}")
+                else:
+                    print("❌", result["message"])
             except Exception as e:
                 print("❌ Error:", e)
 
         elif choice == "4":
             sector = input("Enter sector name: ")
-            sector_complaints = get_complaints_by_sector(sector)
+            sector_complaints = get_complaints_by_sector(sector)[0]
             if not sector_complaints:
                 print("No complaints in this sector.")
             else:
@@ -144,6 +407,26 @@ def main():
                     print(c)
 
         elif choice == "5":
+            try:
+                path = input("Enter file name (.jsonl or .csv): ")
+                sector = input("Enter sector (blank for all): ")
+                district = input("Enter district (blank for all): ")
+                export_to_file(path, sector=sector or None, district=district or None)
+                print(f"✅ Exported to {path}")
+            except Exception as e:
+                print("❌ Error:", e)
+
+        elif choice == "6":
+            try:
+                path = input("Enter file name (.jsonl or .csv): ")
+                result = import_from_file(path)
+                print(f"✅ Imported {result['imported']} complaints, skipped {result['skipped']}")
+                for error in result["errors"]:
+                    print(f"   line {error['line']}: {error['message']}")
+            except Exception as e:
+                print("❌ Error:", e)
+
+        elif choice == "7":
             print("Exiting Complaint System. Goodbye!")
             break
 
@@ -152,4 +435,16 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # python complaints.py                         -> interactive menu
+    # python complaints.py export <file|-> [csv]  -> export every complaint
+    # python complaints.py import <file> [csv]     -> bulk-load complaints
+    storage.init_db()
+    if len(sys.argv) >= 3 and sys.argv[1] == "export":
+        export_to_file(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "import":
+        result = import_from_file(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"Imported {result['imported']} complaints, skipped {result['skipped']}")
+        for error in result["errors"]:
+            print(f"  line {error['line']}: {error['message']}")
+    else:
+        main()
@@ -6,9 +6,15 @@ const API_CONFIG = {
         REGISTER: '/register',
         OFFICIAL_LOGIN: '/official/login',
         OFFICIAL_REGISTER: '/official/register',
+        OFFICIAL_DASHBOARD: '/official/dashboard',
         COMPLAINTS: '/complaints',
+        COMPLAINTS_EXPORT: '/complaints/export',
+        COMPLAINTS_IMPORT: '/complaints/import',
         LOCATION: '/location',
+        SCHEME_SEARCH: '/schemes/search',
+        SCHEME_RECOMMEND: '/schemes/recommend',
         NOTIFICATIONS: '/notifications',
+        STREAM: '/stream',
         VOICE: '/voice',
         HEALTH: '/health',
         DOCUMENTS: '/documents'
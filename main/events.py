@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+
+import storage
+
+# Server-sent events: live complaint status changes and notifications per user.
+#
+# The notifications table is the event log: an event's id is its notification id, so a
+# reconnecting client's Last-Event-ID resumes exactly where it stopped. The in-process
+# pub/sub only carries wake-ups; on each one a connection reads its user's rows newer
+# than the last id it sent, a page at a time. A connection therefore holds a cursor and
+# a flag however far behind it is, and a burst of events costs one wake-up.
+#
+# Events written by other worker processes are picked up on the next heartbeat.
+#
+# stream() holds a thread per connection; asgi.py serves the same stream from a coroutine.
+MAX_CONNECTIONS = int(os.environ.get("DIGIGOV_STREAM_MAX_CONNECTIONS", "500"))
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 5000
+PAGE_SIZE = 50
+
+_subscribers = {}  # user id -> set of Subscription
+_connections = 0
+_lock = threading.Lock()
+
+
+class TooManyStreams(Exception):
+    """The process is at MAX_CONNECTIONS; the API answers 503"""
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._pending = threading.Event()
+
+    def wake(self):
+        self._pending.set()
+
+    def wait(self, timeout):
+        """True when woken by a publish, False on timeout"""
+        woken = self._pending.wait(timeout)
+        self._pending.clear()
+        return woken
+
+
+def subscribe(user_id, kind=Subscription):
+    global _connections
+    with _lock:
+        if _connections >= MAX_CONNECTIONS:
+            raise TooManyStreams("Too many open event streams")
+        subscription = kind(str(user_id))
+        _subscribers.setdefault(subscription.user_id, set()).add(subscription)
+        _connections += 1
+    return subscription
+
+
+def unsubscribe(subscription):
+    global _connections
+    with _lock:
+        subscriptions = _subscribers.get(subscription.user_id)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            _connections -= 1
+            if not subscriptions:
+                del _subscribers[subscription.user_id]
+
+
+def publish(user_ids):
+    """Wake every open stream of these users (call once their rows are committed)"""
+    with _lock:
+        for user_id in user_ids:
+            for subscription in _subscribers.get(str(user_id), ()):
+                subscription.wake()
+
+
+def publish_after_commit(user_ids):
+    """Wake the users' streams when the current transaction commits"""
+    user_ids = {str(u) for u in user_ids}
+    if user_ids:
+        storage.after_commit(lambda: publish(user_ids))
+
+
+def stats():
+    with _lock:
+        return {"connections": _connections, "users": len(_subscribers)}
+
+
+def format_event(record):
+    kind = "complaint_status" if record.get("kind") == "complaint_status" else "notification"
+    return f"id: {record['id']}\nevent: {kind}\ndata: {json.dumps(record, ensure_ascii=False)}\n\n"
+
+
+def check_capacity():
+    with _lock:
+        if _connections >= MAX_CONNECTIONS:
+            raise TooManyStreams("Too many open event streams")
+
+
+def stream(user_id, last_id=None):
+    """SSE text for a user's notifications after `last_id`, then live ones as they arrive.
+
+    Without `last_id` only events from now on are sent. Raises TooManyStreams.
+    """
+    check_capacity()
+
+    def generate():
+        # Subscribed inside the generator so a response that is never iterated holds no
+        # slot, and before the first read so nothing committed in between is missed
+        subscription = subscribe(user_id)
+        try:
+            cursor = storage.latest_notification_id(user_id) if last_id is None else last_id
+            yield f"retry: {RETRY_MS}\n\n"
+            while True:
+                while True:
+                    records = storage.notifications_after(user_id, cursor, PAGE_SIZE)
+                    for record in records:
+                        cursor = record["id"]
+                        yield format_event(record)
+                    if len(records) < PAGE_SIZE:
+                        break
+                if not subscription.wait(HEARTBEAT_SECONDS):
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            unsubscribe(subscription)
+
+    return generate()
+
@@ -0,0 +1,122 @@
+import functools
+import json
+import math
+import os
+import threading
+
+# Offline reverse geocoding: coordinates -> state and district.
+#
+# Boundaries come from a GeoJSON FeatureCollection of district polygons (for example the
+# DataMeet India district maps), with the state and district names in each feature's
+# properties. Features are bucketed into a uniform lat/lng grid by bounding box, so a
+# lookup only runs point-in-polygon tests against the few districts touching its cell.
+BOUNDARIES_FILE = os.environ.get("DIGIGOV_BOUNDARIES", "boundaries.geojson")
+GRID_DEGREES = 0.25
+# Results are cached per cell of this many decimal places (3 -> about 110 m)
+CACHE_PRECISION = 3
+
+STATE_KEYS = ("state", "ST_NM", "st_nm", "STATE", "NAME_1")
+DISTRICT_KEYS = ("district", "DISTRICT", "dtname", "NAME_2")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _first(properties, keys):
+    return next((properties[k] for k in keys if properties.get(k)), None)
+
+
+def _point_in_ring(lng, lat, ring):
+    """Even-odd ray casting; `ring` is a list of [lng, lat] pairs as in GeoJSON"""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _point_in_polygon(lng, lat, polygon):
+    # First ring is the outline, the rest are holes
+    if not _point_in_ring(lng, lat, polygon[0]):
+        return False
+    return not any(_point_in_ring(lng, lat, hole) for hole in polygon[1:])
+
+
+def _cell(lat, lng):
+    return math.floor(lat / GRID_DEGREES), math.floor(lng / GRID_DEGREES)
+
+
+class BoundaryIndex:
+    def __init__(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            collection = json.load(f)
+        # (state, district, bbox, polygons)
+        self.regions = []
+        self.grid = {}
+        for feature in collection.get("features", []):
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                continue
+            properties = feature.get("properties") or {}
+            points = [p for polygon in polygons for p in polygon[0]]
+            lngs = [p[0] for p in points]
+            lats = [p[1] for p in points]
+            bbox = (min(lats), min(lngs), max(lats), max(lngs))
+            region_id = len(self.regions)
+            self.regions.append((_first(properties, STATE_KEYS), _first(properties, DISTRICT_KEYS), bbox, polygons))
+            (lat0, lng0), (lat1, lng1) = _cell(bbox[0], bbox[1]), _cell(bbox[2], bbox[3])
+            for row in range(lat0, lat1 + 1):
+                for col in range(lng0, lng1 + 1):
+                    self.grid.setdefault((row, col), []).append(region_id)
+
+    def find(self, lat, lng):
+        for region_id in self.grid.get(_cell(lat, lng), ()):
+            state, district, (min_lat, min_lng, max_lat, max_lng), polygons = self.regions[region_id]
+            if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+                continue
+            if any(_point_in_polygon(lng, lat, polygon) for polygon in polygons):
+                return {"state": state, "district": district}
+        return None
+
+
+def _boundaries():
+    """Load the boundary index on first use; None when no boundary file is installed"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None and os.path.exists(BOUNDARIES_FILE):
+                _index = BoundaryIndex(BOUNDARIES_FILE)
+    return _index
+
+
+@functools.lru_cache(maxsize=65536)
+def _reverse_cell(lat, lng):
+    index = _boundaries()
+    return index.find(lat, lng) if index else None
+
+
+def reverse_geocode(lat, lng):
+    """{"state", "district"} for a coordinate, or None outside the known boundaries"""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    result = _reverse_cell(round(lat, CACHE_PRECISION), round(lng, CACHE_PRECISION))
+    return dict(result) if result else None
+
+
+def describe(place):
+    """'District, State' for display and for a complaint's location field"""
+    if not place:
+        return ""
+    return ", ".join(part for part in (place.get("district"), place.get("state")) if part)
@@ -1,29 +1,164 @@
-import requests
+import csv
+import functools
+import ipaddress
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
 
-def get_location():
+# Local IPv4 geolocation database: no network calls, no work at import time.
+#
+# File layout (little endian):
+#   header  b"DGEO" | uint32 version | uint32 record count
+#   records uint32 first_ip | uint32 last_ip | float32 lat | float32 lng   (sorted by first_ip)
+#
+# Build it from any range CSV (DB-IP / IP2Location LITE style: first_ip,last_ip,...,lat,lng)
+# with `python gps.py build <csv> <out>`. The file is memory-mapped and binary searched,
+# so lookups cost O(log n) page reads and the OS shares the pages between workers.
+GEOIP_DB = os.environ.get("DIGIGOV_GEOIP_DB", "geoip.bin")
+
+MAGIC = b"DGEO"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+RECORD = struct.Struct("<IIff")
+KEY = struct.Struct("<I")
+CACHE_SIZE = 65536
+
+_db = None
+_db_lock = threading.Lock()
+
+
+class GeoIPDatabase:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a DigiGov GeoIP database")
+        if HEADER.size + self.count * RECORD.size > len(self._map):
+            raise ValueError(f"{path} is truncated")
+
+    def find(self, ip):
+        """(lat, lng) of the range containing integer IPv4 `ip`, or None"""
+        lo, hi = 0, self.count
+        # Rightmost record whose first_ip <= ip
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(self._map, HEADER.size + mid * RECORD.size)[0] <= ip:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        first_ip, last_ip, lat, lng = RECORD.unpack_from(self._map, HEADER.size + (lo - 1) * RECORD.size)
+        if ip > last_ip:
+            return None
+        return round(lat, 4), round(lng, 4)
+
+
+def _database():
+    """Open the database on first use; None when it has not been built"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None and os.path.exists(GEOIP_DB):
+                _db = GeoIPDatabase(GEOIP_DB)
+    return _db
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _lookup(ip_int):
+    db = _database()
+    return db.find(ip_int) if db else None
+
+
+def get_location(ip):
     """
-    Get approximate location (latitude and longitude) using IP-based geolocation.
+    Get approximate location (latitude and longitude) of a client IP address.
     Returns:
-        tuple: (latitude, longitude) or None if location cannot be determined.
+        tuple: (latitude, longitude) or None if location cannot be determined
+        (private/loopback address, IPv6, no database, or address not covered).
     """
     try:
-        response = requests.get("https://ipinfo.io")
-        response.raise_for_status()  # Raises an error for bad HTTP status codes
-        data = response.json()
-        if "loc" in data:
-            lat, lon = map(float, data["loc"].split(","))
-            return lat, lon
-        else:
-            print("Location information not available in response.")
-            return None
-    except requests.RequestException as e:
-        print("Error fetching location:", e)
+        addr = ipaddress.ip_address(str(ip).strip())
+    except ValueError:
         return None
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    if addr.version != 4 or not addr.is_global:
+        return None
+    return _lookup(int(addr))
+
+
+def _parse_ip(value):
+    # IP2Location CSVs store addresses as integers, DB-IP as dotted quads
+    value = value.strip()
+    return ipaddress.ip_address(int(value) if value.isdigit() else value)
 
-# Get the coordinates
-coords = get_location()
-if coords:
-    print(f"Approximate Latitude: {coords[0]}")
-    print(f"Approximate Longitude: {coords[1]}")
-else:
-    print("Could not determine location.")
+
+def build_database(csv_path, out_path):
+    """Convert a range CSV into the binary format, skipping rows without coordinates"""
+    records = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 4:
+                continue
+            try:
+                first, last = _parse_ip(row[0]), _parse_ip(row[1])
+                lat, lng = float(row[-2]), float(row[-1])
+            except ValueError:
+                continue  # header row, IPv6 range or missing coordinates
+            if first.version == 4 and last.version == 4:
+                records.append((int(first), int(last), lat, lng))
+    records.sort()
+    tmp_path = out_path + ".part"
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        for record in records:
+            out.write(RECORD.pack(*record))
+    os.replace(tmp_path, out_path)
+    return len(records)
+
+
+def _benchmark(lookups=200000):
+    db = _database()
+    if db is None:
+        raise SystemExit(f"{GEOIP_DB} not found; build it first")
+    ips = [random.getrandbits(32) for _ in range(lookups)]
+    start = time.perf_counter()
+    for ip in ips:
+        db.find(ip)
+    uncached = (time.perf_counter() - start) / lookups
+    hot = ips[:1000]
+    for ip in hot:
+        _lookup(ip)
+    start = time.perf_counter()
+    for _ in range(lookups // len(hot)):
+        for ip in hot:
+            _lookup(ip)
+    cached = (time.perf_counter() - start) / lookups
+    print(f"{db.count} ranges: {uncached * 1e6:.2f} us/lookup uncached, {cached * 1e6:.2f} us/lookup cached")
+
+
+if __name__ == "__main__":
+    # python gps.py build <csv> [out]   -> build the database
+    # python gps.py bench               -> lookup latency
+    # python gps.py <ip>                -> look one address up
+    if len(sys.argv) >= 3 and sys.argv[1] == "build":
+        count = build_database(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else GEOIP_DB)
+        print(f"Wrote {count} ranges")
+    elif len(sys.argv) == 2 and sys.argv[1] == "bench":
+        _benchmark()
+    elif len(sys.argv) == 2:
+        coords = get_location(sys.argv[1])
+        if coords:
+            print(f"Approximate Latitude: {coords[0]}")
+            print(f"Approximate Longitude: {coords[1]}")
+        else:
+            print("Could not determine location.")
+    else:
+        print("usage: python gps.py build <csv> [out] | bench | <ip>")
@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py asgi:app   (run from this directory)
+#
+# One uvicorn worker process per core: within a worker, blocking Flask routes share
+# asgi.WSGI_THREADS threads and event streams share the event loop.
+#
+# Importing the app has no side effects, so it is imported once in the master and the
+# workers fork from it with the code already loaded. Each worker then runs
+# app.create_app() at lifespan startup, so each has its own database connections,
+# background threads, speech recognition pool and scheme index; the job queues and
+# reminders live in SQLite and are safe to share. Lower DIGIGOV_STT_WORKERS when running
+# many workers on a small machine.
+#
+# Streaming voice sessions (POST /api/voice/stream) hold recognizer state that cannot move
+# between processes, and gunicorn does not route a client's requests to the same worker.
+# So one worker hosts every session and the others forward to it over a Unix socket
+# (asgi.py picks the path; see transcription.py). The key is generated here, in the
+# master, so every worker inherits it.
+os.environ.setdefault("DIGIGOV_STT_STREAM_KEY", os.urandom(16).hex())
+
+bind = os.environ.get("DIGIGOV_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("DIGIGOV_WEB_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Event streams send a heartbeat every events.HEARTBEAT_SECONDS, well inside these
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get("DIGIGOV_ACCESS_LOG", "-")
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# --- Configuration ---
+# bcrypt releases the GIL while hashing, so a thread pool spreads the work over all cores
+BCRYPT_ROUNDS = int(os.environ.get("DIGIGOV_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.environ.get("DIGIGOV_HASH_WORKERS", str(os.cpu_count() or 2)))
+# Hash jobs allowed to wait for a worker before new ones are rejected
+HASH_QUEUE_LIMIT = int(os.environ.get("DIGIGOV_HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+
+class PoolBusy(Exception):
+    """Raised when the hashing pool is saturated; the API answers 503"""
+
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "in_flight": 0,
+    "completed": 0,
+    "rejected": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+}
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        with _stats_lock:
+            _stats["completed"] += 1
+            _stats["total_seconds"] += elapsed
+            _stats["max_seconds"] = max(_stats["max_seconds"], elapsed)
+
+
+def _run(func, *args):
+    """Run `func` on the pool and wait for it, or raise PoolBusy if the queue is full"""
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise PoolBusy("Password hashing queue is full")
+    with _stats_lock:
+        _stats["in_flight"] += 1
+    try:
+        return _executor.submit(_timed, func, *args).result()
+    finally:
+        with _stats_lock:
+            _stats["in_flight"] -= 1
+        _slots.release()
+
+
+def hash_password(password):
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return _run(bcrypt.hashpw, password.encode("utf-8"), salt).decode("utf-8")
+
+
+def check_password(password, hashed_password):
+    return _run(bcrypt.checkpw, password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+def needs_rehash(hashed_password):
+    """True when a stored hash was made with a different work factor than BCRYPT_ROUNDS"""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    completed = snapshot["completed"]
+    snapshot["queue_depth"] = max(snapshot["in_flight"] - HASH_WORKERS, 0)
+    snapshot["avg_seconds"] = snapshot["total_seconds"] / completed if completed else 0.0
+    snapshot["workers"] = HASH_WORKERS
+    snapshot["queue_limit"] = HASH_QUEUE_LIMIT
+    snapshot["rounds"] = BCRYPT_ROUNDS
+    return snapshot
@@ -0,0 +1,80 @@
+import json
+import re
+import unicodedata
+
+# Voice commands for the five home-screen blocks. Phrases are matched after normalisation,
+# so case, punctuation and extra spaces do not matter. Native-script and romanised forms
+# are both listed because the recognizer emits whichever its model was trained on.
+INTENT_PHRASES = {
+    "schemes": [
+        "schemes", "scheme", "government schemes", "government scheme",
+        "yojana", "yojanaen", "sarkari yojana",
+        "योजना", "योजनाएं", "सरकारी योजना",
+        "పథకాలు", "పథకం", "ప్రభుత్వ పథకాలు",
+    ],
+    "complaints": [
+        "complaints", "complaint", "raise complaint", "file complaint",
+        "shikayat", "shikayat darj",
+        "शिकायत", "शिकायतें", "शिकायत दर्ज",
+        "ఫిర్యాదు", "ఫిర్యాదులు",
+    ],
+    "children": [
+        "children", "child", "kids", "school", "attendance",
+        "bacche", "bachche",
+        "बच्चे", "बच्चों",
+        "పిల్లలు",
+    ],
+    "bills": [
+        "bill payment", "bill payments", "bills", "bill", "pay bill", "pay bills",
+        "bijli bill", "bill bhugtan",
+        "बिल", "बिल भुगतान", "बिजली बिल",
+        "బిల్లు", "బిల్లులు", "బిల్లు చెల్లింపు",
+    ],
+    "documents": [
+        "documents", "document", "my documents",
+        "dastavez", "kagaz",
+        "दस्तावेज़", "दस्तावेज", "कागज़",
+        "పత్రాలు", "డాక్యుమెంట్స్",
+    ],
+}
+
+# Words people wrap around a command ("open complaints", "शिकायत खोलो") that carry no intent
+FILLER_WORDS = {
+    "open", "go", "to", "show", "me", "the", "please", "my",
+    "kholo", "dikhao", "khol",
+    "खोलो", "दिखाओ", "मेरे", "मेरा",
+    "తెరువు", "చూపించు", "నా",
+}
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFC", str(text or "")).casefold()
+    # Drop punctuation and symbols by category; a \w regex would also strip Indic vowel signs
+    text = "".join(" " if unicodedata.category(c)[0] in "PS" else c for c in text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def _strip_fillers(text):
+    return " ".join(w for w in text.split(" ") if w not in FILLER_WORDS)
+
+
+# Precompiled once: normalised phrase -> intent, with and without filler words
+PHRASE_TO_INTENT = {}
+for _intent, _phrases in INTENT_PHRASES.items():
+    for _phrase in _phrases:
+        PHRASE_TO_INTENT.setdefault(normalize(_phrase), _intent)
+        PHRASE_TO_INTENT.setdefault(_strip_fillers(normalize(_phrase)), _intent)
+PHRASE_TO_INTENT.pop("", None)
+
+# Vosk grammar for the short-clip fast path; "[unk]" lets the recognizer reject anything else
+GRAMMAR = json.dumps(sorted(PHRASE_TO_INTENT) + ["[unk]"], ensure_ascii=False)
+
+
+def match(transcript):
+    """The intent for a spoken command, or None for anything that is not one"""
+    text = normalize(transcript)
+    if not text:
+        return None
+    return PHRASE_TO_INTENT.get(text) or PHRASE_TO_INTENT.get(_strip_fillers(text))
@@ -0,0 +1,110 @@
+import http.client
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+# HTTP load test for comparing serving modes, e.g. the development server against the
+# ASGI workers:
+#
+#   python app.py                              &  python loadtest.py http://localhost:5000
+#   gunicorn -c gunicorn.conf.py asgi:app      &  python loadtest.py http://localhost:5000
+#
+# `concurrency` client threads send a weighted mix of read requests over keep-alive
+# connections for `seconds`, while `streams` idle /api/stream connections are held open
+# (as open browser tabs would). Reports throughput and p50/p99 latency per route. Run it
+# from another machine, or pin it to spare cores: the client is Python too. The dashboard
+# is for officials only: set DIGIGOV_LOADTEST_EMP_ID to an official's employee id, or
+# its requests only measure the 403.
+EMP_ID = os.environ.get("DIGIGOV_LOADTEST_EMP_ID", "")
+ROUTES = [
+    (4, "/api/complaints?limit=20"),
+    (3, "/api/schemes/search?q=pension"),
+    (2, f"/api/official/dashboard?emp_id={EMP_ID}"),
+    (1, "/api/health"),
+]
+
+
+def _percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] * 1000 if values else 0.0
+
+
+def _client(host, port, deadline, results, rng):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    paths = [path for weight, path in ROUTES for _ in range(weight)]
+    while time.monotonic() < deadline:
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 500
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            ok = False
+        results.append((path, time.perf_counter() - start, ok))
+
+
+def _hold_stream(host, port, index, opened, stop):
+    """Open /api/stream and read it until `stop` is set"""
+    try:
+        sock = socket.create_connection((host, port), timeout=60)
+        sock.sendall(f"GET /api/stream?user_id=loadtest-{index} HTTP/1.1\r\nHost: {host}\r\n"
+                     "Accept: text/event-stream\r\n\r\n".encode())
+        if b" 200 " in sock.recv(4096).split(b"\r\n", 1)[0]:
+            opened.append(index)
+        sock.settimeout(1)
+        while not stop.is_set():
+            try:
+                if not sock.recv(4096):
+                    break
+            except socket.timeout:
+                pass
+        sock.close()
+    except OSError:
+        pass
+
+
+def run(url, concurrency=32, seconds=30, streams=0):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    stop, opened = threading.Event(), []
+    holders = [threading.Thread(target=_hold_stream, args=(host, port, i, opened, stop), daemon=True)
+               for i in range(streams)]
+    for thread in holders:
+        thread.start()
+    if streams:
+        time.sleep(2)
+        print(f"{len(opened)} of {streams} event streams open")
+
+    results = []
+    deadline = time.monotonic() + seconds
+    clients = [threading.Thread(target=_client, args=(host, port, deadline, results, random.Random(i)))
+               for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    print(f"{len(results)} requests in {elapsed:.1f}s with {concurrency} clients: "
+          f"{len(results) / elapsed:.0f} req/s, {sum(not ok for _, _, ok in results)} errors")
+    for path in [None] + [path for _, path in ROUTES]:
+        latencies = sorted(t for p, t, ok in results if ok and (path is None or p == path))
+        print(f"  {path or 'all':32} n={len(latencies):7} p50 {_percentile(latencies, 0.5):7.1f} ms  "
+              f"p99 {_percentile(latencies, 0.99):7.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    # python loadtest.py <base url> [concurrency] [seconds] [streams]
+    if len(sys.argv) < 2:
+        print("usage: python loadtest.py <base url> [concurrency] [seconds] [streams]")
+        sys.exit(1)
+    run(sys.argv[1], *(int(a) for a in sys.argv[2:5]))
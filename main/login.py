@@ -1,90 +1,96 @@
-import json
-import bcrypt
+import threading
 from datetime import datetime
 
-def load_users():
+import hashing
+import storage
+
+# In-memory index of users by id, phone and emp_id. Built once from the users table and
+# then refreshed incrementally: every user write bumps a version, so each lookup only
+# asks storage for rows newer than the last one seen (an indexed, usually empty query).
+_index_lock = threading.Lock()
+_index_version = -1
+_users_by_id = {}
+_users_by_phone = {}
+_users_by_emp_id = {}
+
+def _refresh_index():
+    global _index_version
+    with _index_lock:
+        version, changed = storage.users_changed_since(_index_version)
+        for user in changed:
+            _users_by_id[str(user["id"])] = user
+            if user.get("phone"):
+                _users_by_phone[user["phone"]] = user
+            if user.get("emp_id"):
+                _users_by_emp_id[user["emp_id"]] = user
+        _index_version = version
+
+def get_user_by_id(user_id):
+    _refresh_index()
+    return _users_by_id.get(str(user_id))
+
+def get_user_by_phone(phone):
+    _refresh_index()
+    return _users_by_phone.get(phone)
+
+def get_user_by_emp_id(emp_id):
+    _refresh_index()
+    return _users_by_emp_id.get(emp_id)
+
+def _rehash_if_needed(user, password):
+    """Re-hash a verified password when the configured bcrypt cost has changed"""
+    if not hashing.needs_rehash(user["hashed_password"]):
+        return user
     try:
-        with open('users.json', 'r') as f:
-            data = json.load(f)
-            # Migrate existing officials section into users for unified storage
-            if isinstance(data, dict) and 'officials' in data:
-                users_map = data.get('users', {}) or {}
-                officials_map = data.get('officials', {}) or {}
-                # Reassign new ids continuing from current users count
-                next_id = len(users_map) + 1
-                for off in officials_map.values():
-                    # Skip if already present (by emp_id match)
-                    already = False
-                    for u in users_map.values():
-                        if u.get('emp_id') and u.get('emp_id') == off.get('emp_id'):
-                            already = True
-                            break
-                    if already:
-                        continue
-                    new_id = str(next_id)
-                    next_id += 1
-                    merged = dict(off)
-                    merged['id'] = new_id
-                    merged['role'] = 'official'
-                    users_map[new_id] = merged
-                # Remove officials key after migration
-                data['users'] = users_map
-                data.pop('officials', None)
-                # Persist migration
-                save_users(data)
-            # Ensure users key exists
-            if 'users' not in data:
-                data['users'] = {}
-            return data
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"users": {}}
-
-def save_users(users_data):
-    with open('users.json', 'w') as f:
-        json.dump(users_data, f, indent=4)
+        updated = dict(user, hashed_password=hashing.hash_password(password))
+        with storage.transaction() as conn:
+            storage.upsert_user(conn, updated)
+        _refresh_index()
+        return updated
+    except hashing.PoolBusy:
+        # Not worth failing a successful login over; try again next time
+        return user
 
 def register_user(data):
-    print("Starting registration with data:", data)  # Debug print
-    
-    users_data = load_users()
-    
     # Check if phone number already exists
-    for user in users_data["users"].values():
-        if user["phone"] == data["phone"]:
-            return {
-                "success": False,
-                "message": "Phone number already registered"
-            }
-    
-    # Generate new user ID
-    user_id = str(len(users_data["users"]) + 1)
+    if get_user_by_phone(data["phone"]):
+        return {
+            "success": False,
+            "message": "Phone number already registered"
+        }
     
     # Hash password
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(data["password"].encode('utf-8'), salt)
+    hashed_password = hashing.hash_password(data["password"])
     
     # Create user entry
     new_user = {
-        "id": user_id,
+        "id": None,  # assigned by storage.insert_user
         "name": data["name"],
         "phone": data["phone"],
         "aadhaar": data["aadhaar"],
         "email": data.get("email", ""),
         "address": data.get("address", ""),
+        "state": data.get("state", ""),
+        "district": data.get("district", ""),
+        # [{"name", "role", "age"}]; personalises scheme recommendations and reminders
+        "family": data.get("family", []),
         "role": data.get("role", "citizen"),
         "created_at": datetime.now().isoformat(),
-        "hashed_password": hashed_password.decode('utf-8')
+        "hashed_password": hashed_password
     }
     
-    # Add to users
-    users_data["users"][user_id] = new_user
-    
-    # Save to file
+    # Save, re-checking the phone inside the write transaction in case of a concurrent registration
     try:
-        save_users(users_data)
-        print("User saved successfully")  # Debug print
+        with storage.transaction() as conn:
+            if storage.find_user("phone", data["phone"], conn):
+                return {
+                    "success": False,
+                    "message": "Phone number already registered"
+                }
+            storage.insert_user(conn, new_user)
+        _refresh_index()
     except Exception as e:
-        print("Error saving user:", str(e))  # Debug print
+        print("Error saving user:", str(e))
         return {
             "success": False,
             "message": "Failed to save user data"
@@ -98,14 +104,7 @@ def register_user(data):
     }
 
 def verify_login(phone, password):
-    users_data = load_users()
-    
-    # Find user by phone
-    user = None
-    for u in users_data["users"].values():
-        if u["phone"] == phone:
-            user = u
-            break
+    user = get_user_by_phone(phone)
     
     if not user:
         return {
@@ -114,7 +113,8 @@ def verify_login(phone, password):
         }
     
     # Verify password
-    if bcrypt.checkpw(password.encode('utf-8'), user["hashed_password"].encode('utf-8')):
+    if hashing.check_password(password, user["hashed_password"]):
+        user = _rehash_if_needed(user, password)
         return {
             "success": True,
             "message": "Login successful",
@@ -127,32 +127,28 @@ def verify_login(phone, password):
     }
 
 def register_official(data):
-    users_data = load_users()
-
     # Check duplicate by emp_id inside unified users
-    for u in users_data.get('users', {}).values():
-        if u.get('emp_id') == data['emp_id']:
-            return {"success": False, "message": "Employee ID already registered"}
-
-    official_id = str(len(users_data.get('users', {})) + 1)
+    if get_user_by_emp_id(data['emp_id']):
+        return {"success": False, "message": "Employee ID already registered"}
 
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(data["password"].encode('utf-8'), salt)
+    hashed_password = hashing.hash_password(data["password"])
 
     new_official = {
-        "id": official_id,
+        "id": None,  # assigned by storage.insert_user
         "emp_id": data["emp_id"],
         "name": data["name"],
         "department": data["department"],
         "category": data["category"],
         "role": "official",
         "created_at": datetime.now().isoformat(),
-        "hashed_password": hashed_password.decode('utf-8')
+        "hashed_password": hashed_password
     }
 
-    users_data["users"][official_id] = new_official
-
-    save_users(users_data)
+    with storage.transaction() as conn:
+        if storage.find_user("emp_id", data["emp_id"], conn):
+            return {"success": False, "message": "Employee ID already registered"}
+        storage.insert_user(conn, new_official)
+    _refresh_index()
     return {
         "success": True,
         "message": "Official registered successfully",
@@ -160,17 +156,13 @@ def register_official(data):
     }
 
 def verify_official_login(emp_id, password):
-    users_data = load_users()
-    official = None
-    for u in users_data.get('users', {}).values():
-        if u.get('role') == 'official' and u.get('emp_id') == emp_id:
-            official = u
-            break
-
-    if not official:
+    official = get_user_by_emp_id(emp_id)
+
+    if not official or official.get('role') != 'official':
         return {"success": False, "message": "Official not found"}
 
-    if bcrypt.checkpw(password.encode('utf-8'), official["hashed_password"].encode('utf-8')):
+    if hashing.check_password(password, official["hashed_password"]):
+        official = _rehash_if_needed(official, password)
         return {
             "success": True,
             "message": "Login successful",
@@ -0,0 +1,247 @@
+import bisect
+import cProfile
+import functools
+import glob
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Request metrics in the Prometheus text format, served at /api/metrics.
+#
+# Every request is counted by route, method and status, and its latency and body sizes go
+# into histograms. instrument() wraps a module's functions so the time spent in storage
+# calls and bcrypt is broken down by function. Collectors add point-in-time values
+# (queue depths, open streams) from the modules' own stats() at scrape time.
+#
+# The numbers are per process: behind gunicorn each scrape sees the worker that answered
+# it, identified by the pid label of digigov_process_info.
+#
+# Slow-request profiling is opt-in: with DIGIGOV_PROFILE_SLOW_MS set, a PROFILE_SAMPLE
+# fraction of requests run under cProfile (one at a time per process), and those that
+# take at least that long are written to PROFILE_DIR for `python -m pstats`.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+PROFILE_SLOW_MS = float(os.environ.get("DIGIGOV_PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE = float(os.environ.get("DIGIGOV_PROFILE_SAMPLE", "0.05"))
+PROFILE_DIR = os.environ.get("DIGIGOV_PROFILE_DIR", "profiles")
+PROFILE_KEEP = 200
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+_started_at = time.time()
+
+
+# --- Metric Types ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+def register_collector(collect):
+    """Add a function returning [(name, type, help, value)] read at every scrape"""
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics, collectors = list(_metrics), list(_collectors)
+    lines = [
+        "# HELP digigov_process_info The process these numbers come from",
+        "# TYPE digigov_process_info gauge",
+        f'digigov_process_info{{pid="{os.getpid()}"}} 1',
+        "# HELP digigov_process_start_time_seconds When this process started",
+        "# TYPE digigov_process_start_time_seconds gauge",
+        f"digigov_process_start_time_seconds {_started_at}",
+    ]
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collect in collectors:
+        try:
+            samples = collect()
+        except Exception as e:
+            print("Metrics collector error:", e)
+            continue
+        for name, kind, help_text, value in samples:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+# --- Request Metrics ---
+
+REQUESTS = Counter("digigov_http_requests_total", "HTTP requests by route, method and status",
+                   ("route", "method", "status"))
+LATENCY = Histogram("digigov_http_request_duration_seconds",
+                    "Time to produce the response (streamed bodies not included)", ("route", "method"))
+REQUEST_SIZE = Histogram("digigov_http_request_size_bytes", "Request body sizes", ("route",), SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram("digigov_http_response_size_bytes",
+                          "Response body sizes (when known up front)", ("route",), SIZE_BUCKETS)
+CALL_SECONDS = Histogram("digigov_call_duration_seconds",
+                         "Time in instrumented storage and password hashing calls", ("module", "function"))
+PROFILES = Counter("digigov_slow_request_profiles_total", "Slow-request profiles written", ("route",))
+
+_profile_lock = threading.Lock()
+
+
+class RequestTimer:
+    """Times one request and, when sampled, profiles it"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.profiler = None
+        if PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE and _profile_lock.acquire(blocking=False):
+            try:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler (a debugger, say) is already active
+                self.profiler = None
+                _profile_lock.release()
+
+    def finish(self, route, method, status, request_bytes=None, response_bytes=None):
+        elapsed = time.perf_counter() - self.start
+        REQUESTS.inc(route, method, str(status))
+        LATENCY.observe(elapsed, route, method)
+        if request_bytes is not None:
+            REQUEST_SIZE.observe(request_bytes, route)
+        if response_bytes is not None:
+            RESPONSE_SIZE.observe(response_bytes, route)
+        profiler = self.close()
+        if profiler is not None and elapsed * 1000 >= PROFILE_SLOW_MS:
+            _save_profile(profiler, route, elapsed)
+
+    def close(self):
+        """Stop profiling (if this request was); returns the profiler"""
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+        return profiler
+
+
+def _save_profile(profiler, route, elapsed):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{elapsed * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)
+        PROFILES.inc(route)
+        # Keep the newest PROFILE_KEEP; the names sort by time
+        for old in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.prof")))[:-PROFILE_KEEP]:
+            os.remove(old)
+    except OSError as e:
+        print("Profile write error:", e)
+
+
+# --- Call Timing ---
+
+def timed(module_name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            CALL_SECONDS.observe(time.perf_counter() - start, module_name, func.__name__)
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def timed_context(module_name, func):
+    """timed() for a context manager factory: times the whole `with` block"""
+    @contextmanager
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with func(*args, **kwargs) as value:
+                yield value
+        finally:
+            CALL_SECONDS.observe(time.perf_counter() - start, module_name, func.__name__)
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def instrument(module, names, contexts=()):
+    """Time calls to `module`'s functions `names` and context managers `contexts`.
+
+    Only calls made through the module attribute are seen, which is how this codebase
+    calls them.
+    """
+    for wrap, group in ((timed, names), (timed_context, contexts)):
+        for name in group:
+            func = getattr(module, name)
+            if not getattr(func, "__wrapped_by_metrics__", False):
+                setattr(module, name, wrap(module.__name__, func))
+
+
+def public_functions(module, skip=()):
+    """Names of the public functions defined in `module` itself"""
+    return [name for name, value in vars(module).items()
+            if callable(value) and getattr(value, "__module__", None) == module.__name__
+            and not name.startswith("_") and not isinstance(value, type) and name not in skip]
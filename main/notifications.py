@@ -1,14 +1,376 @@
+import collections
+import os
+import sys
+import threading
 import time
-from plyer import notification
+import traceback
+from datetime import datetime
+
+import events
+import login
+import storage
+
+# Every notification goes into the user's inbox (the notifications table) and, for users
+# with a phone number, into a delivery job for the outbound transport. Both live in the
+# main database, so nothing is lost across restarts.
+#
+# A broadcast (say, a reminder to every parent in a district) is a single fan-out job.
+# A worker walks the users table a page at a time. Each page's inbox rows, its delivery
+# jobs and the fan-out cursor are written in one transaction, so an interrupted fan-out
+# resumes at the next page without duplicates. Delivery jobs carry a batch of recipients
+# and are sent at no more than RATE messages per second per process.
+FANOUT_KIND = "notification_fanout"
+DELIVERY_KIND = "notification_delivery"
+TRANSPORT = os.environ.get("DIGIGOV_NOTIFY_TRANSPORT", "stub")
+RATE = float(os.environ.get("DIGIGOV_NOTIFY_RATE", "50"))
+WORKERS = int(os.environ.get("DIGIGOV_NOTIFY_WORKERS", "1"))
+SMS_URL = os.environ.get("DIGIGOV_SMS_URL", "")
+SMS_TOKEN = os.environ.get("DIGIGOV_SMS_TOKEN", "")
+PAGE_SIZE = 1000
+DELIVERY_BATCH = 100
+POLL_SECONDS = 5
+MAX_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 60
+
+CHILD_ROLES = {"son", "daughter", "child"}
+CHILD_AGE = 18
+
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+# --- Transports ---
+# A transport sends a batch of {"phone", "title", "message"} dicts and returns one entry
+# per message: None when it was accepted, otherwise an error string. Their optional
+# libraries (requests, plyer) are imported only when that transport is selected.
+
+class StubTransport:
+    """Keeps the most recent messages in memory instead of sending them"""
+
+    def __init__(self, keep=10000):
+        self.sent = collections.deque(maxlen=keep)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        with self._lock:
+            self.sent.extend(messages)
+            self.count += len(messages)
+        print(f"Notification stub: {len(messages)} messages ({self.count} total)")
+        return [None] * len(messages)
+
+
+class GatewayTransport:
+    """POSTs each batch as JSON to an SMS/push gateway at DIGIGOV_SMS_URL.
+
+    The gateway may answer {"results": [{"error": ...} | {}, ...]} to report failures per
+    message; any other 2xx response counts as all accepted.
+    """
+
+    def __init__(self):
+        try:
+            import requests
+        except ImportError:
+            raise RuntimeError("requests is not installed")
+        if not SMS_URL:
+            raise RuntimeError("DIGIGOV_SMS_URL is not set")
+        self._session = requests.Session()
+
+    def send(self, messages):
+        headers = {"Authorization": f"Bearer {SMS_TOKEN}"} if SMS_TOKEN else {}
+        response = self._session.post(SMS_URL, json={"messages": messages}, headers=headers, timeout=30)
+        response.raise_for_status()
+        try:
+            results = response.json().get("results")
+        except ValueError:
+            results = None
+        if isinstance(results, list) and len(results) == len(messages):
+            return [r.get("error") if isinstance(r, dict) else None for r in results]
+        return [None] * len(messages)
+
+
+class DesktopTransport:
+    """Desktop popups through plyer; only useful when the server is someone's own machine"""
+
+    def __init__(self):
+        try:
+            from plyer import notification
+        except ImportError:
+            raise RuntimeError("plyer is not installed")
+        self._notification = notification
+
+    def send(self, messages):
+        for message in messages:
+            self._notification.notify(title=message["title"], message=message["message"], timeout=5)
+        return [None] * len(messages)
+
+
+TRANSPORTS = {"stub": StubTransport, "sms": GatewayTransport, "desktop": DesktopTransport}
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def register_transport(name, factory):
+    """Make a transport selectable with DIGIGOV_NOTIFY_TRANSPORT=<name>"""
+    TRANSPORTS[name] = factory
+
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if TRANSPORT not in TRANSPORTS:
+                raise RuntimeError(f"Unknown notification transport {TRANSPORT!r}")
+            _transport = TRANSPORTS[TRANSPORT]()
+        return _transport
+
+
+class RateLimiter:
+    """Token bucket shared by the delivery threads of a process"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Saving up is capped at one second's worth, so an idle period does not turn
+            # into a burst
+            self._allowance = min(self._allowance + (now - self._last) * self.rate, self.rate)
+            self._last = now
+            self._allowance -= count
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+_limiter = RateLimiter(RATE)
+
+
+# --- Sending ---
+
+def _record(user_id, title, message, kind, extra=None):
+    record = {
+        "userId": str(user_id),
+        "title": title,
+        "message": message,
+        "kind": kind,
+        "createdAt": datetime.now().isoformat()
+    }
+    if extra:
+        record.update(extra)
+    return record
+
+
+def _enqueue_recipients(conn, recipients, title=None, message=None):
+    """Delivery jobs of up to DELIVERY_BATCH recipients each.
+
+    A recipient is {"userId", "phone"} plus its own "title"/"message" when they differ
+    from the job's.
+    """
+    for start in range(0, len(recipients), DELIVERY_BATCH):
+        storage.enqueue_job(conn, DELIVERY_KIND, {
+            "title": title,
+            "message": message,
+            "recipients": recipients[start:start + DELIVERY_BATCH]
+        })
+    if recipients:
+        _wakeup.set()
+
+
+def _enqueue_deliveries(conn, users, title, message):
+    recipients = [{"userId": str(u["id"]), "phone": u["phone"]} for u in users if u.get("phone")]
+    _enqueue_recipients(conn, recipients, title, message)
+
+
+def notify(user_id, title, message, kind="info", conn=None, extra=None):
+    """Put a notification in one user's inbox and queue it for delivery.
+
+    Pass `conn` to make it part of the caller's transaction; `extra` fields are stored
+    with the inbox record.
+    """
+    if conn is None:
+        with storage.transaction() as conn:
+            return notify(user_id, title, message, kind, conn, extra)
+    record = _record(user_id, title, message, kind, extra)
+    storage.insert_notifications(conn, [record])
+    events.publish_after_commit([user_id])
+    user = login.get_user_by_id(user_id)
+    if user:
+        _enqueue_deliveries(conn, [user], title, message)
+    return record
+
+
+def notify_many(conn, items):
+    """Inbox rows and batched delivery jobs for many (user, title, message, kind) at once"""
+    storage.insert_notifications(conn, [_record(u["id"], t, m, k) for u, t, m, k in items])
+    events.publish_after_commit(u["id"] for u, t, m, k in items)
+    _enqueue_recipients(conn, [
+        {"userId": str(u["id"]), "phone": u["phone"], "title": t, "message": m}
+        for u, t, m, k in items if u.get("phone")
+    ])
+
+
+def matches(user, audience):
+    """Whether `user` is in a broadcast audience.
+
+    audience keys, all optional: role (default "citizen"), state, district, and parents
+    (true for users with a child in their family details).
+    """
+    if user.get("role", "citizen") != audience.get("role", "citizen"):
+        return False
+    for field in ("state", "district"):
+        wanted = audience.get(field)
+        if wanted and str(user.get(field, "")).strip().casefold() != str(wanted).strip().casefold():
+            return False
+    if audience.get("parents"):
+        family = user.get("family") or []
+        return any(
+            str(m.get("role", "")).strip().lower() in CHILD_ROLES
+            or (str(m.get("age", "")).isdigit() and int(m["age"]) < CHILD_AGE)
+            for m in family
+        )
+    return True
+
+
+def broadcast(audience, title, message, kind="broadcast", sent_by=None):
+    """Queue a notification for everyone in `audience`; returns the fan-out job id.
+
+    Costs one insert however many users match. Pass audience={"user_ids": [...]} to
+    address an explicit list instead of a filter.
+    """
+    with storage.transaction() as conn:
+        job_id = storage.enqueue_job(conn, FANOUT_KIND, {
+            "audience": audience,
+            "title": title,
+            "message": message,
+            "kind": kind,
+            "sentBy": sent_by,
+            "cursor": None,
+            "sent": 0
+        })
+    _wakeup.set()
+    return job_id
+
+
+def _next_page(data):
+    """(matching users, cursor after this page, whether there was a page) for a fan-out"""
+    audience, cursor = data["audience"], data.get("cursor")
+    if "user_ids" in audience:
+        start = cursor or 0
+        ids = audience["user_ids"][start:start + PAGE_SIZE]
+        users = [login.get_user_by_id(i) for i in ids]
+        return [u for u in users if u], start + len(ids), bool(ids)
+    users = storage.users_page(cursor, PAGE_SIZE)
+    matching = [u for u in users if matches(u, audience)]
+    return matching, users[-1]["id"] if users else cursor, bool(users)
+
+
+def _fan_out(job):
+    data = job["data"]
+    while True:
+        users, cursor, more = _next_page(data)
+        if not more:
+            return
+        with storage.transaction() as conn:
+            records = [_record(u["id"], data["title"], data["message"], data["kind"],
+                               {"broadcastId": job["id"]}) for u in users]
+            storage.insert_notifications(conn, records)
+            events.publish_after_commit(u["id"] for u in users)
+            _enqueue_deliveries(conn, users, data["title"], data["message"])
+            data["cursor"] = cursor
+            data["sent"] += len(users)
+            storage.update_job(conn, job["id"], data)
+
+
+def _deliver(job):
+    data = job["data"]
+    recipients = data["recipients"]
+    _limiter.acquire(len(recipients))
+    messages = [{"phone": r["phone"], "title": r.get("title") or data["title"],
+                 "message": r.get("message") or data["message"]} for r in recipients]
+    errors = get_transport().send(messages)
+    failed = [r for r, error in zip(recipients, errors) if error]
+    if not failed:
+        return
+    # Retry only the recipients the gateway rejected
+    data["recipients"] = failed
+    with storage.transaction() as conn:
+        storage.update_job(conn, job["id"], data)
+    raise RuntimeError(f"{len(failed)} of {len(recipients)} messages failed: {next(e for e in errors if e)}")
+
+
+def process_one():
+    """Run one queued fan-out or delivery job; returns False when the queue is empty"""
+    job = storage.claim_job([FANOUT_KIND, DELIVERY_KIND])
+    if job is None:
+        return False
+    try:
+        if job["kind"] == FANOUT_KIND:
+            _fan_out(job)
+        else:
+            _deliver(job)
+        storage.finish_job(job["id"])
+    except Exception as e:
+        print("Notification error:", e)
+        traceback.print_exc()
+        status = "pending" if job["attempts"] < MAX_ATTEMPTS else "failed"
+        # A failing gateway is usually down for a while: hold this job back (in the
+        # database, so it survives restarts) while the worker gets on with other jobs
+        storage.finish_job(job["id"], status, str(e),
+                           retry_after=min(2 ** job["attempts"], MAX_BACKOFF_SECONDS))
+    return True
+
+
+def _worker_loop():
+    while True:
+        try:
+            if process_one():
+                continue
+        except Exception as e:
+            print("Notification worker error:", e)
+        _wakeup.wait(POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_workers(count=WORKERS):
+    """Start the background notification threads once per process"""
+    global _started
+    with _start_lock:
+        if _started or count <= 0:
+            return
+        for i in range(count):
+            threading.Thread(target=_worker_loop, name=f"notify-{i}", daemon=True).start()
+        _started = True
+
+
+# --- Inbox ---
+
+def inbox(user_id, limit=50, before=None, unread_only=False):
+    """(a page of notifications, newest first; unread count)"""
+    return (storage.list_notifications(user_id, limit, before, unread_only),
+            storage.unread_notifications(user_id))
+
+
+def mark_read(user_id, ids=None):
+    with storage.transaction() as conn:
+        return storage.mark_notifications_read(conn, user_id, ids)
 
-def send_notification(title, message):
-    notification.notify(
-        title=title,
-        message=message,
-        timeout=5   # seconds
-    )
 
 if __name__ == "__main__":
-    send_notification("DigiGov", "Reminder: Check new schemes today!")
-    time.sleep(2)
-    send_notification("DigiGov", "Don’t forget to send your child to school 📚")
+    # python notifications.py                                  -> standalone worker
+    # python notifications.py broadcast <state> <title> <message> -> queue a broadcast
+    storage.init_db()
+    if len(sys.argv) == 5 and sys.argv[1] == "broadcast":
+        print(f"Queued fan-out job {broadcast({'state': sys.argv[2]}, sys.argv[3], sys.argv[4])}")
+    else:
+        # Run with DIGIGOV_NOTIFY_WORKERS=0 on the API servers
+        while True:
+            if not process_one():
+                time.sleep(POLL_SECONDS)
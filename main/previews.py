@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+import traceback
+
+import blobstore
+import storage
+
+# Optional imaging libraries. Without Pillow no workers start and jobs stay queued until
+# a process that has it runs; without PyMuPDF (imported on the first PDF) only PDF jobs
+# fail.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+JOB_KIND = "document_preview"
+WORKERS = int(os.environ.get("DIGIGOV_PREVIEW_WORKERS", "2"))
+POLL_SECONDS = 5
+MAX_ATTEMPTS = 3
+
+# name -> (longest side in pixels, WebP quality)
+VARIANTS = {
+    "thumbnail": (320, 60),
+    "preview": (1280, 70),
+}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+PDF_EXTENSIONS = {".pdf"}
+
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+def variant_path(digest, variant):
+    """Variants live next to the blob they were made from, so identical uploads share them"""
+    return f"{blobstore.blob_path(digest)}.{variant}.webp"
+
+
+def wants_preview(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext in IMAGE_EXTENSIONS or ext in PDF_EXTENSIONS
+
+
+def enqueue(conn, record):
+    """Queue preview generation for a stored document (call inside its transaction)"""
+    if record.get("sha256") and wants_preview(record.get("original_name")):
+        storage.enqueue_job(conn, JOB_KIND, {
+            "sha256": record["sha256"],
+            "name": record.get("original_name"),
+        })
+        _wakeup.set()
+
+
+def _open_image(path, name):
+    if os.path.splitext(name or "")[1].lower() in PDF_EXTENSIONS:
+        try:
+            import fitz  # PyMuPDF, renders the first page of PDFs
+        except ImportError:
+            raise RuntimeError("PyMuPDF is not installed; cannot render PDF previews")
+        with fitz.open(path) as pdf:
+            if pdf.page_count == 0:
+                raise ValueError("PDF has no pages")
+            # Enough resolution for the largest variant
+            pix = pdf[0].get_pixmap(dpi=110)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    image = Image.open(path)
+    # Phone photos are often stored sideways with an EXIF rotation flag
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    return image
+
+
+def generate(digest, name):
+    """Write every missing variant of blob `digest`"""
+    if Image is None:
+        raise RuntimeError("Pillow is not installed; cannot generate previews")
+    source = blobstore.blob_path(digest)
+    if not os.path.exists(source):
+        # Document deleted before its preview was made
+        return
+    pending = {v: spec for v, spec in VARIANTS.items() if not os.path.exists(variant_path(digest, v))}
+    if not pending:
+        return
+    image = _open_image(source, name)
+    # Largest first, so each smaller variant is scaled from an already reduced copy
+    for variant, (longest_side, quality) in sorted(pending.items(), key=lambda item: -item[1][0]):
+        image.thumbnail((longest_side, longest_side))
+        target = variant_path(digest, variant)
+        tmp_path = target + ".part"
+        image.save(tmp_path, format="WEBP", quality=quality, method=4)
+        os.replace(tmp_path, target)
+
+
+def process_one():
+    """Run one queued job; returns False when the queue is empty"""
+    job = storage.claim_job([JOB_KIND])
+    if job is None:
+        return False
+    try:
+        generate(job["data"]["sha256"], job["data"].get("name"))
+        storage.finish_job(job["id"])
+    except Exception as e:
+        print("Preview error:", e)
+        traceback.print_exc()
+        status = "pending" if job["attempts"] < MAX_ATTEMPTS else "failed"
+        storage.finish_job(job["id"], status, str(e))
+    return True
+
+
+def _worker_loop():
+    while True:
+        try:
+            if process_one():
+                continue
+        except Exception as e:
+            print("Preview worker error:", e)
+        _wakeup.wait(POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_workers(count=WORKERS):
+    """Start the background preview threads once per process"""
+    global _started
+    with _start_lock:
+        if _started or count <= 0:
+            return
+        if Image is None:
+            print("Pillow is not installed; document previews stay queued")
+            return
+        for i in range(count):
+            threading.Thread(target=_worker_loop, name=f"preview-{i}", daemon=True).start()
+        _started = True
+
+
+if __name__ == "__main__":
+    # Standalone worker: run with DIGIGOV_PREVIEW_WORKERS=0 on the API servers
+    storage.init_db()
+    while True:
+        if not process_one():
+            time.sleep(POLL_SECONDS)
@@ -0,0 +1,435 @@
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import schemes
+
+# Semantic scheme recommendations.
+#
+# Every scheme in the catalogue is embedded once and the vectors are kept on disk as a
+# float16 .npy matrix that is memory-mapped at load, so the OS shares one copy between
+# workers. A query is embedded, optionally blended with the user's profile, and scored
+# against the matrix in row blocks (a float32 matrix-vector product per block) followed by
+# an argpartition top-k. Large catalogues add an IVF index so a query only reads a slice.
+#
+# DIGIGOV_EMBED_MODEL names a sentence-transformers model to embed with (for example
+# paraphrase-multilingual-MiniLM-L12-v2). Without one, a built-in hashing encoder over the
+# romanised search tokens and their character trigrams is used: no download, CPU only,
+# and it still matches across scripts and spelling variants.
+EMBEDDINGS_FILE = os.environ.get("DIGIGOV_SCHEME_EMBEDDINGS", "scheme_embeddings.npy")
+EMBED_MODEL = os.environ.get("DIGIGOV_EMBED_MODEL", "")
+HASH_DIM = 512
+ENCODE_BATCH = 256
+# Rows multiplied at a time; bounds the float32 working copy of the float16 matrix
+BLOCK_ROWS = 16384
+# How much of the query vector the user's profile contributes
+PROFILE_WEIGHT = 0.35
+# Catalogues this large also get an IVF index (k-means lists); a query then only scores
+# the rows in the lists whose centroids are closest to it
+IVF_MIN_ROWS = 4096
+IVF_PROBES = int(os.environ.get("DIGIGOV_RECOMMEND_PROBES", "16"))
+
+# Family roles (as entered at registration) -> what schemes for that person are about
+ROLE_INTERESTS = {
+    "farmer": "farmer agriculture crop land kisan",
+    "son": "child education school scholarship",
+    "daughter": "girl child education school savings",
+    "child": "child education school vaccination",
+    "student": "student education scholarship",
+    "mother": "women maternity health",
+    "wife": "women health",
+    "father": "employment wage",
+    "husband": "employment wage",
+    "grandfather": "senior citizen old age pension",
+    "grandmother": "senior citizen old age pension women",
+    "elderly": "senior citizen old age pension",
+    "disabled": "disability pension",
+    "unemployed": "employment guarantee wage job",
+}
+SENIOR_AGE = 60
+CHILD_AGE = 18
+
+
+class Unavailable(Exception):
+    """NumPy is not installed; the API answers 503"""
+
+
+class HashingEncoder:
+    """Feature-hashed bag of search tokens and character trigrams, L2-normalised"""
+    name = f"hashing-{HASH_DIM}"
+    dim = HASH_DIM
+
+    def _features(self, text):
+        for token in schemes.tokenize(text):
+            yield token, 1.0
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def encode(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                # crc32 rather than hash(): the matrix on disk must match across processes
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-9)
+
+
+class ModelEncoder:
+    def __init__(self, model_name):
+        # Imported here: it pulls in torch, which takes seconds to load
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        return self._model.encode(list(texts), batch_size=64, normalize_embeddings=True,
+                                  convert_to_numpy=True).astype(np.float32)
+
+
+def scheme_text(scheme):
+    parts = [scheme.get("title"), scheme.get("description"), scheme.get("category"),
+             scheme.get("eligibility")]
+    parts += scheme.get("benefits") or []
+    parts += scheme.get("aliases") or []
+    return " ".join(str(p) for p in parts if p)
+
+
+def _fingerprint(encoder, texts):
+    digest = hashlib.sha256(encoder.name.encode("utf-8"))
+    for text in texts:
+        digest.update(text.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+# --- Embedding Matrix ---
+_state = None  # (scheme index, encoder, matrix, IVF index or None)
+_state_lock = threading.Lock()
+_encoder = None
+_masks = {}
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None:
+        _encoder = HashingEncoder()
+        if EMBED_MODEL:
+            try:
+                _encoder = ModelEncoder(EMBED_MODEL)
+            except ImportError:
+                pass
+    return _encoder
+
+
+class IVFIndex:
+    """Spherical k-means partition of the matrix rows into inverted lists"""
+
+    def __init__(self, centroids, order, bounds):
+        self.centroids = centroids
+        # Row ids grouped by list; list c is order[bounds[c]:bounds[c + 1]]
+        self.order = order
+        self.bounds = bounds
+
+    @classmethod
+    def train(cls, matrix, iterations=8, seed=7):
+        count = matrix.shape[0]
+        lists = int(math.sqrt(count))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, min(count, lists * 64), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            filled = np.bincount(assign, minlength=lists) > 0
+            centroids[filled] = sums[filled]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-9)
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable").astype(np.int32)
+        bounds = np.searchsorted(assignment[order], np.arange(lists + 1))
+        return cls(centroids, order, bounds)
+
+    def save(self, f):
+        np.savez(f, centroids=self.centroids, order=self.order, bounds=self.bounds)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["order"], data["bounds"])
+
+    def candidates(self, query, probes):
+        """Row ids in the `probes` lists nearest to `query`, in ascending order"""
+        probes = min(probes, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        rows = np.concatenate([self.order[self.bounds[c]:self.bounds[c + 1]] for c in nearest])
+        rows.sort()  # read the memory map front to back
+        return rows
+
+
+def _replace_atomically(path, write):
+    """Call write(file) on a temp file private to this process, then move it to `path`"""
+    tmp_path = f"{path}.{os.getpid()}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def _build_lock(path):
+    """Exclusive across processes, so gunicorn workers starting together build the matrix once"""
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None  # Windows: no lock, but each builder still writes its own temp files
+    with open(path + ".lock", "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build(index, encoder, path=EMBEDDINGS_FILE):
+    """Embed every scheme in `index` and write the float16 matrix plus its metadata.
+
+    Call it under _build_lock(path) when other processes may be reading or building.
+    """
+    texts = [scheme_text(s) for s in index.schemes]
+    tmp_path = f"{path}.{os.getpid()}.part"
+    matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float16,
+                                       shape=(len(texts), encoder.dim))
+    for start in range(0, len(texts), ENCODE_BATCH):
+        batch = texts[start:start + ENCODE_BATCH]
+        matrix[start:start + len(batch)] = encoder.encode(batch)
+    matrix.flush()
+    del matrix
+    # Readers only ever see a complete matrix
+    os.replace(tmp_path, path)
+    ivf_path = path + ".ivf.npz"
+    if len(texts) >= IVF_MIN_ROWS:
+        ivf = IVFIndex.train(np.load(path, mmap_mode="r"))
+        _replace_atomically(ivf_path, ivf.save)
+    elif os.path.exists(ivf_path):
+        os.remove(ivf_path)
+    meta = {"model": encoder.name, "count": len(texts), "fingerprint": _fingerprint(encoder, texts)}
+    _replace_atomically(path + ".json", lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+
+def _is_current(index, encoder, path):
+    try:
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    texts = [scheme_text(s) for s in index.schemes]
+    return meta.get("fingerprint") == _fingerprint(encoder, texts) and os.path.exists(path)
+
+
+def _loaded():
+    """(index, encoder, matrix, ivf) for the current catalogue, re-embedding it when it changed"""
+    global _state
+    if np is None:
+        raise Unavailable("Recommendations need NumPy")
+    index = schemes.catalogue()
+    state = _state
+    if state is None or state[0] is not index:
+        with _state_lock:
+            state = _state
+            if state is None or state[0] is not index:
+                encoder = _get_encoder()
+                ivf_path = EMBEDDINGS_FILE + ".ivf.npz"
+                with _build_lock(EMBEDDINGS_FILE):
+                    # Another worker may have built it while this one waited
+                    if not _is_current(index, encoder, EMBEDDINGS_FILE):
+                        build(index, encoder, EMBEDDINGS_FILE)
+                    ivf = IVFIndex.load(ivf_path) if os.path.exists(ivf_path) else None
+                    matrix = np.load(EMBEDDINGS_FILE, mmap_mode="r")
+                state = (index, encoder, matrix, ivf)
+                _masks.clear()
+                _state = state
+    return state
+
+
+def _state_mask(index, state):
+    """Boolean row mask of schemes on offer in `state`, or None for no restriction"""
+    allowed = index.allowed(state)
+    if allowed is None:
+        return None
+    key = schemes.state_key(state)
+    if key not in index.by_state:
+        key = None  # one national-only mask for every unknown state, as in index.allowed
+    mask = _masks.get(key)
+    if mask is None:
+        mask = np.zeros(len(index.schemes), dtype=bool)
+        mask[list(allowed)] = True
+        _masks[key] = mask
+    return mask
+
+
+def top_k(matrix, queries, k, mask=None):
+    """Best `k` rows of `matrix` for each row of `queries`: (indices, scores), best first"""
+    count = matrix.shape[0]
+    scores = np.empty((queries.shape[0], count), dtype=np.float32)
+    queries = queries.astype(np.float32).T
+    for start in range(0, count, BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+        scores[:, start:start + block.shape[0]] = (block @ queries).T
+    if mask is not None:
+        scores[:, ~mask] = -np.inf
+    k = min(k, count)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64), scores[:, :0]
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def nearest(matrix, ivf, query, k, mask=None, probes=IVF_PROBES):
+    """top_k for one query vector, through the IVF lists when there is an index"""
+    if ivf is None:
+        rows, scores = top_k(matrix, query[np.newaxis, :], k, mask)
+        return rows[0], scores[0]
+    rows = ivf.candidates(query, probes)
+    if mask is not None:
+        rows = rows[mask[rows]]
+    if len(rows) < k:
+        # The probed lists hold too few schemes on offer in this state
+        rows, scores = top_k(matrix, query[np.newaxis, :], k, mask)
+        return rows[0], scores[0]
+    scores = np.asarray(matrix[rows], dtype=np.float32) @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return rows[top], scores[top]
+
+
+# --- Recommendations ---
+
+def profile_text(user):
+    """Interests implied by a user's family members, as text to embed"""
+    interests = []
+    for member in (user or {}).get("family") or []:
+        role = str(member.get("role", "")).strip().lower()
+        if role in ROLE_INTERESTS:
+            interests.append(ROLE_INTERESTS[role])
+        try:
+            age = int(member.get("age"))
+        except (TypeError, ValueError):
+            continue
+        if age >= SENIOR_AGE:
+            interests.append(ROLE_INTERESTS["elderly"])
+        elif age < CHILD_AGE:
+            interests.append(ROLE_INTERESTS["child"])
+    return " ".join(interests)
+
+
+def recommend(query="", user=None, state=None, limit=10):
+    """(schemes with a "score", the state used), best match first.
+
+    `user` is a profile as stored at registration: its family roles steer the results and
+    its state is used when none is given.
+    """
+    index, encoder, matrix, ivf = _loaded()
+    state = state or (user or {}).get("state") or None
+    profile = profile_text(user)
+    if not query.strip() and not profile:
+        return schemes.search("", state=state, limit=limit)[0], state
+
+    texts = [t for t in (query, profile) if t.strip()]
+    vectors = encoder.encode(texts)
+    vector = vectors[0]
+    if query.strip() and profile:
+        vector = vector + PROFILE_WEIGHT * vectors[1]
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-9)
+
+    rows, scores = nearest(matrix, ivf, vector, limit, _state_mask(index, state))
+    results = [dict(index.schemes[int(row)], score=round(float(score), 4))
+               for row, score in zip(rows, scores) if score > 0]
+    return results, state
+
+
+def _benchmark(count=50000, dim=384, queries=200, k=10):
+    if np is None:
+        raise SystemExit("NumPy is not installed")
+    rng = np.random.default_rng(7)
+    # Clustered like real embeddings: schemes on the same topic sit close together
+    topics = rng.standard_normal((1024, dim)).astype(np.float32)
+    exact = topics[rng.integers(0, len(topics), count)] + 1.2 * rng.standard_normal((count, dim)).astype(np.float32)
+    exact /= np.linalg.norm(exact, axis=1, keepdims=True)
+    path = "bench_embeddings.npy"
+    np.save(path, exact.astype(np.float16))
+    matrix = np.load(path, mmap_mode="r")
+    # Queries near real rows, as a rephrased scheme name would be
+    q = exact[rng.integers(0, count, queries)] + 0.5 * rng.standard_normal((queries, dim)).astype(np.float32) / math.sqrt(dim)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    truth = [set(row.tolist()) for row in np.argsort(-(q @ exact.T), axis=1)[:, :k]]
+
+    def run(label, search):
+        latencies, hits = [], 0
+        for row, expected in zip(q, truth):
+            start = time.perf_counter()
+            rows = search(row)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & set(rows.tolist()))
+        latencies.sort()
+        print(f"{label:<14} p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f} ms  "
+              f"recall@{k} {hits / (queries * k):.4f}")
+
+    try:
+        print(f"{count} x {dim} float16 ({matrix.nbytes / 2**20:.0f} MiB mapped); recall is against float32 exact search")
+        run("exact", lambda row: nearest(matrix, None, row, k)[0])
+        start = time.perf_counter()
+        top_k(matrix, q, k)
+        print(f"{'exact batched':<14} {(time.perf_counter() - start) / queries * 1000:6.2f} ms/query")
+        start = time.perf_counter()
+        ivf = IVFIndex.train(matrix)
+        print(f"IVF: {len(ivf.centroids)} lists trained in {time.perf_counter() - start:.1f}s")
+        for probes in (4, 8, 16, 32):
+            run(f"ivf probes={probes}", lambda row: nearest(matrix, ivf, row, k, probes=probes)[0])
+    finally:
+        del matrix
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    # python recommend.py build         -> (re)embed the catalogue
+    # python recommend.py bench [count] -> latency and recall, exact and IVF
+    # python recommend.py <query>       -> recommend for a query
+    if len(sys.argv) == 2 and sys.argv[1] == "build":
+        if np is None:
+            raise SystemExit("NumPy is not installed")
+        with _build_lock(EMBEDDINGS_FILE):
+            build(schemes.catalogue(), _get_encoder(), EMBEDDINGS_FILE)
+        print(f"Wrote {EMBEDDINGS_FILE}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 50000)
+    elif len(sys.argv) >= 2:
+        for scheme in recommend(" ".join(sys.argv[1:]))[0]:
+            print(f"{scheme['score']:8.3f}  {scheme['title']}")
+    else:
+        print("usage: python recommend.py build | bench [count] | <query>")
@@ -0,0 +1,272 @@
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from datetime import date, datetime, timedelta
+
+import login
+import notifications
+import storage
+
+# Children's reminders: a school-day attendance nudge for every school-age child and one
+# reminder per vaccination visit on the national immunisation schedule. A younger child's
+# attendance reminder is scheduled for the first school day they are old enough, and the
+# child's age is checked again before every send, so it stops once they leave school age.
+#
+# Reminders are rows in the reminders table keyed by their next due time. A tick takes
+# only the rows that are due (an index range scan, never a pass over all children), hands
+# them to notifications.notify_many in one batch, and moves recurring ones to their next
+# occurrence in the same transaction, so a restart neither loses nor repeats any.
+ATTENDANCE_HOUR = int(os.environ.get("DIGIGOV_ATTENDANCE_REMINDER_HOUR", "8"))
+VACCINATION_HOUR = int(os.environ.get("DIGIGOV_VACCINATION_REMINDER_HOUR", "9"))
+SCHOOL_DAYS = {0, 1, 2, 3, 4, 5}  # Monday to Saturday
+SCHOOL_AGES = range(5, 18)
+CHILD_ROLES = notifications.CHILD_ROLES
+CHILD_AGE = notifications.CHILD_AGE
+# An attendance reminder this late (say, after downtime) is dropped, not sent
+STALE_SECONDS = 3 * 3600
+BATCH_SIZE = 1000
+MAX_SLEEP_SECONDS = 60
+
+# Universal Immunization Programme: (days after birth, vaccines due)
+VACCINATION_SCHEDULE = [
+    (0, "BCG, OPV-0 and Hepatitis B birth dose"),
+    (42, "OPV-1, Pentavalent-1, Rotavirus-1, fIPV-1 and PCV-1"),
+    (70, "OPV-2, Pentavalent-2 and Rotavirus-2"),
+    (98, "OPV-3, Pentavalent-3, Rotavirus-3, fIPV-2 and PCV-2"),
+    (270, "Measles-Rubella-1, JE-1 and PCV booster"),
+    (480, "Measles-Rubella-2, JE-2, DPT booster-1 and OPV booster"),
+    (1825, "DPT booster-2"),
+    (3650, "Td"),
+    (5840, "Td"),
+]
+# Vaccination reminders go out this many days before the visit
+VACCINATION_NOTICE_DAYS = 1
+
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+# --- Planning ---
+
+def _birth_date(member, today):
+    """A child's date of birth, or an estimate from their age; None when neither is known"""
+    try:
+        return date.fromisoformat(str(member["dob"])[:10])
+    except (KeyError, ValueError):
+        pass
+    try:
+        age = int(member.get("age"))
+    except (TypeError, ValueError):
+        return None
+    return today - timedelta(days=int(age * 365.25))
+
+
+def children(user, today=None):
+    """(name, date of birth or None, has an exact dob) for each child in the user's family"""
+    today = today or date.today()
+    result = []
+    for position, member in enumerate(user.get("family") or []):
+        role = str(member.get("role", "")).strip().lower()
+        born = _birth_date(member, today)
+        is_child = role in CHILD_ROLES or (born is not None and (today - born).days < CHILD_AGE * 365)
+        if is_child:
+            name = member.get("name") or f"Child {position + 1}"
+            result.append((name, born, "dob" in member))
+    return result
+
+
+def age_on(born, today):
+    return (today - born).days // 365
+
+
+def in_school(user, child, today):
+    """Whether `child` (by name) is still in the user's family and of school age on `today`.
+
+    Children whose age is unknown count as school age.
+    """
+    for name, born, _ in children(user, today):
+        if name == child:
+            return born is None or age_on(born, today) in SCHOOL_AGES
+    return False
+
+
+def next_school_day(after):
+    """Next ATTENDANCE_HOUR on a school day strictly after datetime `after`"""
+    candidate = after.replace(hour=ATTENDANCE_HOUR, minute=0, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    while candidate.weekday() not in SCHOOL_DAYS:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def plan(user, now=None):
+    """Every reminder a user should have scheduled, as (due timestamp, data)"""
+    now = now or datetime.now()
+    today = now.date()
+    reminders = []
+    for name, born, exact in children(user, today):
+        age = age_on(born, today) if born else None
+        if age is None or age in SCHOOL_AGES:
+            reminders.append((next_school_day(now).timestamp(), {"kind": "attendance", "child": name}))
+        elif age < SCHOOL_AGES.start:
+            # Starts by itself on the first school day once the child is old enough
+            eligible = born + timedelta(days=SCHOOL_AGES.start * 365)
+            first = next_school_day(datetime.combine(eligible, datetime.min.time()))
+            reminders.append((first.timestamp(), {"kind": "attendance", "child": name}))
+        if not exact:
+            continue  # estimated birthdays are too rough to time vaccinations by
+        for offset, vaccines in VACCINATION_SCHEDULE:
+            visit = born + timedelta(days=offset)
+            notice = datetime.combine(visit - timedelta(days=VACCINATION_NOTICE_DAYS), datetime.min.time())
+            notice = notice.replace(hour=VACCINATION_HOUR)
+            if visit >= today:
+                reminders.append((max(notice, now).timestamp(), {
+                    "kind": "vaccination",
+                    "child": name,
+                    "vaccines": vaccines,
+                    "visit": visit.isoformat()
+                }))
+    return reminders
+
+
+def schedule_user(user, conn=None):
+    """(Re)schedule a user's reminders from their current family details"""
+    if conn is None:
+        with storage.transaction() as conn:
+            return schedule_user(user, conn)
+    reminders = plan(user)
+    storage.replace_reminders(conn, user["id"], reminders)
+    if reminders:
+        _wakeup.set()
+    return len(reminders)
+
+
+def schedule_all():
+    """Backfill: schedule reminders for every citizen, a page of users per transaction"""
+    total, cursor = 0, None
+    while True:
+        users = storage.users_page(cursor)
+        if not users:
+            return total
+        with storage.transaction() as conn:
+            for user in users:
+                if user.get("role", "citizen") == "citizen" and user.get("family"):
+                    total += schedule_user(user, conn)
+        cursor = users[-1]["id"]
+
+
+# --- Sending ---
+
+def _message(reminder):
+    if reminder["kind"] == "attendance":
+        return "School today", f"Good morning! Please send {reminder['child']} to school today."
+    visit = date.fromisoformat(reminder["visit"]).strftime("%d %b %Y")
+    return ("Vaccination due",
+            f"{reminder['child']} is due for {reminder['vaccines']} on {visit}. "
+            "Please visit your nearest health centre or Anganwadi.")
+
+
+def run_due(now=None, limit=BATCH_SIZE):
+    """Send one batch of due reminders; returns how many were taken off the queue"""
+    now = now or time.time()
+    with storage.transaction() as conn:
+        due = storage.due_reminders(conn, now, limit)
+        if not due:
+            return 0
+        items, reschedule, finished = [], [], []
+        today = date.fromtimestamp(now)
+        for reminder in due:
+            user = login.get_user_by_id(reminder["userId"])
+            attendance = reminder["kind"] == "attendance"
+            # Ages are re-checked every time: a child who has left school age stops here
+            current = bool(user) and (not attendance or in_school(user, reminder["child"], today))
+            stale = attendance and now - reminder["due"] > STALE_SECONDS
+            if current and not stale:
+                title, message = _message(reminder)
+                items.append((user, title, message, "reminder"))
+            if attendance and current:
+                following = next_school_day(datetime.fromtimestamp(max(now, reminder["due"])))
+                reschedule.append((reminder["id"], following.timestamp()))
+            else:
+                finished.append(reminder["id"])
+        notifications.notify_many(conn, items)
+        storage.reschedule_reminders(conn, reschedule)
+        storage.delete_reminders(conn, finished)
+    return len(due)
+
+
+def _scheduler_loop():
+    while True:
+        try:
+            if run_due():
+                continue
+            following = storage.next_reminder_due()
+            wait = MAX_SLEEP_SECONDS if following is None else following - time.time()
+        except Exception as e:
+            print("Reminder scheduler error:", e)
+            traceback.print_exc()
+            wait = MAX_SLEEP_SECONDS
+        # Woken early when a new reminder is scheduled
+        _wakeup.wait(min(max(wait, 0.05), MAX_SLEEP_SECONDS))
+        _wakeup.clear()
+
+
+def start_scheduler():
+    """Start the reminder thread once per process"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        threading.Thread(target=_scheduler_loop, name="reminders", daemon=True).start()
+        _started = True
+
+
+def _benchmark(count=1000000, ticks=50):
+    """Queue `count` reminders over the next 30 days, then time ticks of due batches"""
+    rng = random.Random(7)
+    start_time = time.time()
+    start = time.perf_counter()
+    with storage.transaction() as conn:
+        for first in range(0, count, 100000):
+            conn.executemany(
+                "INSERT INTO reminders (due, user_id, data) VALUES (?, ?, ?)",
+                [(start_time + rng.uniform(0, 30 * 86400), f"bench-{i}", '{"kind": "vaccination"}')
+                 for i in range(first, min(first + 100000, count))],
+            )
+    print(f"scheduled {count} reminders in {time.perf_counter() - start:.1f}s")
+
+    # A tick a day in: about 1/30 of the reminders are due, taken BATCH_SIZE at a time
+    now = start_time + 86400
+    latencies = []
+    for _ in range(ticks):
+        tick = time.perf_counter()
+        with storage.transaction() as conn:
+            ids = [r["id"] for r in storage.due_reminders(conn, now, BATCH_SIZE)]
+            storage.delete_reminders(conn, ids)
+        latencies.append(time.perf_counter() - tick)
+    latencies.sort()
+    print(f"tick of {BATCH_SIZE} due reminders: p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    with storage.transaction() as conn:
+        conn.execute("DELETE FROM reminders WHERE user_id LIKE 'bench-%'")
+
+
+if __name__ == "__main__":
+    # python reminders.py schedule       -> (re)schedule reminders for every citizen
+    # python reminders.py bench [count]  -> scheduling and tick cost (use a scratch DIGIGOV_DB)
+    # python reminders.py                -> standalone scheduler
+    storage.init_db()
+    if len(sys.argv) == 2 and sys.argv[1] == "schedule":
+        print(f"Scheduled {schedule_all()} reminders")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    else:
+        start_scheduler()
+        notifications.start_workers()
+        while True:
+            time.sleep(3600)
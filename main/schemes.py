@@ -0,0 +1,313 @@
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import intents
+
+# Scheme catalogue and full-text search.
+#
+# The catalogue is a JSON list of schemes (see schemes.json). It is loaded once into an
+# inverted index: term -> (doc ids, weighted term frequencies) in typed arrays, ranked with
+# BM25. Every token is romanised and phonetically folded before indexing, so "योजना",
+# "yojana" and "yojna" style spellings meet on the same key, and the last query word also
+# matches as a prefix for typeahead.
+SCHEMES_FILE = os.environ.get("DIGIGOV_SCHEMES", "schemes.json")
+
+# Field weights: a hit in the title or a local-language alias counts for more
+FIELD_WEIGHTS = {
+    "title": 3, "aliases": 3, "category": 2, "type": 1,
+    "description": 1, "eligibility": 1, "benefits": 1, "documents": 1,
+}
+BM25_K1 = 1.2
+BM25_B = 0.75
+MIN_PREFIX = 2
+MAX_PREFIX_TERMS = 64
+PREFIX_WEIGHT = 0.8
+# Postings read per query term; later ones add too little to change the top results
+MAX_POSTINGS = 2000
+MAX_PREFIX_POSTINGS = 200
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# --- Tokenization ---
+# Devanagari, Bengali, Gurmukhi, Gujarati, Oriya, Tamil, Telugu, Kannada and Malayalam share
+# the ISCII layout (each block is 0x80 wide), so one table keyed by the offset within the
+# block romanises all of them.
+INDIC_START, INDIC_END = 0x0900, 0x0D7F
+_CONSONANTS = {
+    0x15: "k", 0x16: "kh", 0x17: "g", 0x18: "gh", 0x19: "n",
+    0x1A: "ch", 0x1B: "chh", 0x1C: "j", 0x1D: "jh", 0x1E: "n",
+    0x1F: "t", 0x20: "th", 0x21: "d", 0x22: "dh", 0x23: "n",
+    0x24: "t", 0x25: "th", 0x26: "d", 0x27: "dh", 0x28: "n", 0x29: "n",
+    0x2A: "p", 0x2B: "ph", 0x2C: "b", 0x2D: "bh", 0x2E: "m",
+    0x2F: "y", 0x30: "r", 0x31: "r", 0x32: "l", 0x33: "l", 0x34: "l", 0x35: "v",
+    0x36: "sh", 0x37: "sh", 0x38: "s", 0x39: "h",
+    0x58: "k", 0x59: "kh", 0x5A: "g", 0x5B: "j", 0x5C: "r", 0x5D: "rh", 0x5E: "ph", 0x5F: "y",
+}
+_VOWEL_SIGNS = {
+    0x3E: "aa", 0x3F: "i", 0x40: "ii", 0x41: "u", 0x42: "uu", 0x43: "ri", 0x44: "rii",
+    0x45: "e", 0x46: "e", 0x47: "e", 0x48: "ai", 0x49: "o", 0x4A: "o", 0x4B: "o", 0x4C: "au",
+}
+_VOWELS = {
+    0x05: "a", 0x06: "aa", 0x07: "i", 0x08: "ii", 0x09: "u", 0x0A: "uu", 0x0B: "ri", 0x0C: "li",
+    0x0D: "e", 0x0E: "e", 0x0F: "e", 0x10: "ai", 0x11: "o", 0x12: "o", 0x13: "o", 0x14: "au",
+}
+# Candrabindu, anusvara, visarga
+_SIGNS = {0x01: "n", 0x02: "n", 0x03: "h"}
+_VIRAMA = 0x4D
+
+# Applied to every romanised token: spellings of the same word differ mostly in vowel
+# length, aspiration and a few interchangeable consonants
+_FOLD_PAIRS = (("ee", "i"), ("oo", "u"), ("w", "v"), ("z", "j"), ("q", "k"), ("f", "ph"))
+_ASPIRABLE = set("kgcjtdpbs")
+
+
+def romanize(word):
+    """Latin transliteration of an Indic-script word; other characters pass through"""
+    out = []
+    pending = False  # last consonant still carries its inherent 'a'
+    for char in word:
+        code = ord(char)
+        if not INDIC_START <= code <= INDIC_END:
+            if pending:
+                out.append("a")
+                pending = False
+            out.append(char)
+            continue
+        offset = code & 0x7F
+        if offset in _CONSONANTS:
+            if pending:
+                out.append("a")
+            out.append(_CONSONANTS[offset])
+            pending = True
+        elif offset in _VOWEL_SIGNS:
+            out.append(_VOWEL_SIGNS[offset])
+            pending = False
+        elif offset == _VIRAMA:
+            pending = False
+        elif 0x66 <= offset <= 0x6F:
+            out.append(str(offset - 0x66))
+            pending = False
+        elif offset in _SIGNS or offset in _VOWELS:
+            if pending:
+                out.append("a")
+            out.append(_SIGNS.get(offset) or _VOWELS[offset])
+            pending = False
+        # Nukta, length marks and the like do not change the romanisation
+    # The inherent vowel of a word-final consonant is not pronounced (schwa deletion)
+    return "".join(out)
+
+
+def fold(word):
+    for a, b in _FOLD_PAIRS:
+        word = word.replace(a, b)
+    out = []
+    for char in word:
+        if out and char == out[-1]:
+            continue  # aa -> a, ii -> i, ss -> s
+        if char == "h" and out and out[-1] in _ASPIRABLE:
+            continue  # kh -> k, bh -> b, sh -> s
+        out.append(char)
+    return "".join(out)
+
+
+def tokenize(text):
+    """Search keys for a piece of text in any supported script"""
+    return [fold(romanize(word)) for word in intents.normalize(text).split(" ") if word]
+
+
+# --- Index ---
+
+def _field_text(scheme, field):
+    value = scheme.get(field)
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value or "")
+
+
+def state_key(state):
+    return intents.normalize(state)
+
+
+class SchemeIndex:
+    def __init__(self, schemes):
+        self.schemes = schemes
+        # Schemes with no "states" are offered everywhere; the rest only in the listed states
+        self.national = set()
+        self.by_state = {}
+        self._allowed = {}
+        frequencies = {}
+        lengths = []
+        for doc_id, scheme in enumerate(schemes):
+            freqs = {}
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(_field_text(scheme, field)):
+                    freqs[term] = freqs.get(term, 0) + weight
+            for term, tf in freqs.items():
+                frequencies.setdefault(term, []).append((doc_id, tf))
+            lengths.append(sum(freqs.values()))
+            states = [state_key(s) for s in scheme.get("states") or [] if s]
+            if states:
+                for state in states:
+                    self.by_state.setdefault(state, set()).add(doc_id)
+            else:
+                self.national.add(doc_id)
+
+        # Every part of a BM25 term score is fixed once the catalogue is, so each posting
+        # stores its final score ("impact") and lists are ordered best first
+        count = len(schemes)
+        avg_length = (sum(lengths) / count) if count else 1.0
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) for length in lengths]
+        self.postings = {}
+        for term, entries in frequencies.items():
+            idf = math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            scored = sorted(((idf * tf * (BM25_K1 + 1) / (tf + norms[d]), d) for d, tf in entries), reverse=True)
+            self.postings[term] = (array("I", (d for _, d in scored)), array("f", (i for i, _ in scored)))
+        self.terms = sorted(self.postings)
+        self._national_only = frozenset(self.national)
+
+    def allowed(self, state):
+        """Documents on offer in `state`, or None for no restriction"""
+        if not state:
+            return None
+        key = state_key(state)
+        if key not in self.by_state:
+            # Any other string (typo, junk) gets the one shared set, so client-supplied
+            # states cannot grow the cache
+            return self._national_only
+        if key not in self._allowed:
+            self._allowed[key] = frozenset(self.national | self.by_state[key])
+        return self._allowed[key]
+
+    def _expand(self, prefix):
+        """Indexed terms starting with `prefix`, most common first"""
+        start = bisect_left(self.terms, prefix)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(prefix):
+            end += 1
+        candidates = self.terms[start:end]
+        if len(candidates) > MAX_PREFIX_TERMS:
+            candidates = heapq.nlargest(MAX_PREFIX_TERMS, candidates, key=lambda t: len(self.postings[t][0]))
+        return candidates
+
+    def _score_term(self, term, weight, scores, allowed, limit=MAX_POSTINGS):
+        docs, impacts = self.postings[term]
+        # Very common words carry little weight, so only their best postings are read
+        for doc_id, impact in zip(docs[:limit], impacts[:limit]):
+            if allowed is None or doc_id in allowed:
+                impact *= weight
+                if impact > scores.get(doc_id, 0.0):
+                    scores[doc_id] = impact
+
+    def search(self, query, state=None, limit=20, prefix=True):
+        """(schemes with a "score", number of matches), best first"""
+        allowed = self.allowed(state)
+        tokens = tokenize(query)
+        if not tokens:
+            # Nothing typed yet: the most popular schemes on offer
+            docs = range(len(self.schemes)) if allowed is None else allowed
+            top = heapq.nlargest(limit, docs, key=lambda d: self.schemes[d].get("popularity", 0))
+            return [dict(self.schemes[d], score=0.0) for d in top], len(docs)
+
+        total = {}
+        for token in dict.fromkeys(tokens):
+            # Per query word, a document scores its best matching term
+            scores = {}
+            if token in self.postings:
+                self._score_term(token, 1.0, scores, allowed)
+            if prefix and token == tokens[-1] and len(token) >= MIN_PREFIX:
+                for term in self._expand(token):
+                    if term != token:
+                        self._score_term(term, PREFIX_WEIGHT, scores, allowed, MAX_PREFIX_POSTINGS)
+            for doc_id, score in scores.items():
+                total[doc_id] = total.get(doc_id, 0.0) + score
+        top = heapq.nlargest(limit, total.items(), key=lambda item: item[1])
+        return [dict(self.schemes[d], score=round(s, 4)) for d, s in top], len(total)
+
+
+# --- Catalogue ---
+
+def load(path=None):
+    """(Re)build the index from the catalogue file; an empty index when it is missing"""
+    global _index
+    path = path or SCHEMES_FILE
+    schemes = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            schemes = json.load(f)
+    index = SchemeIndex(schemes)
+    with _index_lock:
+        _index = index
+    return index
+
+
+def catalogue():
+    if _index is None:
+        load()
+    return _index
+
+
+def search(query, state=None, limit=20, prefix=True):
+    return catalogue().search(query, state=state, limit=limit, prefix=prefix)
+
+
+def _benchmark(count=30000, queries=2000):
+    rng = random.Random(7)
+    syllables = ["ka", "ki", "ra", "ma", "na", "sa", "ya", "jo", "vi", "pa", "la", "de", "bhu", "shi", "tra"]
+    vocabulary = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(20000)]
+    # Zipf-like draw so a few words are very common, as in real scheme text
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    states = ["State %d" % i for i in range(36)]
+
+    def words(n):
+        return " ".join(rng.choices(vocabulary, weights, k=n))
+
+    catalogue = [{
+        "id": i,
+        "title": words(4),
+        "description": words(30),
+        "category": rng.choice(["health", "education", "agriculture", "housing", "women"]),
+        "states": [] if rng.random() < 0.3 else [rng.choice(states)],
+        "popularity": rng.randint(0, 100),
+    } for i in range(count)]
+    start = time.perf_counter()
+    index = SchemeIndex(catalogue)
+    build = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(queries):
+        query = words(rng.randint(1, 3))
+        if rng.random() < 0.5:
+            query = query[:-2]  # typeahead: last word still being typed
+        state = rng.choice(states) if rng.random() < 0.5 else None
+        start = time.perf_counter()
+        index.search(query, state=state)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"{count} schemes, {len(index.terms)} terms, built in {build:.2f}s")
+    print(f"search: mean {sum(latencies) / len(latencies) * 1000:.2f} ms, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    # python schemes.py bench [count]   -> index build time and query latency
+    # python schemes.py <query>         -> search the catalogue
+    if len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 30000)
+    elif len(sys.argv) >= 2:
+        results, total = search(" ".join(sys.argv[1:]))
+        print(f"{total} matches")
+        for scheme in results:
+            print(f"{scheme['score']:8.3f}  {scheme['title']}")
+    else:
+        print("usage: python schemes.py bench [count] | <query>")
@@ -0,0 +1,890 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Database File ---
+DB_PATH = os.environ.get("DIGIGOV_DB", "digigov.db")
+
+# Legacy JSON files imported by the one-shot migrator
+USERS_FILE = "users.json"
+COMPLAINTS_FILE = "complaints.json"
+DOCS_FILE = "documents.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS complaints (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    username TEXT,
+    sector TEXT,
+    status TEXT,
+    priority TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_complaints_user_id ON complaints(user_id);
+CREATE INDEX IF NOT EXISTS idx_complaints_username ON complaints(username);
+CREATE INDEX IF NOT EXISTS idx_complaints_sector ON complaints(sector);
+CREATE INDEX IF NOT EXISTS idx_complaints_status ON complaints(status);
+CREATE INDEX IF NOT EXISTS idx_complaints_priority ON complaints(priority);
+CREATE INDEX IF NOT EXISTS idx_complaints_created_at ON complaints(created_at, id);
+CREATE TABLE IF NOT EXISTS complaint_counts (
+    sector TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (sector, status, priority, day)
+);
+CREATE TABLE IF NOT EXISTS complaint_events (
+    id INTEGER PRIMARY KEY,
+    complaint_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_complaint_events_complaint_id ON complaint_events(complaint_id, id);
+CREATE TABLE IF NOT EXISTS complaint_clusters (
+    id INTEGER PRIMARY KEY,
+    sector TEXT,
+    size INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_complaint_clusters_updated_at ON complaint_clusters(updated_at);
+CREATE TABLE IF NOT EXISTS complaint_signatures (
+    complaint_id INTEGER PRIMARY KEY,
+    cluster_id INTEGER NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_complaint_signatures_cluster_id ON complaint_signatures(cluster_id);
+CREATE TABLE IF NOT EXISTS complaint_lsh (
+    bucket TEXT NOT NULL,
+    day TEXT NOT NULL,
+    complaint_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_complaint_lsh_bucket ON complaint_lsh(bucket);
+CREATE INDEX IF NOT EXISTS idx_complaint_lsh_day ON complaint_lsh(day);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_user_id ON documents(user_id);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    updated_at REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    run_after REAL,
+    error TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, kind, id);
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    phone TEXT,
+    emp_id TEXT,
+    role TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    read INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications(user_id, read, id);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_id_id ON notifications(user_id, id);
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY,
+    due REAL NOT NULL,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders(due);
+CREATE INDEX IF NOT EXISTS idx_reminders_user_id ON reminders(user_id);
+CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone);
+CREATE INDEX IF NOT EXISTS idx_users_emp_id ON users(emp_id);
+"""
+
+# Created after columns added to existing databases are in place
+LATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_users_version ON users(version);
+"""
+
+_local = threading.local()
+
+
+def get_connection():
+    """Return this thread's connection, opening it in WAL mode on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Run the enclosed statements as a single write transaction"""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    _local.after_commit = []
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        _local.after_commit = []
+        raise
+    conn.execute("COMMIT")
+    callbacks, _local.after_commit = _local.after_commit, []
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            print("After-commit callback error:", e)
+
+
+def after_commit(callback):
+    """Call `callback` once the current transaction commits; dropped if it rolls back"""
+    _local.after_commit.append(callback)
+
+
+def next_id(conn, name, table=None):
+    """Allocate the next value of a persistent sequence; values are never reused.
+
+    Must be called inside `transaction()` so concurrent workers serialize on it.
+    A sequence that does not exist yet starts after the highest numeric id in `table`.
+    """
+    row = conn.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        current = 0
+        if table:
+            current = conn.execute(
+                f"SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) FROM {table}"
+            ).fetchone()[0]
+    else:
+        current = row["value"]
+    conn.execute(
+        "INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (name, current + 1)
+    )
+    return current + 1
+
+
+def advance_sequence(conn, name, value, table=None):
+    """Make sure a sequence never hands out `value` or below (after inserting an explicit id)"""
+    start = f"(SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) FROM {table})" if table else "0"
+    conn.execute(
+        f"INSERT INTO sequences (name, value) VALUES (?, MAX(?, {start})) "
+        "ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)",
+        (name, value),
+    )
+
+
+def _dump(record):
+    return json.dumps(record, separators=(",", ":"))
+
+
+def _rows_to_records(rows):
+    return [json.loads(row["data"]) for row in rows]
+
+
+# --- Complaints ---
+
+def _complaint_values(record):
+    return (
+        record["id"],
+        str(record.get("userId", record.get("user_id", ""))),
+        str(record.get("username", "")),
+        record.get("sector"),
+        record.get("status"),
+        record.get("priority"),
+        # complaints.py wrote "YYYY-MM-DD HH:MM:SS"; normalise so the column sorts as ISO 8601
+        (record.get("createdAt") or record.get("created_at") or "").replace(" ", "T"),
+        _dump(record),
+    )
+
+
+def _count_complaint(conn, sector, status, priority, created_at, delta):
+    """Adjust the dashboard counter for one (sector, status, priority, creation day) cell"""
+    conn.execute(
+        "INSERT INTO complaint_counts (sector, status, priority, day, count) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (sector, status, priority, day) DO UPDATE SET count = count + excluded.count",
+        (sector or "", status or "", priority or "", (created_at or "")[:10], delta),
+    )
+
+
+def insert_complaint(conn, record):
+    """Insert a complaint; assigns `id` from the complaints sequence when the record has none"""
+    if not record.get("id"):
+        record["id"] = next_id(conn, "complaints", "complaints")
+    values = _complaint_values(record)
+    conn.execute(
+        "INSERT INTO complaints (id, user_id, username, sector, status, priority, created_at, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        values,
+    )
+    _count_complaint(conn, *values[3:7], 1)
+    return record
+
+
+def update_complaint(conn, record):
+    values = _complaint_values(record)
+    old = conn.execute(
+        "SELECT sector, status, priority, created_at FROM complaints WHERE id = ?", (record["id"],)
+    ).fetchone()
+    conn.execute(
+        "UPDATE complaints SET user_id = ?, username = ?, sector = ?, status = ?, priority = ?, "
+        "created_at = ?, data = ? WHERE id = ?",
+        values[1:] + values[:1],
+    )
+    if old and tuple(old) != values[3:7]:
+        _count_complaint(conn, *old, -1)
+        _count_complaint(conn, *values[3:7], 1)
+
+
+def append_complaint_event(conn, event):
+    """Append a status event; the history is never rewritten"""
+    conn.execute(
+        "INSERT INTO complaint_events (complaint_id, data) VALUES (?, ?)",
+        (event["complaintId"], _dump(event)),
+    )
+
+
+def complaint_events(complaint_id):
+    rows = get_connection().execute(
+        "SELECT data FROM complaint_events WHERE complaint_id = ? ORDER BY id", (complaint_id,)
+    ).fetchall()
+    return _rows_to_records(rows)
+
+
+def rebuild_complaint_counts(conn):
+    """Recompute the dashboard counters from scratch (after a bulk import)"""
+    conn.execute("DELETE FROM complaint_counts")
+    conn.execute(
+        "INSERT INTO complaint_counts (sector, status, priority, day, count) "
+        "SELECT COALESCE(sector, ''), COALESCE(status, ''), COALESCE(priority, ''), "
+        "SUBSTR(COALESCE(created_at, ''), 1, 10), COUNT(*) "
+        "FROM complaints GROUP BY 1, 2, 3, 4"
+    )
+
+
+def complaint_counts():
+    """Counter rows as (sector, status, priority, day, count); size is independent of complaint volume"""
+    return get_connection().execute(
+        "SELECT sector, status, priority, day, count FROM complaint_counts WHERE count > 0"
+    ).fetchall()
+
+
+def get_complaint(complaint_id, conn=None):
+    row = (conn or get_connection()).execute(
+        "SELECT data FROM complaints WHERE id = ?", (complaint_id,)
+    ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def query_complaints(user_id=None, sector=None, status=None, priority=None,
+                     created_from=None, created_to=None, order="asc", limit=50, after=None,
+                     cluster_id=None, district=None, count=True):
+    """One page of complaints ordered by (createdAt, id), with the total matching count.
+
+    `after` is the (created_at, id) key of the last row of the previous page; the
+    returned key is None once there are no more rows. The total is only counted for the
+    first page (no `after`) and is None for later pages, or for every page with
+    count=False.
+    """
+    where, params = [], []
+    if user_id:
+        where.append("(user_id = ? OR username = ?)")
+        params += [str(user_id), str(user_id)]
+    for column, value in (("sector", sector), ("status", status), ("priority", priority)):
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if created_from:
+        where.append("created_at >= ?")
+        params.append(created_from)
+    if created_to:
+        # A bare date means "up to the end of that day"
+        where.append("created_at <= ?")
+        params.append(created_to + "T23:59:59.999999" if len(created_to) == 10 else created_to)
+    if cluster_id:
+        where.append("id IN (SELECT complaint_id FROM complaint_signatures WHERE cluster_id = ?)")
+        params.append(cluster_id)
+    if district:
+        where.append("json_extract(data, '$.district') = ?")
+        params.append(district)
+
+    conn = get_connection()
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    total = None
+    if count and not after:
+        if user_id or created_from or created_to or cluster_id or district:
+            total = conn.execute(f"SELECT COUNT(*) FROM complaints{where_sql}", params).fetchone()[0]
+        else:
+            # Only sector/status/priority filters: the dashboard counters have the answer
+            total = conn.execute(
+                f"SELECT COALESCE(SUM(count), 0) FROM complaint_counts{where_sql}", params
+            ).fetchone()[0]
+
+    direction, op = ("DESC", "<") if order == "desc" else ("ASC", ">")
+    if after:
+        where.append(f"(created_at, id) {op} (?, ?)")
+        params += list(after)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    rows = conn.execute(
+        f"SELECT created_at, id, data FROM complaints{where_sql} "
+        f"ORDER BY created_at {direction}, id {direction} LIMIT ?",
+        params + [limit + 1],
+    ).fetchall()
+
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = (rows[-1]["created_at"], rows[-1]["id"])
+    return _rows_to_records(rows), total, next_after
+
+
+def complaints_after(after=None, limit=1000):
+    """Complaints in (created_at, id) order after key `after`, for batch jobs"""
+    if after:
+        rows = get_connection().execute(
+            "SELECT created_at, id, data FROM complaints WHERE (created_at, id) > (?, ?) "
+            "ORDER BY created_at, id LIMIT ?",
+            (*after, limit),
+        ).fetchall()
+    else:
+        rows = get_connection().execute(
+            "SELECT created_at, id, data FROM complaints ORDER BY created_at, id LIMIT ?", (limit,)
+        ).fetchall()
+    next_after = (rows[-1]["created_at"], rows[-1]["id"]) if rows else None
+    return _rows_to_records(rows), next_after
+
+
+# --- Complaint Clusters ---
+# Near-duplicate complaints share a cluster, whose id is that of its first complaint.
+# complaint_lsh maps LSH band buckets to complaints for candidate lookup; see clusters.py.
+
+def cluster_of(conn, complaint_id):
+    row = conn.execute(
+        "SELECT cluster_id FROM complaint_signatures WHERE complaint_id = ?", (complaint_id,)
+    ).fetchone()
+    return row["cluster_id"] if row else None
+
+
+def lsh_candidates(conn, buckets, limit=200):
+    """Complaints sharing any of `buckets`: {complaint id: (cluster id, signature)}"""
+    if not buckets:
+        return {}
+    placeholders = ", ".join("?" for _ in buckets)
+    rows = conn.execute(
+        "SELECT s.complaint_id, s.cluster_id, s.signature FROM complaint_signatures s "
+        f"WHERE s.complaint_id IN (SELECT complaint_id FROM complaint_lsh WHERE bucket IN ({placeholders}) "
+        "LIMIT ?)",
+        list(buckets) + [limit],
+    ).fetchall()
+    return {row["complaint_id"]: (row["cluster_id"], row["signature"]) for row in rows}
+
+
+def add_to_cluster(conn, complaint_id, cluster_id, signature, buckets, day, cluster_data, updated_at):
+    """File a complaint's signature and buckets and count it in its cluster (new or existing)"""
+    conn.execute(
+        "INSERT INTO complaint_signatures (complaint_id, cluster_id, signature) VALUES (?, ?, ?)",
+        (complaint_id, cluster_id, signature),
+    )
+    conn.executemany(
+        "INSERT INTO complaint_lsh (bucket, day, complaint_id) VALUES (?, ?, ?)",
+        [(bucket, day, complaint_id) for bucket in buckets],
+    )
+    conn.execute(
+        "INSERT INTO complaint_clusters (id, sector, size, updated_at, data) VALUES (?, ?, 1, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET size = size + 1, updated_at = MAX(updated_at, excluded.updated_at)",
+        (cluster_id, cluster_data.get("sector"), updated_at, _dump(cluster_data)),
+    )
+
+
+def prune_lsh(conn, before_day):
+    """Drop buckets of days no new complaint can be matched against any more"""
+    return conn.execute("DELETE FROM complaint_lsh WHERE day < ?", (before_day,)).rowcount
+
+
+def clear_clusters(conn):
+    conn.execute("DELETE FROM complaint_lsh")
+    conn.execute("DELETE FROM complaint_signatures")
+    conn.execute("DELETE FROM complaint_clusters")
+
+
+def top_clusters(sector=None, since=None, min_size=2, limit=20):
+    """The largest clusters active since `since`, for the dashboard"""
+    where, params = ["size >= ?"], [min_size]
+    if sector:
+        where.append("sector = ?")
+        params.append(sector)
+    if since:
+        where.append("updated_at >= ?")
+        params.append(since)
+    rows = get_connection().execute(
+        f"SELECT id, size, updated_at, data FROM complaint_clusters WHERE {' AND '.join(where)} "
+        "ORDER BY size DESC, id LIMIT ?",
+        params + [limit],
+    ).fetchall()
+    clusters = []
+    for row in rows:
+        cluster = json.loads(row["data"])
+        cluster.update(id=row["id"], size=row["size"], updatedAt=row["updated_at"])
+        clusters.append(cluster)
+    return clusters
+
+
+# --- Documents ---
+
+def insert_document(conn, record):
+    """Insert a document record; assigns `id` from the documents sequence when the record has none"""
+    if not record.get("id"):
+        record["id"] = next_id(conn, "documents", "documents")
+    conn.execute(
+        "INSERT INTO documents (id, user_id, data) VALUES (?, ?, ?)",
+        (record["id"], str(record.get("user_id", "")), _dump(record)),
+    )
+    return record
+
+
+def get_document(doc_id):
+    row = get_connection().execute(
+        "SELECT data FROM documents WHERE id = ?", (doc_id,)
+    ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def list_documents(user_id=None):
+    conn = get_connection()
+    if user_id:
+        rows = conn.execute(
+            "SELECT data FROM documents WHERE user_id = ? ORDER BY id", (str(user_id),)
+        ).fetchall()
+    else:
+        rows = conn.execute("SELECT data FROM documents ORDER BY id").fetchall()
+    return _rows_to_records(rows)
+
+
+def delete_document(conn, doc_id):
+    conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+
+
+# --- Blobs ---
+
+def acquire_blob(conn, digest, size):
+    """Add a reference to a stored file; True when this is the first one"""
+    row = conn.execute("SELECT refs FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+    if row:
+        conn.execute("UPDATE blobs SET refs = refs + 1 WHERE sha256 = ?", (digest,))
+        return False
+    conn.execute("INSERT INTO blobs (sha256, size, refs) VALUES (?, ?, 1)", (digest, size))
+    return True
+
+
+def release_blob(conn, digest):
+    """Drop a reference to a stored file; returns the references left"""
+    conn.execute("UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?", (digest,))
+    row = conn.execute("SELECT refs FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+    if row and row["refs"] > 0:
+        return row["refs"]
+    conn.execute("DELETE FROM blobs WHERE sha256 = ?", (digest,))
+    return 0
+
+
+def blob_refs(conn, digest):
+    row = conn.execute("SELECT refs FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+    return row["refs"] if row else 0
+
+
+# --- Resumable Uploads ---
+
+def save_upload(conn, session):
+    conn.execute(
+        "INSERT OR REPLACE INTO uploads (id, updated_at, data) VALUES (?, ?, ?)",
+        (session["id"], time.time(), _dump(session)),
+    )
+
+
+def get_upload(upload_id):
+    row = get_connection().execute(
+        "SELECT data FROM uploads WHERE id = ?", (upload_id,)
+    ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def advance_upload(conn, upload_id, offset, new_offset):
+    """Move a session from `offset` to `new_offset`; False if it is no longer at `offset`"""
+    cur = conn.execute(
+        "UPDATE uploads SET updated_at = ?, data = json_set(data, '$.offset', ?) "
+        "WHERE id = ? AND json_extract(data, '$.offset') = ?",
+        (time.time(), new_offset, upload_id, offset),
+    )
+    return cur.rowcount == 1
+
+
+def delete_upload(conn, upload_id):
+    conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+
+
+def expire_uploads(conn, before):
+    """Delete upload sessions last saved before the timestamp `before`; returns their ids"""
+    ids = [row["id"] for row in conn.execute("SELECT id FROM uploads WHERE updated_at < ?", (before,))]
+    conn.execute("DELETE FROM uploads WHERE updated_at < ?", (before,))
+    return ids
+
+
+# --- Background Jobs ---
+# A small persistent queue: jobs survive restarts, and a job whose worker died is handed
+# out again once its lease runs out.
+
+def enqueue_job(conn, kind, data):
+    cur = conn.execute(
+        "INSERT INTO jobs (kind, status, data) VALUES (?, 'pending', ?)", (kind, _dump(data))
+    )
+    return cur.lastrowid
+
+
+def claim_job(kinds, lease_seconds=300):
+    """Take the oldest runnable job of one of `kinds`, or None"""
+    now = time.time()
+    placeholders = ", ".join("?" for _ in kinds)
+    with transaction() as conn:
+        row = conn.execute(
+            f"SELECT id, kind, attempts, data FROM jobs WHERE kind IN ({placeholders}) AND "
+            "((status = 'pending' AND (run_after IS NULL OR run_after <= ?)) OR "
+            "(status = 'running' AND claimed_at < ?)) ORDER BY id LIMIT 1",
+            list(kinds) + [now, now - lease_seconds],
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+            (now, row["id"]),
+        )
+    return {"id": row["id"], "kind": row["kind"], "attempts": row["attempts"] + 1,
+            "data": json.loads(row["data"])}
+
+
+def update_job(conn, job_id, data):
+    """Save a running job's progress (renewing its lease) so a retry resumes there"""
+    conn.execute(
+        "UPDATE jobs SET data = ?, claimed_at = ? WHERE id = ?", (_dump(data), time.time(), job_id)
+    )
+
+
+def finish_job(job_id, status="done", error=None, retry_after=0):
+    """Drop a finished job, or mark it 'failed' (kept for inspection) or 'pending' to retry.
+
+    A pending job is not handed out again for `retry_after` seconds.
+    """
+    with transaction() as conn:
+        if status == "done":
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, claimed_at = NULL, run_after = ? WHERE id = ?",
+                (status, error, time.time() + retry_after if retry_after else None, job_id),
+            )
+
+
+# --- Notifications ---
+
+def insert_notifications(conn, records):
+    """Add notifications to their users' inboxes; assigns each record an `id`"""
+    for record in records:
+        cur = conn.execute(
+            "INSERT INTO notifications (user_id, data) VALUES (?, ?)",
+            (str(record["userId"]), _dump(record)),
+        )
+        record["id"] = cur.lastrowid
+    return records
+
+
+def list_notifications(user_id, limit=50, before=None, unread_only=False):
+    """A page of a user's inbox, newest first; pass the last id back as `before`"""
+    where, params = ["user_id = ?"], [str(user_id)]
+    if unread_only:
+        where.append("read = 0")
+    if before is not None:
+        where.append("id < ?")
+        params.append(before)
+    rows = get_connection().execute(
+        f"SELECT id, read, data FROM notifications WHERE {' AND '.join(where)} "
+        "ORDER BY id DESC LIMIT ?",
+        params + [limit],
+    ).fetchall()
+    return [_notification(row) for row in rows]
+
+
+def _notification(row):
+    record = json.loads(row["data"])
+    record["id"] = row["id"]
+    record["read"] = bool(row["read"])
+    return record
+
+
+def notifications_after(user_id, after, limit=50):
+    """A user's notifications with ids after `after`, oldest first"""
+    rows = get_connection().execute(
+        "SELECT id, read, data FROM notifications WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (str(user_id), after, limit),
+    ).fetchall()
+    return [_notification(row) for row in rows]
+
+
+def latest_notification_id(user_id):
+    return get_connection().execute(
+        "SELECT COALESCE(MAX(id), 0) FROM notifications WHERE user_id = ?", (str(user_id),)
+    ).fetchone()[0]
+
+
+def unread_notifications(user_id):
+    return get_connection().execute(
+        "SELECT COUNT(*) FROM notifications WHERE user_id = ? AND read = 0", (str(user_id),)
+    ).fetchone()[0]
+
+
+def mark_notifications_read(conn, user_id, ids=None):
+    """Mark some (or, without `ids`, all) of a user's notifications read"""
+    if ids is None:
+        cur = conn.execute(
+            "UPDATE notifications SET read = 1 WHERE user_id = ? AND read = 0", (str(user_id),)
+        )
+    else:
+        cur = conn.executemany(
+            "UPDATE notifications SET read = 1 WHERE user_id = ? AND id = ?",
+            [(str(user_id), int(i)) for i in ids],
+        )
+    return cur.rowcount
+
+
+# --- Reminders ---
+# Scheduled reminders ordered by the `due` index (a Unix timestamp), which serves as a
+# persistent priority queue: each tick range-scans only the rows that are already due.
+
+def replace_reminders(conn, user_id, reminders):
+    """Swap a user's scheduled reminders for `reminders`, a list of (due, data)"""
+    conn.execute("DELETE FROM reminders WHERE user_id = ?", (str(user_id),))
+    conn.executemany(
+        "INSERT INTO reminders (due, user_id, data) VALUES (?, ?, ?)",
+        [(due, str(user_id), _dump(data)) for due, data in reminders],
+    )
+
+
+def due_reminders(conn, now, limit=1000):
+    """The earliest reminders due at or before `now`, oldest first"""
+    rows = conn.execute(
+        "SELECT id, due, user_id, data FROM reminders WHERE due <= ? ORDER BY due LIMIT ?",
+        (now, limit),
+    ).fetchall()
+    records = []
+    for row in rows:
+        record = json.loads(row["data"])
+        record.update(id=row["id"], due=row["due"], userId=row["user_id"])
+        records.append(record)
+    return records
+
+
+def reschedule_reminders(conn, changes):
+    """Move reminders to new due times; `changes` is a list of (id, due)"""
+    conn.executemany("UPDATE reminders SET due = ? WHERE id = ?", [(due, i) for i, due in changes])
+
+
+def delete_reminders(conn, ids):
+    conn.executemany("DELETE FROM reminders WHERE id = ?", [(i,) for i in ids])
+
+
+def next_reminder_due():
+    """Due time of the earliest scheduled reminder, or None"""
+    return get_connection().execute("SELECT MIN(due) FROM reminders").fetchone()[0]
+
+
+# --- Users ---
+
+def _user_values(user):
+    return (
+        str(user["id"]),
+        user.get("phone"),
+        user.get("emp_id"),
+        user.get("role"),
+        _dump(user),
+    )
+
+
+def upsert_user(conn, user):
+    """Insert or replace a user, stamping the row with a new users version"""
+    version = next_id(conn, "users_version")
+    conn.execute(
+        "INSERT OR REPLACE INTO users (id, phone, emp_id, role, data, version) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        _user_values(user) + (version,),
+    )
+
+
+def insert_user(conn, user):
+    """Insert a new user; assigns `id` from the users sequence"""
+    user["id"] = str(next_id(conn, "users", "users"))
+    upsert_user(conn, user)
+    return user
+
+
+def find_user(field, value, conn=None):
+    """Look a user up through the phone or emp_id index"""
+    if field not in ("phone", "emp_id"):
+        raise ValueError(f"users are not indexed by {field}")
+    row = (conn or get_connection()).execute(
+        f"SELECT data FROM users WHERE {field} = ? ORDER BY CAST(id AS INTEGER) LIMIT 1", (value,)
+    ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def users_page(after=None, limit=1000):
+    """Up to `limit` users with ids after `after`, in id order, for walking the whole table"""
+    rows = get_connection().execute(
+        "SELECT data FROM users WHERE id > ? ORDER BY id LIMIT ?", (after or "", limit)
+    ).fetchall()
+    return _rows_to_records(rows)
+
+
+def users_changed_since(version):
+    """Users written after `version`, with the latest version seen.
+
+    Lets callers keep an in-memory copy of the users table in sync without rescanning it.
+    """
+    rows = get_connection().execute(
+        "SELECT version, data FROM users WHERE version > ? ORDER BY version", (version,)
+    ).fetchall()
+    latest = rows[-1]["version"] if rows else version
+    return latest, _rows_to_records(rows)
+
+
+# --- JSON Migration ---
+
+def _read_json(path):
+    try:
+        with open(path, "r") as f:
+            content = f.read().strip()
+        return json.loads(content) if content else None
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Skipping {path}: {e}")
+        return None
+
+
+def _merge_officials(data):
+    """Fold the legacy `officials` section into `users`, skipping emp_ids already present"""
+    users_map = dict(data.get("users", {}) or {})
+    known_emp_ids = {u.get("emp_id") for u in users_map.values() if u.get("emp_id")}
+    next_id = len(users_map) + 1
+    for off in (data.get("officials", {}) or {}).values():
+        if off.get("emp_id") and off.get("emp_id") in known_emp_ids:
+            continue
+        while str(next_id) in users_map:
+            next_id += 1
+        merged = dict(off)
+        merged["id"] = str(next_id)
+        merged["role"] = "official"
+        users_map[merged["id"]] = merged
+        known_emp_ids.add(merged.get("emp_id"))
+    return users_map
+
+
+def migrate_from_json(users_file=USERS_FILE, complaints_file=COMPLAINTS_FILE, docs_file=DOCS_FILE):
+    """Import the legacy JSON files once; later calls are no-ops"""
+    with transaction() as conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return False
+
+        users_data = _read_json(users_file)
+        if isinstance(users_data, dict):
+            for user_id, user in _merge_officials(users_data).items():
+                user.setdefault("id", user_id)
+                upsert_user(conn, user)
+
+        complaints_data = _read_json(complaints_file)
+        if isinstance(complaints_data, dict):
+            if isinstance(complaints_data.get("complaints"), list):
+                items = complaints_data["complaints"]
+            else:
+                # complaints.py writes a dict keyed by complaint id
+                items = list(complaints_data.values())
+            for record in items:
+                if isinstance(record, dict) and record.get("id"):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO complaints "
+                        "(id, user_id, username, sector, status, priority, created_at, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        _complaint_values(record),
+                    )
+
+        docs_data = _read_json(docs_file)
+        if isinstance(docs_data, dict):
+            for record in docs_data.get("documents", []):
+                if isinstance(record, dict) and record.get("id"):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO documents (id, user_id, data) VALUES (?, ?, ?)",
+                        (record["id"], str(record.get("user_id", "")), _dump(record)),
+                    )
+
+        rebuild_complaint_counts(conn)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+    return True
+
+
+def _add_missing_columns(conn):
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(users)")}
+    if "version" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(uploads)")}
+    if "updated_at" not in columns:
+        conn.execute("ALTER TABLE uploads ADD COLUMN updated_at REAL")
+        # Sessions already open get the full time to live from now
+        conn.execute("UPDATE uploads SET updated_at = ?", (time.time(),))
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "run_after" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN run_after REAL")
+
+
+def init_db():
+    """Create the schema and import the legacy JSON files on first run"""
+    conn = get_connection()
+    conn.executescript(SCHEMA)
+    with transaction():
+        _add_missing_columns(conn)
+    conn.executescript(LATE_INDEXES)
+    with transaction():
+        # Databases created before the dashboard counters existed need one backfill
+        if not conn.execute("SELECT 1 FROM meta WHERE key = 'complaint_counts_built'").fetchone():
+            rebuild_complaint_counts(conn)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('complaint_counts_built', '1')")
+    if migrate_from_json():
+        print(f"Imported legacy JSON data into {DB_PATH}")
+
+
+if __name__ == "__main__":
+    init_db()
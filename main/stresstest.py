@@ -0,0 +1,79 @@
+import http.client
+import json
+import multiprocessing
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+# Concurrency stress test for filing complaints, against a running server:
+#
+#   gunicorn -c gunicorn.conf.py asgi:app   &  python stresstest.py http://localhost:5000
+#
+# `processes` client processes each POST `per_process` complaints to /api/complaints at
+# once, all under one fresh user id. Passes when every request succeeded, every returned
+# id is distinct and GET /api/complaints counts exactly that many complaints for the user,
+# i.e. no write was lost and no id was handed out twice. Use a scratch DIGIGOV_DB: the
+# complaints it files are kept.
+
+
+def _request(conn, method, path, body=None):
+    payload = json.dumps(body).encode() if body is not None else None
+    conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read() or b"{}")
+
+
+def _client(args):
+    url, user_id, index, count = args
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    results = []
+    for i in range(count):
+        try:
+            status, body = _request(conn, "POST", "/api/complaints", {
+                "userId": user_id,
+                "sector": "Water",
+                "subject": f"Stress test {index}-{i}",
+                "description": f"Pipeline {index} burst near house {i} ({os.getpid()})",
+                "location": "Stress test",
+                "priority": "normal",
+            })
+            results.append((status, (body.get("complaint") or {}).get("id")))
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            conn.close()
+            results.append((str(e), None))
+    return results
+
+
+def run(url, processes=8, per_process=50):
+    user_id = f"stress-{int(time.time())}-{os.getpid()}"
+    started = time.perf_counter()
+    # Spawned, not forked: separate interpreters, as separate browsers would be
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        batches = pool.map(_client, [(url, user_id, i, per_process) for i in range(processes)])
+    elapsed = time.perf_counter() - started
+
+    results = [result for batch in batches for result in batch]
+    failed = [status for status, _ in results if status != 200]
+    ids = [complaint_id for status, complaint_id in results if status == 200]
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    _, listing = _request(conn, "GET", f"/api/complaints?user_id={user_id}&limit=1")
+    stored = listing.get("total")
+
+    total = processes * per_process
+    print(f"{total} complaints from {processes} processes in {elapsed:.1f}s "
+          f"({total / elapsed:.0f}/s): {len(failed)} failed, {len(set(ids))} distinct ids, "
+          f"{stored} stored for {user_id}")
+    ok = not failed and len(set(ids)) == len(ids) == total and stored == total
+    print("PASS" if ok else f"FAIL{': ' + repr(failed[:5]) if failed else ''}")
+    return ok
+
+
+if __name__ == "__main__":
+    # python stresstest.py <base url> [processes] [complaints per process]
+    if len(sys.argv) < 2:
+        print("usage: python stresstest.py <base url> [processes] [complaints per process]")
+        sys.exit(1)
+    sys.exit(0 if run(sys.argv[1], *(int(a) for a in sys.argv[2:4])) else 1)
@@ -0,0 +1,601 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import intents
+
+# Offline speech-to-text on CPU with Vosk (https://alphacephei.com/vosk/models).
+# The model is loaded once in each worker process when the pool starts; requests are
+# grouped into small batches so a burst of clips costs one round trip per worker.
+MODEL_PATH = os.environ.get("DIGIGOV_VOSK_MODEL", "models/vosk")
+WORKERS = int(os.environ.get("DIGIGOV_STT_WORKERS", "2"))
+BATCH_SIZE = int(os.environ.get("DIGIGOV_STT_BATCH_SIZE", "4"))
+# How long the batcher waits for more clips once it has one
+BATCH_WAIT_SECONDS = float(os.environ.get("DIGIGOV_STT_BATCH_WAIT_MS", "20")) / 1000
+# Clips allowed to wait for a worker before new ones are rejected
+QUEUE_LIMIT = int(os.environ.get("DIGIGOV_STT_QUEUE_LIMIT", "32"))
+REQUEST_TIMEOUT = float(os.environ.get("DIGIGOV_STT_TIMEOUT", "30"))
+
+SAMPLE_RATE = 16000
+MAX_AUDIO_SECONDS = 60
+FEED_BYTES = 8000  # 0.25 s of 16 kHz 16-bit mono per AcceptWaveform call
+
+# Clips up to this long are first tried against the command grammar only
+COMMAND_MAX_SECONDS = 2.5
+CACHE_SIZE = int(os.environ.get("DIGIGOV_STT_CACHE_SIZE", "2048"))
+CACHE_TTL_SECONDS = int(os.environ.get("DIGIGOV_STT_CACHE_TTL", "600"))
+
+
+class Unavailable(Exception):
+    """No model or decoder is installed; the API answers 503"""
+
+
+class Busy(Exception):
+    """Too many clips are waiting; the API answers 503"""
+
+
+# --- Worker Process Side ---
+_model = None
+_model_lock = threading.Lock()
+
+
+def _load_model(model_path):
+    global _model
+    from vosk import Model, SetLogLevel
+    SetLogLevel(-1)
+    _model = Model(model_path)
+
+
+def local_model():
+    """The model loaded in this process, for callers outside the pool (CLI, streaming)"""
+    with _model_lock:
+        if _model is None:
+            if not is_available():
+                raise Unavailable("Offline speech model is not installed")
+            _load_model(MODEL_PATH)
+    return _model
+
+
+def _ping():
+    return os.getpid()
+
+
+def recognize(model, pcm, grammar=None):
+    """Transcribe 16 kHz mono 16-bit PCM with a loaded model, optionally limited to a grammar"""
+    from vosk import KaldiRecognizer
+    if grammar:
+        recognizer = KaldiRecognizer(model, SAMPLE_RATE, grammar)
+    else:
+        recognizer = KaldiRecognizer(model, SAMPLE_RATE)
+    for start in range(0, len(pcm), FEED_BYTES):
+        recognizer.AcceptWaveform(pcm[start:start + FEED_BYTES])
+    return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+def _transcribe_batch(clips):
+    results = []
+    for pcm, grammar in clips:
+        try:
+            results.append({"text": recognize(_model, pcm, grammar)})
+        except Exception as e:
+            results.append({"error": str(e)})
+    return results
+
+
+# --- Audio Decoding ---
+
+def decode_audio(data):
+    """Turn an uploaded clip into 16 kHz mono 16-bit PCM.
+
+    16 kHz mono WAV is used as is; anything else (browser webm/ogg, mp3, other WAVs)
+    goes through ffmpeg when it is installed.
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) == (SAMPLE_RATE, 1, 2):
+                return wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        pass
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise Unavailable("ffmpeg is needed to decode this audio format")
+    proc = subprocess.run(
+        [ffmpeg, "-loglevel", "error", "-i", "pipe:0", "-t", str(MAX_AUDIO_SECONDS),
+         "-ar", str(SAMPLE_RATE), "-ac", "1", "-f", "s16le", "pipe:1"],
+        input=data, capture_output=True, timeout=REQUEST_TIMEOUT,
+    )
+    if proc.returncode != 0:
+        raise ValueError(proc.stderr.decode("utf-8", "replace").strip() or "Could not decode audio")
+    return proc.stdout
+
+
+# --- Request Side ---
+_executor = None
+_pending = None
+# One batch in flight per worker; while all are busy clips collect into bigger batches
+_worker_slots = threading.Semaphore(WORKERS)
+_start_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"completed": 0, "rejected": 0, "batches": 0, "total_seconds": 0.0, "restarts": 0}
+
+
+def is_available():
+    try:
+        import vosk  # noqa: F401
+    except ImportError:
+        return False
+    return os.path.isdir(MODEL_PATH)
+
+
+def _new_executor():
+    # Not fork: the pool may start after the server's threads are running
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=WORKERS, initializer=_load_model, initargs=(MODEL_PATH,),
+        mp_context=multiprocessing.get_context(method)
+    )
+
+
+def start():
+    """Start the worker pool and load the model in every worker; no-op without a model"""
+    global _executor, _pending
+    with _start_lock:
+        if _executor is not None or WORKERS <= 0 or not is_available():
+            return _executor is not None
+        _executor = _new_executor()
+        # Spawn every worker (and load its model) now rather than on the first request
+        for f in [_executor.submit(_ping) for _ in range(WORKERS)]:
+            f.result()
+        _pending = queue.Queue(maxsize=QUEUE_LIMIT)
+        threading.Thread(target=_batch_loop, name="stt-batcher", daemon=True).start()
+        return True
+
+
+def _restart_pool(broken):
+    """Replace a pool that lost a worker (crash, OOM kill); later batches go to the new one"""
+    global _executor
+    with _start_lock:
+        if _executor is broken:
+            print("Speech worker pool broke; starting a new one")
+            _executor = _new_executor()
+            broken.shutdown(wait=False)
+            with _stats_lock:
+                _stats["restarts"] += 1
+
+
+def _fail(batch, error):
+    for _, _, waiter in batch:
+        waiter.set_exception(error)
+
+
+def _batch_loop():
+    while True:
+        _worker_slots.acquire()
+        batch = [_pending.get()]
+        deadline = time.monotonic() + BATCH_WAIT_SECONDS
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            _dispatch(batch)
+        except Exception as e:
+            # The batcher must survive anything, or every later clip would wait forever
+            print("Speech batch error:", e)
+            _worker_slots.release()
+            _fail(batch, RuntimeError(f"Speech recognition failed: {e}"))
+
+
+def _dispatch(batch):
+    started = time.perf_counter()
+    clips = [(pcm, grammar) for pcm, grammar, _ in batch]
+    executor = _executor
+    try:
+        future = executor.submit(_transcribe_batch, clips)
+    except BrokenProcessPool:
+        _restart_pool(executor)
+        future = _executor.submit(_transcribe_batch, clips)
+
+    def deliver(done):
+        try:
+            results = done.result()
+        except Exception as e:
+            results = [{"error": str(e)}] * len(batch)
+            if isinstance(e, BrokenProcessPool):
+                # Rebuilt on the next submit, from the batcher thread
+                print("Speech worker died:", e)
+        with _stats_lock:
+            _stats["batches"] += 1
+            _stats["completed"] += len(batch)
+            _stats["total_seconds"] += time.perf_counter() - started
+        _worker_slots.release()
+        for (_, _, waiter), result in zip(batch, results):
+            if "error" in result:
+                waiter.set_exception(RuntimeError(result["error"]))
+            else:
+                waiter.set_result(result["text"])
+
+    future.add_done_callback(deliver)
+
+
+def transcribe_pcm(pcm, timeout=REQUEST_TIMEOUT, grammar=None):
+    """Queue PCM for the pool and wait for its transcript"""
+    if not start():
+        raise Unavailable("Offline speech model is not installed")
+    waiter = Future()
+    try:
+        _pending.put_nowait((pcm, grammar, waiter))
+    except queue.Full:
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise Busy("Too many voice requests in progress")
+    return waiter.result(timeout=timeout)
+
+
+# --- Transcript Cache ---
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._items.pop(key, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_cache = TTLCache(CACHE_SIZE, CACHE_TTL_SECONDS)
+
+
+def audio_key(pcm):
+    """Digest of the decoded 16 kHz mono PCM, so the same clip matches in any container
+    (a retried upload, or one re-sent as WAV instead of webm)"""
+    return hashlib.sha256(pcm).hexdigest()
+
+
+def transcribe(data, timeout=REQUEST_TIMEOUT):
+    """Transcribe an uploaded audio file; returns {"transcript", "intent"}.
+
+    Short clips are first recognized against the home-screen command grammar, which is
+    much cheaper than open recognition; only if that yields no command does the clip get
+    full recognition. Results are cached by audio_key.
+    """
+    pcm = decode_audio(data)[:MAX_AUDIO_SECONDS * SAMPLE_RATE * 2]
+    key = audio_key(pcm)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    result = None
+    if len(pcm) <= COMMAND_MAX_SECONDS * SAMPLE_RATE * 2:
+        text = transcribe_pcm(pcm, timeout, grammar=intents.GRAMMAR)
+        intent = intents.match(text)
+        if intent:
+            result = {"transcript": text, "intent": intent}
+    if result is None:
+        text = transcribe_pcm(pcm, timeout)
+        result = {"transcript": text, "intent": intents.match(text)}
+    _cache.put(key, result)
+    return result
+
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    snapshot["queue_depth"] = _pending.qsize() if _pending is not None else 0
+    snapshot["workers"] = WORKERS if _executor is not None else 0
+    snapshot["live_streams"] = len(_streams)
+    snapshot["cache_hits"] = _cache.hits
+    snapshot["cache_misses"] = _cache.misses
+    return snapshot
+
+
+# --- Streaming Sessions ---
+# Audio arrives in small raw PCM chunks while the user is still speaking; each chunk is fed
+# straight into a per-session recognizer and only the recognizer state is kept, never the
+# audio. A recognizer cannot leave the process that made it, so with several server
+# workers (gunicorn.conf.py sets DIGIGOV_STT_STREAM_SOCKET) one of them is elected stream
+# host by a file lock and holds every session; the others forward each call to it over
+# that Unix socket. If the host exits another worker takes over; its open sessions are
+# lost and their clients get "Voice session expired". Without the setting (python app.py)
+# sessions simply live in this process.
+STREAM_SOCKET = os.environ.get("DIGIGOV_STT_STREAM_SOCKET", "")
+STREAM_AUTHKEY = os.environ.get("DIGIGOV_STT_STREAM_KEY", "").encode() or None
+STREAM_CONNECT_SECONDS = 5
+STREAM_MAX_SESSIONS = int(os.environ.get("DIGIGOV_STT_MAX_STREAMS", "64"))
+STREAM_IDLE_SECONDS = 30
+STREAM_MAX_SECONDS = 120
+MAX_CHUNK_BYTES = 2 * SAMPLE_RATE * 2  # 2 s of audio per request
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def _expire_streams(now):
+    for stream_id, session in list(_streams.items()):
+        if now - session["last_seen"] > STREAM_IDLE_SECONDS:
+            del _streams[stream_id]
+
+
+def _open_local():
+    # Raises Unavailable (503) without vosk or a model, before vosk is imported
+    model = local_model()
+    from vosk import KaldiRecognizer
+    recognizer = KaldiRecognizer(model, SAMPLE_RATE)
+    now = time.monotonic()
+    with _streams_lock:
+        _expire_streams(now)
+        if len(_streams) >= STREAM_MAX_SESSIONS:
+            raise Busy("Too many live voice sessions")
+        stream_id = os.urandom(12).hex()
+        _streams[stream_id] = {
+            "recognizer": recognizer,
+            "segments": [],
+            "bytes": 0,
+            "last_seen": now,
+            "lock": threading.Lock(),
+        }
+    return stream_id
+
+
+def _get_stream(stream_id):
+    with _streams_lock:
+        session = _streams.get(stream_id)
+    if session is None:
+        raise KeyError(stream_id)
+    return session
+
+
+def _feed_local(stream_id, pcm):
+    if len(pcm) > MAX_CHUNK_BYTES:
+        raise ValueError(f"Chunks are limited to {MAX_CHUNK_BYTES} bytes")
+    session = _get_stream(stream_id)
+    with session["lock"]:
+        session["bytes"] += len(pcm)
+        if session["bytes"] > STREAM_MAX_SECONDS * SAMPLE_RATE * 2:
+            raise ValueError(f"Voice input is limited to {STREAM_MAX_SECONDS} seconds")
+        session["last_seen"] = time.monotonic()
+        recognizer = session["recognizer"]
+        if recognizer.AcceptWaveform(pcm):
+            # End of an utterance: commit it and start a fresh partial
+            text = json.loads(recognizer.Result()).get("text", "")
+            if text:
+                session["segments"].append(text)
+            partial = ""
+        else:
+            partial = json.loads(recognizer.PartialResult()).get("partial", "")
+        return {"text": " ".join(session["segments"]), "partial": partial}
+
+
+def _close_local(stream_id):
+    session = _get_stream(stream_id)
+    with session["lock"]:
+        text = json.loads(session["recognizer"].FinalResult()).get("text", "")
+        if text:
+            session["segments"].append(text)
+    with _streams_lock:
+        _streams.pop(stream_id, None)
+    return " ".join(session["segments"])
+
+
+# --- Stream Host ---
+# Exceptions that cross the socket; anything else arrives as RuntimeError
+_STREAM_ERRORS = {"Busy": Busy, "Unavailable": Unavailable, "KeyError": KeyError, "ValueError": ValueError}
+_STREAM_OPS = {"open": _open_local, "feed": _feed_local, "close": _close_local}
+_host_lock_file = None
+_client = threading.local()
+
+
+def _serve_connection(conn):
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", _STREAM_OPS[op](*args))
+            except Exception as e:
+                reply = ("error", type(e).__name__, e.args[0] if e.args else str(e))
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def _serve(listener):
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # A client that fails authentication; keep serving the rest
+            print("Voice stream host error:", e)
+            continue
+        threading.Thread(target=_serve_connection, args=(conn,), name="stt-stream-conn",
+                         daemon=True).start()
+
+
+def _try_become_host():
+    """Take the host lock if no live process holds it; True while this process is host"""
+    global _host_lock_file
+    import fcntl
+    from multiprocessing.connection import Listener
+    with _streams_lock:
+        if _host_lock_file is not None:
+            return True
+        f = open(STREAM_SOCKET + ".lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        # Left behind by a host that died
+        if os.path.exists(STREAM_SOCKET):
+            os.remove(STREAM_SOCKET)
+        listener = Listener(STREAM_SOCKET, family="AF_UNIX", authkey=STREAM_AUTHKEY)
+        os.chmod(STREAM_SOCKET, 0o600)  # only this user's processes may connect
+        threading.Thread(target=_serve, args=(listener,), name="stt-stream-host", daemon=True).start()
+        # Held open for the life of the process; the lock goes when the process does
+        _host_lock_file = f
+        print(f"Voice stream host: pid {os.getpid()} on {STREAM_SOCKET}")
+        return True
+
+
+def _connect():
+    from multiprocessing.connection import Client
+    deadline = time.monotonic() + STREAM_CONNECT_SECONDS
+    while True:
+        try:
+            return Client(STREAM_SOCKET, family="AF_UNIX", authkey=STREAM_AUTHKEY)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if _try_become_host():
+                return None
+            if time.monotonic() > deadline:
+                raise Unavailable("Voice stream host is not reachable")
+            time.sleep(0.05)  # the new host is still starting its listener
+
+
+def _stream_call(op, *args):
+    if not STREAM_SOCKET or _host_lock_file is not None:
+        return _STREAM_OPS[op](*args)
+    for attempt in range(2):
+        conn = getattr(_client, "conn", None)
+        if conn is None:
+            conn = _client.conn = _connect()
+            if conn is None:
+                return _STREAM_OPS[op](*args)  # this process just became host
+        try:
+            conn.send((op, args))
+            reply = conn.recv()
+            break
+        except (EOFError, OSError):
+            # The host went away; reconnect (or take over) and retry once
+            _client.conn = None
+            if attempt:
+                raise Unavailable("Voice stream host is not reachable")
+    if reply[0] == "ok":
+        return reply[1]
+    raise _STREAM_ERRORS.get(reply[1], RuntimeError)(reply[2])
+
+
+def open_stream():
+    """Start a streaming session and return its id"""
+    return _stream_call("open")
+
+
+def feed_stream(stream_id, pcm):
+    """Feed 16 kHz mono 16-bit PCM; returns the finished text so far and the current partial"""
+    return _stream_call("feed", stream_id, pcm)
+
+
+def close_stream(stream_id):
+    """Finish a session and return the full transcript"""
+    return _stream_call("close", stream_id)
+
+
+def _benchmark(path, seconds_list=(1, 3, 5, 10), concurrency=8, rounds=4):
+    """Requests/sec and mean latency for clips of several lengths cut from one recording"""
+    from concurrent.futures import ThreadPoolExecutor
+    with open(path, "rb") as f:
+        pcm = decode_audio(f.read())
+    if not start():
+        raise SystemExit("Offline speech model is not installed")
+    print(f"workers={WORKERS} batch={BATCH_SIZE} concurrency={concurrency}")
+    for seconds in seconds_list:
+        clip = pcm[:seconds * SAMPLE_RATE * 2]
+        total = concurrency * rounds
+        latencies = []
+
+        def one(_):
+            begin = time.perf_counter()
+            transcribe_pcm(clip, timeout=300)
+            latencies.append(time.perf_counter() - begin)
+
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - begin
+        print(f"{len(clip) / (SAMPLE_RATE * 2):5.1f}s audio: {total / elapsed:6.2f} req/s, "
+              f"mean latency {sum(latencies) / len(latencies) * 1000:7.1f} ms, "
+              f"max {max(latencies) * 1000:7.1f} ms")
+
+
+def _selftest():
+    """Check that a repeated clip is answered from the cache; needs no model"""
+    global transcribe_pcm
+    calls = []
+
+    def fake_recognizer(pcm, timeout=REQUEST_TIMEOUT, grammar=None):
+        calls.append(grammar)
+        return "complaints" if grammar else "open complaints"
+
+    def wav(pcm):
+        out = io.BytesIO()
+        with wave.open(out, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(pcm)
+        return out.getvalue()
+
+    real, transcribe_pcm = transcribe_pcm, fake_recognizer
+    try:
+        clip = os.urandom(SAMPLE_RATE * 2)  # 1 s, a fresh key on every run
+        first = transcribe(wav(clip))
+        assert len(calls) == 1, calls
+        assert transcribe(wav(clip)) == first and len(calls) == 1, "repeated clip reached the recognizer"
+        transcribe(wav(clip[:-2]))
+        assert len(calls) == 2, "a different clip was answered from the cache"
+    finally:
+        transcribe_pcm = real
+    print("ok: repeated clip served from the cache", stats()["cache_hits"], "hit(s)")
+
+
+if __name__ == "__main__":
+    # python transcription.py <audio file>            -> print transcript
+    # python transcription.py --benchmark <audio file> -> throughput by clip length
+    # python transcription.py --selftest              -> check the transcript cache
+    if len(sys.argv) == 3 and sys.argv[1] == "--benchmark":
+        _benchmark(sys.argv[2])
+    elif len(sys.argv) == 2 and sys.argv[1] == "--selftest":
+        _selftest()
+    elif len(sys.argv) == 2:
+        with open(sys.argv[1], "rb") as f:
+            print(transcribe(f.read()))
+    else:
+        print("usage: python transcription.py [--benchmark] <audio file> | --selftest")
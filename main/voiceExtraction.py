@@ -1,5 +1,7 @@
 import speech_recognition as sr
 
+import transcription
+
 def listen_and_convert():
     recognizer = sr.Recognizer()
     mic = sr.Microphone()
@@ -13,13 +15,16 @@ def listen_and_convert():
 
     try:
         print("📝 Recognizing...")
-        text = recognizer.recognize_google(audio)  # Uses Google Speech API
+        # Offline model, same one the server uses for /api/voice
+        pcm = audio.get_raw_data(convert_rate=transcription.SAMPLE_RATE, convert_width=2)
+        text = transcription.recognize(transcription.local_model(), pcm)
+        if not text:
+            print("❌ Sorry, could not understand audio")
+            return None
         print("You said:", text)
         return text
-    except sr.UnknownValueError:
-        print("❌ Sorry, could not understand audio")
-    except sr.RequestError as e:
-        print(f"⚠️ Could not request results; {e}")
+    except transcription.Unavailable as e:
+        print(f"⚠️ Could not recognize speech; {e}")
 
 if __name__ == "__main__":
     listen_and_convert()